@@ -16,6 +16,7 @@ import os
 import secrets
 import string
 import logging
+import time
 from datetime import datetime, timedelta
 
 # Cấu hình logging
@@ -31,8 +32,16 @@ from server.auth import (
     is_logged_in, login_required, get_user_by_id
 )
 from server.models import GameModel, MoveModel, UserModel, PveHighscoreModel
-from server.board import Board, create_board
-from server.ai import ChessAI, get_ai_move
+from server.board import Board, create_board, encode_move, decode_move
+from server.ai import ChessAI, CancelToken, get_ai_move
+from server.search_stats import STATS_REGISTRY
+from server.opening_book import OPENING_BOOK
+from server.opening_cache import OPENING_CACHE
+from server.tablebase import TABLEBASES
+from server.ponder import Ponderer
+from server.engine_pool import ENGINES_PER_WORKER, EnginePool
+from server.ai_manager import AIManager
+from server.scheduler import AIScheduler
 from config import config
 
 # Khởi tạo Flask app
@@ -55,7 +64,20 @@ else:
 # ============================================
 # In-memory storage cho các game đang chơi
 # ============================================
-ACTIVE_GAMES = {}  # game_id -> {'board': Board, 'players': {}, 'ai': ChessAI or None}
+ACTIVE_GAMES = {}  # game_id -> {'board': Board, 'players': {}, 'ai_level': str or None, 'seq': int, 'ai_thinking': bool}
+
+# ChessAI của các game PvE (LRU trong ngân sách bộ nhớ chung), lấy qua game_ai()
+AI_MANAGER = AIManager(
+    memory_budget=app.config.get('AI_MEMORY_BUDGET_MB', 256) * 1024 * 1024,
+    idle_seconds=app.config.get('AI_ENGINE_IDLE_SECONDS', 300)
+)
+
+# AI suy nghĩ nền trên giờ của người chơi (PvE)
+PONDERER = Ponderer(
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep,
+    max_concurrent=app.config.get('AI_PONDER_MAX_CONCURRENT', 2)
+)
 ROOM_TO_GAME = {}  # room_code -> game_id
 USER_SOCKETS = {}  # user_id -> socket_id
 WAITING_ROOMS = {}  # room_code -> {'host_id': int, 'host_color': str, 'players': {color: {user_id, username, ready}}, 'created_at': datetime}
@@ -63,6 +85,256 @@ WAITING_ROOMS = {}  # room_code -> {'host_id': int, 'host_color': str, 'players'
 # Timeout cho waiting room (30 phút)
 WAITING_ROOM_TIMEOUT = 30 * 60  # giây
 
+# Nước của AI được gửi sớm nhất sau chừng này giây (tính cả lúc suy nghĩ) để người chơi thấy rõ
+AI_REPLY_DELAY = 0.5
+
+# Tablebase cờ tàn của process web (worker / helper process nhận cùng cấu hình khi khởi động)
+TABLEBASES.configure(app.config.get('AI_TABLEBASE_DIR'), app.config.get('AI_TABLEBASE_PIECES', 0))
+
+# Hàng đợi + giới hạn số search nước đi của AI chạy cùng lúc
+AI_SCHEDULER = AIScheduler(
+    sleep=socketio.sleep,
+    max_running=app.config.get('AI_MAX_RUNNING_SEARCHES') or max(1, app.config.get('AI_ENGINE_WORKERS', 0)),
+    level_limits=app.config.get('AI_LEVEL_CONCURRENCY'),
+    max_queue=app.config.get('AI_QUEUE_MAX', 8),
+    max_wait=app.config.get('AI_JOB_MAX_WAIT', 10),
+    degraded_nodes=app.config.get('AI_DEGRADED_NODES', 3000),
+    max_degraded=app.config.get('AI_MAX_DEGRADED_SEARCHES', 4)
+)
+
+
+def get_engine_pool():
+    """Engine pool dùng chung (None nếu AI_ENGINE_WORKERS = 0), tạo khi AI đi nước đầu tiên"""
+    workers = app.config.get('AI_ENGINE_WORKERS', 0)
+    if workers <= 0:
+        return None
+    # Engine trong worker dùng chung ngân sách bộ nhớ với engine của process web
+    tt_entries = AI_MANAGER.reserve_workers(workers * ENGINES_PER_WORKER,
+                                            app.config.get('AI_ENGINE_MEMORY_SHARE', 0.5))
+    return EnginePool.get(workers, spawn=socketio.start_background_task, sleep=socketio.sleep,
+                          health_interval=app.config.get('AI_ENGINE_HEALTH_INTERVAL', 30),
+                          tt_entries=tt_entries)
+
+
+def ai_choose_move(game_id, ai, board, cancel_token=None, turn_started=None):
+    """
+    Nước đi của AI cho game: chờ tới lượt trong AI_SCHEDULER rồi search (hàng đợi đầy
+    hoặc chờ quá lâu thì search với node budget nhỏ); cancel_token bị hủy thì search dừng
+    ngay, kết quả (None hoặc nước dở dang) không được dùng
+    turn_started: thời điểm (monotonic) bắt đầu lượt của AI, để trừ thời gian đã chờ
+    """
+    return AI_SCHEDULER.run(game_id, ai.level, board,
+                            lambda node_limit: search_ai_move(game_id, ai, board, node_limit, cancel_token,
+                                                              turn_started),
+                            cancel_token=cancel_token)
+
+
+def ai_remaining_time(turn_started=None):
+    """
+    Thời gian còn lại của AI trong lượt này (giây): MOVE_TIME_LIMIT trừ thời gian đã qua từ
+    đầu lượt (chờ trong AI_SCHEDULER, ponder); server không giữ đồng hồ cả ván nên chỉ
+    tính theo giới hạn mỗi nước
+    """
+    limit = app.config.get('MOVE_TIME_LIMIT')
+    if limit is None or turn_started is None:
+        return limit
+    return max(0.0, limit - (time.monotonic() - turn_started))
+
+
+def search_ai_move(game_id, ai, board, node_limit=None, cancel_token=None, turn_started=None):
+    """
+    Search trong engine pool nếu bật (không chặn event loop), nếu tắt hoặc worker lỗi
+    thì search tại chỗ (cooperative mode: nhường event loop định kỳ)
+    """
+    remaining_time = ai_remaining_time(turn_started)
+    pool = get_engine_pool()
+    if pool:
+        move = pool.choose_move(game_id, ai, board, remaining_time, node_limit, cancel_token)
+        if move is not None or (cancel_token is not None and cancel_token.cancelled):
+            return move
+    
+    ai.cancel_token = cancel_token
+    if app.config.get('AI_COOPERATIVE'):
+        ai.yield_hook = lambda: socketio.sleep(0)
+        ai.yield_interval = app.config.get('AI_YIELD_INTERVAL', 0.01)
+    try:
+        return ai.choose_move(board, remaining_time=remaining_time, node_limit=node_limit)
+    finally:
+        ai.yield_hook = None
+        ai.cancel_token = None
+
+
+def game_ai(game_id, game_data):
+    """ChessAI của game PvE (engine mới, TT trống nếu engine cũ đã bị AI_MANAGER bỏ)"""
+    return AI_MANAGER.get_ai(game_id, game_data['ai_level'], game_data['ai_color'])
+
+
+def next_move_seq(game_data):
+    """Số thứ tự của nước đi sắp broadcast trong game (client áp dụng move_made theo đúng thứ tự)"""
+    game_data['seq'] = game_data.get('seq', 0) + 1
+    return game_data['seq']
+
+
+def start_ai_reply(game_id, human_move=None):
+    """
+    AI trả lời trong task nền, handler gửi nước của người chơi đi ngay không chờ search;
+    trong lúc đó game_data['ai_thinking'] = True, nước người chơi gửi tới bị từ chối
+    """
+    game_data = ACTIVE_GAMES[game_id]
+    cancel_token = CancelToken()
+    game_data['ai_thinking'] = True
+    game_data['cancel_token'] = cancel_token
+    socketio.start_background_task(ai_reply_task, game_id, game_data, cancel_token, human_move,
+                                   time.monotonic())
+
+
+def ai_reply_task(game_id, game_data, cancel_token, human_move=None, turn_started=None):
+    """
+    Task nền: search nước của AI, áp dụng, lưu và broadcast (move_made kèm seq); kết quả bị bỏ
+    nếu search bị hủy (cancel_ai_search) hoặc game đã kết thúc trong lúc AI suy nghĩ
+    
+    Args:
+        cancel_token: CancelToken của lần trả lời này (game_data['cancel_token'])
+        human_move: nước người chơi vừa đi (số nguyên) để dùng kết quả ponder, None = không ponder
+        turn_started: thời điểm (monotonic) bắt đầu lượt của AI (None = lúc task chạy)
+    """
+    started = turn_started or time.monotonic()
+    try:
+        ai = game_ai(game_id, game_data)
+        board = game_data['board']
+        room_code = game_data['room_code']
+        room = f"game_{room_code}"
+        
+        # Ponder hit thì đã có sẵn nước trả lời, miss thì search bình thường (TT đã ấm);
+        # human_move = None: chỉ chờ ponder cũ (vd đã bị hủy khi mất kết nối) thoát khỏi AI
+        ai_move = PONDERER.finish(game_id, human_move, cancel_token)
+        if ai_move is None and not cancel_token.cancelled:
+            ai_move = ai_choose_move(game_id, ai, board, cancel_token, started)
+        if cancel_token.cancelled:
+            return
+        
+        socketio.sleep(max(0.0, AI_REPLY_DELAY - (time.monotonic() - started)))
+        if cancel_token.cancelled or ACTIVE_GAMES.get(game_id) is not game_data or game_data.get('ended'):
+            return
+        
+        # Search lỗi / nước không hợp lệ: đi nước hợp lệ đầu tiên thay vì để ván treo ở lượt AI
+        checked_move = ai.fallback_move(board, ai_move)
+        if checked_move != ai_move:
+            logger.error(f"[ai_reply] game {game_id}: nước AI không hợp lệ ({ai_move}), "
+                         f"đi nước dự phòng ({checked_move})")
+            ai_move = checked_move
+        if ai_move is None:
+            # AI không còn nước hợp lệ: ván đã kết thúc
+            end_ai_game(game_id, game_data, board)
+            return
+        
+        ai_fr, ai_fc, ai_tr, ai_tc = decode_move(ai_move)
+        ai_success, ai_msg, ai_captured = board.move(ai_fr, ai_fc, ai_tr, ai_tc)
+        if not ai_success:
+            logger.error(f"[ai_reply] game {game_id}: nước AI không hợp lệ ({ai_msg})")
+            return
+        game_data['ai_thinking'] = False
+        game_data['cancel_token'] = None
+        
+        # Lưu nước đi AI
+        human_color = 'red' if game_data['ai_color'] == 'black' else 'black'
+        ai_piece = board.get_piece(ai_tr, ai_tc)
+        MoveModel.save(
+            game_id=game_id,
+            move_number=len(board.move_history),
+            player=game_data['ai_color'],
+            from_row=ai_fr, from_col=ai_fc,
+            to_row=ai_tr, to_col=ai_tc,
+            piece_type=ai_piece['type'] if ai_piece else 'P',
+            captured_piece=ai_captured['type'] if ai_captured else None,
+            is_check=board.is_in_check(human_color)
+        )
+        GameModel.update_board_state(game_id, board.to_dict())
+        
+        # Gửi nước đi AI
+        socketio.emit("move_made", {
+            "from_row": ai_fr,
+            "from_col": ai_fc,
+            "to_row": ai_tr,
+            "to_col": ai_tc,
+            "player": game_data['ai_color'],
+            "piece": ai_piece,  # Thông tin quân AI đã di chuyển
+            "captured": ai_captured,  # Thông tin quân bị AI ăn
+            "board": board.to_dict(),
+            "is_ai": True,
+            "seq": next_move_seq(game_data)
+        }, to=room)
+        
+        # Kiểm tra kết thúc sau nước AI
+        if not end_ai_game(game_id, game_data, board):
+            # Suy nghĩ trước trong lúc chờ người chơi (chỉ khi search chạy trong process web:
+            # với engine pool, search dùng TT của worker nên ponder ở đây không giúp gì)
+            if not get_engine_pool():
+                PONDERER.start(game_id, ai, board)
+    except Exception:
+        logger.exception(f"[ai_reply] Lỗi khi AI đi (game {game_id})")
+    finally:
+        # Bị hủy rồi có lần trả lời mới (người chơi vào lại) thì trạng thái thuộc về lần mới
+        if game_data.get('cancel_token') is cancel_token:
+            game_data['ai_thinking'] = False
+            game_data['cancel_token'] = None
+
+
+def end_ai_game(game_id, game_data, board):
+    """
+    Kết thúc game AI nếu board đã ở trạng thái kết thúc: lưu kết quả, broadcast game_over,
+    giải phóng AI và xóa game khỏi ACTIVE_GAMES
+    
+    Returns:
+        True nếu game đã kết thúc
+    """
+    game_state = board.get_game_state()
+    if game_state == 'playing':
+        return False
+    winner = 'red' if game_state == 'red_wins' else 'black' if game_state == 'black_wins' else None
+    room_code = game_data['room_code']
+    
+    # Đánh dấu đã kết thúc
+    game_data['ended'] = True
+    
+    GameModel.end_game(game_id, winner or 'draw', board.end_reason)
+    socketio.emit("game_over", {"winner": winner, "reason": board.end_reason}, to=f"game_{room_code}")
+    release_game_ai(game_id)
+    
+    if game_id in ACTIVE_GAMES:
+        del ACTIVE_GAMES[game_id]
+    if room_code in ROOM_TO_GAME:
+        del ROOM_TO_GAME[room_code]
+    return True
+
+
+def cancel_ai_search(game_id, reason):
+    """Hủy lần trả lời của AI đang chờ / đang search trong game (nếu có), CPU được trả lại sau vài ms"""
+    game_data = ACTIVE_GAMES.get(game_id)
+    cancel_token = game_data.get('cancel_token') if game_data else None
+    if cancel_token is not None and not cancel_token.cancelled:
+        cancel_token.cancel(reason)
+        logger.info(f"[ai] Hủy search của game {game_id}: {reason}")
+
+
+def resume_ai_turn(game_id):
+    """Game PvE đang tới lượt AI nhưng không có lần trả lời nào chạy (vd đã hủy khi mất kết nối): AI đi tiếp"""
+    game_data = ACTIVE_GAMES.get(game_id)
+    if (game_data and game_data['game_type'] == 'pve' and game_data.get('ai_level')
+            and not game_data.get('ended') and not game_data.get('ai_thinking')
+            and game_data['board'].turn == game_data['ai_color']):
+        start_ai_reply(game_id)
+
+
+def release_game_ai(game_id, reason='game_end'):
+    """Game kết thúc: hủy search đang chạy, dừng ponder, bỏ engine của game (process web và pool)"""
+    cancel_ai_search(game_id, reason)
+    PONDERER.cancel(game_id)
+    AI_MANAGER.remove_ai(game_id)
+    pool = get_engine_pool()
+    if pool:
+        pool.release(game_id)
+
 
 def cleanup_old_waiting_rooms():
     """Xóa các waiting room quá 30 phút"""
@@ -585,13 +857,12 @@ def api_create_game():
         # Tạo board và lưu vào memory
         board = create_board()
         ai_color = 'black' if player_color == 'red' else 'red'
-        ai_instance = ChessAI(level=ai_difficulty, color=ai_color)
         
         ACTIVE_GAMES[game_id] = {
             'board': board,
             'room_code': room_code,
             'game_type': game_type,
-            'ai': ai_instance,
+            'ai_level': ai_difficulty,
             'ai_color': ai_color,
             'players': {
                 'red': {'user_id': red_player_id, 'socket_id': None, 'name': red_player_name},
@@ -600,12 +871,9 @@ def api_create_game():
         }
         ROOM_TO_GAME[room_code] = game_id
         
-        # Nếu AI đi trước (người chơi chọn đen)
+        # Nếu AI đi trước (người chơi chọn đen): trả lời ngay, AI đi trong task nền
         if player_color == 'black':
-            ai_move = ai_instance.choose_move(board)
-            if ai_move:
-                fr, fc, tr, tc = ai_move
-                board.move(fr, fc, tr, tc)
+            start_ai_reply(game_id)
     else:
         # PvP: Tạo waiting room
         WAITING_ROOMS[room_code] = {
@@ -747,6 +1015,149 @@ def api_get_moves(game_id):
     return jsonify({"ok": True, "moves": moves or []})
 
 
+# ChessAI rảnh dùng cho phân tích theo level (dùng lại cả TT giữa các lần phân tích)
+ANALYSIS_AIS = {"medium": [], "hard": []}
+
+
+def acquire_analysis_ai(level):
+    """Lấy 1 ChessAI phân tích đang rảnh của level, hết thì tạo mới (trả lại ANALYSIS_AIS sau khi dùng)"""
+    idle = ANALYSIS_AIS[level]
+    if idle:
+        return idle.pop()
+    ai = ChessAI(level=level, color='red')
+    ai.verbose = False
+    ai.yield_hook = lambda: socketio.sleep(0)
+    ai.yield_interval = app.config.get('AI_YIELD_INTERVAL', 0.01)
+    return ai
+
+
+def analyze_position(data):
+    """
+    Phân tích multi-PV cho vị trí lấy từ data["fen"] hoặc bàn cờ của data["room_code"]
+    
+    Returns:
+        (result, None) hoặc (None, thông báo lỗi)
+    """
+    fen = data.get("fen") or ""
+    room_code = data.get("room_code") or ""
+    if not isinstance(fen, str) or not isinstance(room_code, str):
+        return None, "Dữ liệu không hợp lệ"
+    fen = fen.strip()
+    room_code = room_code.strip().upper()
+    level = data.get("level", "hard")
+    if level not in ("medium", "hard"):
+        level = "hard"
+    
+    try:
+        num_pv = int(data.get("num_pv", 3))
+    except (TypeError, ValueError):
+        num_pv = 3
+    num_pv = max(1, min(num_pv, app.config.get('AI_ANALYSIS_MAX_PV', 5)))
+    
+    if fen:
+        try:
+            board = Board.from_fen(fen)
+        except ValueError:
+            return None, "FEN không hợp lệ"
+        if not board.find_king('red') or not board.find_king('black'):
+            return None, "FEN không hợp lệ"
+    elif room_code:
+        game_id = ROOM_TO_GAME.get(room_code)
+        if not game_id or game_id not in ACTIVE_GAMES:
+            return None, "Game không tồn tại"
+        board = ACTIVE_GAMES[game_id]['board'].clone()
+    else:
+        return None, "Thiếu fen hoặc room_code"
+    
+    if not board.legal_moves(board.turn):
+        return None, "Không còn nước đi"
+    
+    # Chạy qua AI_SCHEDULER với ưu tiên thấp nhất: không chen trước nước đi của các game PvE
+    ai = acquire_analysis_ai(level)
+    try:
+        result = AI_SCHEDULER.run(None, 'analysis', board, lambda node_limit: ai.analyze(
+            board, num_pv=num_pv, time_limit=app.config.get('AI_ANALYSIS_TIME_LIMIT', 3),
+            node_limit=node_limit))
+    finally:
+        ANALYSIS_AIS[level].append(ai)
+    
+    # Search dùng nước đi dạng số nguyên, đổi sang [fr, fc, tr, tc] cho client
+    for line in result['lines']:
+        move = decode_move(line['move'])
+        line['notation'] = ai.get_move_notation(board, *move)
+        line['move'] = list(move)
+        line['pv'] = [list(decode_move(pv_move)) for pv_move in line['pv']]
+    result['fen'] = board.to_fen()
+    return result, None
+
+
+@app.route("/api/analyze", methods=["POST"])
+def api_analyze():
+    """
+    API phân tích vị trí (gợi ý nước đi / xem lại ván)
+    
+    Body JSON:
+    {
+        "fen": "rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w",
+        hoặc "room_code": "ABC123",
+        "num_pv": 3,
+        "level": "hard"
+    }
+    """
+    if not is_logged_in():
+        return jsonify({"ok": False, "message": "Chưa đăng nhập"})
+    
+    data = request.get_json(silent=True)
+    result, error = analyze_position(data if isinstance(data, dict) else {})
+    if error:
+        return jsonify({"ok": False, "message": error})
+    return jsonify({"ok": True, **result})
+
+
+@app.route("/api/ai/stats")
+def api_ai_stats():
+    """API thống kê search của AI (cộng dồn mọi game từ lúc server chạy, theo level)"""
+    if not is_logged_in():
+        return jsonify({"ok": False, "message": "Chưa đăng nhập"})
+    
+    return jsonify({"ok": True, "levels": STATS_REGISTRY.snapshot(), "opening_cache": OPENING_CACHE.snapshot(),
+                    "opening_book": OPENING_BOOK.snapshot(), "tablebase": TABLEBASES.snapshot()})
+
+
+@app.route("/api/ai/health")
+def api_ai_health():
+    """API health check của engine pool (kiểm tra ngay, khởi động lại worker lỗi)"""
+    if not is_logged_in():
+        return jsonify({"ok": False, "message": "Chưa đăng nhập"})
+    
+    pool = get_engine_pool()
+    if not pool:
+        return jsonify({"ok": True, "enabled": False})
+    return jsonify({"ok": True, "enabled": True, **pool.check_health()})
+
+
+@app.route("/api/ai/memory")
+def api_ai_memory():
+    """
+    API bộ nhớ ước tính của các ChessAI trong process web (số engine, entry TT, ngân sách)
+    và của engine trong các worker của engine pool (nếu bật)
+    """
+    if not is_logged_in():
+        return jsonify({"ok": False, "message": "Chưa đăng nhập"})
+    
+    pool = get_engine_pool()
+    return jsonify({"ok": True, **AI_MANAGER.memory(), "engine_pool": pool.memory() if pool else None})
+
+
+@app.route("/api/ai/scheduler")
+def api_ai_scheduler():
+    """API số liệu hàng đợi search của AI (độ sâu hàng đợi, thời gian chờ theo level)"""
+    if not is_logged_in():
+        return jsonify({"ok": False, "message": "Chưa đăng nhập"})
+    
+    return jsonify({"ok": True, **AI_SCHEDULER.snapshot()})
+
+
 # ============================================
 # SOCKET.IO EVENTS - Real-time gameplay
 # ============================================
@@ -774,6 +1185,14 @@ def on_disconnect():
             logger.info(f"[disconnect] Found user_id={user_id} for socket={request.sid}")
             break
     
+    # Game PvE của socket này: dừng search / ponder của AI, vào lại thì AI đi tiếp (resume_ai_turn)
+    for game_id, game_data in list(ACTIVE_GAMES.items()):
+        if game_data['game_type'] != 'pve':
+            continue
+        if any(player.get('socket_id') == request.sid for player in game_data['players'].values()):
+            cancel_ai_search(game_id, 'disconnect')
+            PONDERER.cancel(game_id)
+    
     # Tìm user trong waiting rooms bằng socket_id nếu không tìm thấy user_id
     for room_code, waiting_room in list(WAITING_ROOMS.items()):
         for color, player in list(waiting_room.get('players', {}).items()):
@@ -875,11 +1294,16 @@ def on_join_game(data):
                 game_data['players'][color]['socket_id'] = request.sid
                 break
         
+        # Vào lại đúng lượt AI mà search đã bị hủy (mất kết nối): AI đi tiếp
+        resume_ai_turn(game_id)
+        
         # Gửi trạng thái hiện tại cho client (bao gồm thông tin players)
         emit("game_state", {
             "board": board.to_dict(),
             "room_code": room_code,
             "game_id": game_id,
+            "seq": game_data.get('seq', 0),
+            "ai_thinking": game_data.get('ai_thinking', False),
             "players": {
                 "red": {"name": game_data['players']['red'].get('name', 'Người chơi Đỏ')},
                 "black": {"name": game_data['players']['black'].get('name', 'Người chơi Đen')}
@@ -923,7 +1347,7 @@ def on_join_game(data):
                 'board': board,
                 'room_code': room_code,
                 'game_type': game['game_type'],
-                'ai': ChessAI(level=ai_diff, color=ai_color) if game['game_type'] == 'pve' and ai_color else None,
+                'ai_level': ai_diff if game['game_type'] == 'pve' and ai_color else None,
                 'ai_color': ai_color,
                 'players': {
                     'red': {'user_id': game['red_player_id'], 'socket_id': request.sid if game['red_player_id'] == user_id else None, 'name': red_name},
@@ -931,11 +1355,14 @@ def on_join_game(data):
                 }
             }
             ROOM_TO_GAME[room_code] = game_id
+            resume_ai_turn(game_id)
             
             emit("game_state", {
                 "board": board.to_dict(),
                 "room_code": room_code,
                 "game_id": game_id,
+                "seq": 0,
+                "ai_thinking": ACTIVE_GAMES[game_id].get('ai_thinking', False),
                 "players": {
                     "red": {"name": red_name},
                     "black": {"name": black_name}
@@ -999,6 +1426,11 @@ def on_make_move(data):
         emit("move_error", {"message": "Game đã kết thúc"})
         return
     
+    # AI đang suy nghĩ: từ chối ngay, không đụng tới bàn cờ
+    if game_data.get('ai_thinking'):
+        emit("move_error", {"message": "AI đang suy nghĩ", "code": "ai_thinking", "seq": game_data.get('seq', 0)})
+        return
+    
     board = game_data['board']
     
     # Validate: Kiểm tra player_color có khớp với user trong session không
@@ -1052,7 +1484,8 @@ def on_make_move(data):
         "player": player_color,
         "piece": piece,  # Thông tin quân cờ đã di chuyển
         "captured": captured,  # Thông tin quân bị ăn (nếu có)
-        "board": board.to_dict()
+        "board": board.to_dict(),
+        "seq": next_move_seq(game_data)
     }
     logger.debug(f"[make_move] Emitting move_made to room {room}, turn is now {board.turn}")
     emit("move_made", move_data, to=room)
@@ -1069,8 +1502,9 @@ def on_make_move(data):
         # Đánh dấu đã kết thúc để tránh race condition
         game_data['ended'] = True
         
-        GameModel.end_game(game_id, winner or 'draw', 'checkmate' if winner else 'stalemate')
-        emit("game_over", {"winner": winner, "reason": game_state}, to=room)
+        GameModel.end_game(game_id, winner or 'draw', board.end_reason)
+        emit("game_over", {"winner": winner, "reason": board.end_reason}, to=room)
+        release_game_ai(game_id)
         
         # Cleanup
         if game_id in ACTIVE_GAMES:
@@ -1079,64 +1513,31 @@ def on_make_move(data):
             del ROOM_TO_GAME[room_code]
         return
     
-    # Nếu là PvE, AI đi tiếp
+    # Nếu là PvE, AI đi tiếp (trong task nền, nước của người chơi đã được gửi đi)
     if game_data['game_type'] == 'pve' and board.turn == game_data['ai_color']:
-        ai = game_data['ai']
-        ai_move = ai.choose_move(board)
-        
-        if ai_move:
-            ai_fr, ai_fc, ai_tr, ai_tc = ai_move
-            ai_success, ai_msg, ai_captured = board.move(ai_fr, ai_fc, ai_tr, ai_tc)
-            
-            if ai_success:
-                # Lưu nước đi AI
-                ai_piece = board.get_piece(ai_tr, ai_tc)
-                ai_move_number = len(board.move_history)
-                MoveModel.save(
-                    game_id=game_id,
-                    move_number=ai_move_number,
-                    player=game_data['ai_color'],
-                    from_row=ai_fr, from_col=ai_fc,
-                    to_row=ai_tr, to_col=ai_tc,
-                    piece_type=ai_piece['type'] if ai_piece else 'P',
-                    captured_piece=ai_captured['type'] if ai_captured else None,
-                    is_check=board.is_in_check(player_color)
-                )
-                
-                GameModel.update_board_state(game_id, board.to_dict())
-                
-                # Gửi nước đi AI
-                ai_move_data = {
-                    "from_row": ai_fr,
-                    "from_col": ai_fc,
-                    "to_row": ai_tr,
-                    "to_col": ai_tc,
-                    "player": game_data['ai_color'],
-                    "piece": ai_piece,  # Thông tin quân AI đã di chuyển
-                    "captured": ai_captured,  # Thông tin quân bị AI ăn
-                    "board": board.to_dict(),
-                    "is_ai": True
-                }
-                
-                # Delay nhỏ để người chơi thấy rõ
-                socketio.sleep(0.5)
-                emit("move_made", ai_move_data, to=room)
-                
-                # Kiểm tra kết thúc sau nước AI
-                game_state = board.get_game_state()
-                if game_state != 'playing':
-                    winner = 'red' if game_state == 'red_wins' else 'black' if game_state == 'black_wins' else None
-                    
-                    # Đánh dấu đã kết thúc
-                    game_data['ended'] = True
-                    
-                    GameModel.end_game(game_id, winner or 'draw', 'checkmate' if winner else 'stalemate')
-                    emit("game_over", {"winner": winner, "reason": game_state}, to=room)
-                    
-                    if game_id in ACTIVE_GAMES:
-                        del ACTIVE_GAMES[game_id]
-                    if room_code in ROOM_TO_GAME:
-                        del ROOM_TO_GAME[room_code]
+        start_ai_reply(game_id, encode_move(fr, fc, tr, tc))
+
+
+@socketio.on("analyze")
+def on_analyze(data):
+    """
+    Phân tích vị trí, trả kết quả qua event "analysis_result" (xem api_analyze)
+    
+    Data:
+    {
+        "fen": "..." hoặc "room_code": "ABC123",
+        "num_pv": 3
+    }
+    """
+    if not is_logged_in():
+        emit("analysis_error", {"message": "Chưa đăng nhập"})
+        return
+    
+    result, error = analyze_position(data if isinstance(data, dict) else {})
+    if error:
+        emit("analysis_error", {"message": error})
+        return
+    emit("analysis_result", result)
 
 
 @socketio.on("resign")
@@ -1162,6 +1563,7 @@ def on_resign(data):
     winner = 'black' if player_color == 'red' else 'red'
     GameModel.end_game(game_id, winner, 'resign')
     emit("game_over", {"winner": winner, "reason": "resign"}, to=room)
+    release_game_ai(game_id, 'resign')
     
     if game_id in ACTIVE_GAMES:
         del ACTIVE_GAMES[game_id]
@@ -1201,6 +1603,7 @@ def on_timeout(data):
     
     GameModel.end_game(game_id, winner, 'timeout')
     emit("game_over", {"winner": winner, "reason": "timeout"}, to=room)
+    release_game_ai(game_id, 'timeout')
     
     if game_id in ACTIVE_GAMES:
         del ACTIVE_GAMES[game_id]
@@ -1214,48 +1617,23 @@ def on_skip_turn(data):
     Lưu ý: Với logic mới, AI không bị timeout nên hàm này hiếm khi được gọi
     """
     room_code = data.get("room_code")
-    room = f"game_{room_code}"
     game_id = ROOM_TO_GAME.get(room_code)
     
     if game_id and game_id in ACTIVE_GAMES:
         game_data = ACTIVE_GAMES[game_id]
         board = game_data['board']
         
-        if game_data['game_type'] == 'pve' and game_data['ai']:
-            # Chuyển lượt sang AI
-            board.turn = game_data['ai_color']
+        if game_data['game_type'] == 'pve' and game_data['ai_level']:
+            if game_data.get('ai_thinking') or game_data.get('ended'):
+                return
             
-            # AI đi
-            ai = game_data['ai']
-            ai_move = ai.choose_move(board)
+            # Dừng ponder (nếu có) trước khi dùng lại AI
+            PONDERER.finish(game_id, None)
             
-            if ai_move:
-                from_row, from_col, to_row, to_col = ai_move
-                success, msg, captured = board.move(from_row, from_col, to_row, to_col)
-                
-                if success:
-                    piece = board.get_piece(to_row, to_col)
-                    GameModel.update_board_state(game_id, board.to_dict())
-                    
-                    ai_move_data = {
-                        "from_row": from_row,
-                        "from_col": from_col,
-                        "to_row": to_row,
-                        "to_col": to_col,
-                        "player": game_data['ai_color'],
-                        "piece": piece,
-                        "captured": captured,
-                        "board": board.to_dict(),
-                        "is_ai": True
-                    }
-                    emit("move_made", ai_move_data, to=room)
-                    
-                    # Kiểm tra chiến thắng
-                    game_state = board.get_game_state()
-                    if game_state != 'playing':
-                        winner = 'red' if game_state == 'red_wins' else 'black' if game_state == 'black_wins' else None
-                        GameModel.end_game(game_id, winner or 'draw', 'checkmate' if winner else 'stalemate')
-                        emit("game_over", {"winner": winner, "reason": game_state}, to=room)
+            # Chuyển lượt sang AI, AI đi trong task nền
+            if board.turn != game_data['ai_color']:
+                board.pass_turn()
+            start_ai_reply(game_id)
 
 
 @socketio.on("offer_draw")
@@ -1286,6 +1664,7 @@ def on_accept_draw(data):
     
     GameModel.end_game(game_id, 'draw', 'draw_agreement')
     emit("game_over", {"winner": None, "reason": "draw"}, to=room)
+    release_game_ai(game_id, 'draw')
     
     if game_id in ACTIVE_GAMES:
         del ACTIVE_GAMES[game_id]
@@ -1554,7 +1933,7 @@ def on_start_game(data):
         'board': board,
         'room_code': room_code,
         'game_type': 'pvp',
-        'ai': None,
+        'ai_level': None,
         'ai_color': None,
         'players': {
             'red': {
@@ -57,6 +57,51 @@ class Config:
         'hard': 4       # Độ sâu 4 - Khó
     }
     
+    # Số search nền (ponder trên giờ người chơi PvE) chạy cùng lúc tối đa
+    AI_PONDER_MAX_CONCURRENT = int(os.environ.get('AI_PONDER_MAX_CONCURRENT', 2))
+    
+    # Phân tích multi-PV (gợi ý nước đi, xem lại ván): số line tối đa và thời gian mỗi lần
+    AI_ANALYSIS_MAX_PV = int(os.environ.get('AI_ANALYSIS_MAX_PV', 5))
+    AI_ANALYSIS_TIME_LIMIT = float(os.environ.get('AI_ANALYSIS_TIME_LIMIT', 3))
+    
+    # Tablebase cờ tàn (tạo bằng python -m server.tablebase): thư mục (rỗng = không dùng) và
+    # số quân tối đa để tra (0 = theo bộ quân lớn nhất trong thư mục)
+    AI_TABLEBASE_DIR = os.environ.get('AI_TABLEBASE_DIR', '')
+    AI_TABLEBASE_PIECES = int(os.environ.get('AI_TABLEBASE_PIECES', 0))
+    
+    # Engine pool: số worker process search nước đi của AI (0 = search ngay trong
+    # process web, chặn event loop trong lúc AI suy nghĩ) và chu kỳ health check (giây)
+    AI_ENGINE_WORKERS = int(os.environ.get('AI_ENGINE_WORKERS', 0))
+    AI_ENGINE_HEALTH_INTERVAL = float(os.environ.get('AI_ENGINE_HEALTH_INTERVAL', 30))
+    
+    # Cooperative mode (khi không dùng engine pool): search trong process web nhưng nhường
+    # event loop ít nhất mỗi AI_YIELD_INTERVAL giây để các game / request khác vẫn chạy
+    AI_COOPERATIVE = os.environ.get('AI_COOPERATIVE', '1') == '1'
+    AI_YIELD_INTERVAL = float(os.environ.get('AI_YIELD_INTERVAL', 0.01))
+    
+    # Scheduler search của AI: số search chạy cùng lúc (0 = bằng số worker của engine pool,
+    # tối thiểu 1), giới hạn riêng theo level, số job chờ tối đa và thời gian chờ tối đa (giây);
+    # hàng đợi đầy hoặc chờ quá hạn thì search ngay với AI_DEGRADED_NODES node (tối đa
+    # AI_MAX_DEGRADED_SEARCHES search hạ cấp cùng lúc)
+    AI_MAX_RUNNING_SEARCHES = int(os.environ.get('AI_MAX_RUNNING_SEARCHES', 0))
+    AI_LEVEL_CONCURRENCY = {
+        'easy': 8,
+        'medium': 4,
+        'hard': 2,
+        'analysis': 1
+    }
+    AI_QUEUE_MAX = int(os.environ.get('AI_QUEUE_MAX', 8))
+    AI_JOB_MAX_WAIT = float(os.environ.get('AI_JOB_MAX_WAIT', 10))
+    AI_DEGRADED_NODES = int(os.environ.get('AI_DEGRADED_NODES', 3000))
+    AI_MAX_DEGRADED_SEARCHES = int(os.environ.get('AI_MAX_DEGRADED_SEARCHES', 4))
+    
+    # Bộ nhớ tối đa cho ChessAI của các game PvE (MB, chủ yếu là TT), gồm cả engine trong
+    # worker của engine pool (AI_ENGINE_MEMORY_SHARE của ngân sách khi AI_ENGINE_WORKERS > 0);
+    # engine không dùng quá AI_ENGINE_IDLE_SECONDS giây bị thu nhỏ TT trước
+    AI_MEMORY_BUDGET_MB = int(os.environ.get('AI_MEMORY_BUDGET_MB', 256))
+    AI_ENGINE_IDLE_SECONDS = float(os.environ.get('AI_ENGINE_IDLE_SECONDS', 300))
+    AI_ENGINE_MEMORY_SHARE = float(os.environ.get('AI_ENGINE_MEMORY_SHARE', 0.5))
+    
     # Game Configuration
     GAME_TIME_LIMIT = 30 * 60  # 30 phút mỗi ván (tính bằng giây)
     MOVE_TIME_LIMIT = 60       # 60 giây mỗi nước đi
@@ -90,7 +90,7 @@ CREATE TABLE Games (
     
     -- Kết quả
     winner NVARCHAR(20) NULL,        -- 'red', 'black', 'draw', NULL (chưa kết thúc)
-    end_reason NVARCHAR(50) NULL,    -- 'checkmate', 'resign', 'timeout', 'draw_agreement'
+    end_reason NVARCHAR(50) NULL,    -- 'checkmate', 'resign', 'timeout', 'draw_agreement', 'stalemate', 'repetition', 'perpetual_check', 'perpetual_chase'
     
     -- Thời gian
     created_at DATETIME DEFAULT GETDATE(),
@@ -25,14 +25,110 @@ CẢI TIẾN ĐÃ THÊM:
 3. Iterative Deepening: Tìm từ depth thấp lên cao
 4. Killer Moves: Nhớ các nước cắt tỉa hiệu quả
 5. History Heuristic: Ưu tiên nước đi đã tốt trong quá khứ
-6. Time Management: Giới hạn thời gian suy nghĩ
+6. Time Management: đồng hồ monotonic, giới hạn mềm/cứng, theo đồng hồ còn lại
+7. Zobrist Hash + Make/Unmake: không clone bàn cờ ở mỗi node
+8. Phát hiện lặp lại: hòa, hoặc xử thua bên chiếu dai / đuổi dai (luật châu Á)
+9. Futility Pruning + Razoring: bỏ nước yên lặng / cả node ở depth 1-2 khi
+   điểm nhanh (quân + vị trí, cập nhật tăng dần) quá xa alpha/beta
+10. Điểm chiếu hết hữu hạn theo khoảng cách (ưu tiên hết nhanh nhất) + Mate Distance Pruning
+11. Node budget: mỗi level search đúng 1 số node cố định (độ khó không phụ thuộc tải CPU)
+12. Thống kê search có cấu trúc (server/search_stats.py), cộng dồn toàn process
+13. LMR theo bảng log(depth) x log(thứ tự nước) + late move pruning thay cho cắt cứng số nước
+14. Nước đi dạng số nguyên (ô đi * 90 + ô đến, xem board.encode_move) trong toàn bộ search,
+    TT, killer, history và PV; chỉ đổi sang (fr, fc, tr, tc) ở biên API (app.py)
+15. Move picker theo giai đoạn (MovePicker): chỉ chấm điểm / sắp xếp nhóm nước kế tiếp khi
+    nhóm trước đã xét hết, node bị cắt sớm không tốn công sắp xếp phần còn lại
+16. Cooperative mode: có yield_hook thì search nhường event loop đều đặn (số node giữa 2 lần
+    nhường tính theo nps đo được), thống kê ghi khoảng nghẽn dài nhất giữa 2 lần nhường
+17. Hủy search (CancelToken): game kết thúc / người chơi rời đi trong lúc AI suy nghĩ thì
+    search dừng ở lần đọc đồng hồ kế tiếp, thống kê ghi số lần hủy và thời gian tiết kiệm
+18. Opening cache dùng chung cả process (server/opening_cache.py): vị trí khai cuộc đã có
+    kết quả đủ depth (của game khác hoặc nạp từ file) được trả lời ngay, không search
+19. Opening book từ các ván đã chơi (server/opening_book.py, file nhị phân đọc bằng mmap):
+    nước khai cuộc chọn ngẫu nhiên theo thống kê thắng / hòa / thua, độ đa dạng theo level
+20. Tablebase cờ tàn (server/tablebase.py): khi còn ít quân, node có bộ quân trong tablebase
+    nhận điểm chính xác (chiếu hết theo khoảng cách hoặc hòa), không search tiếp
 """
 
+import functools
+import os
 import random
 import math
 import time
 from copy import deepcopy
-from server.board import Board, PIECE_VALUES
+from server.board import Board, PIECE_VALUES, PIECE_INDEX, MOVE_COORDS
+from server.opening_book import OPENING_BOOK
+from server.opening_cache import OPENING_CACHE
+from server.search_stats import SearchStats, SearchResult, STATS_REGISTRY
+from server.tablebase import TABLEBASES, WIN, DRAW
+from server.trace import SearchTrace
+
+# Số helper process Lazy SMP cho level hard (xem server/smp.py), 0 = tắt
+SMP_HELPERS = int(os.environ.get('AI_SMP_HELPERS', '0'))
+
+# Số worker process chia nước ở root cho level medium/hard, 0 = tắt
+ROOT_SPLIT_WORKERS = int(os.environ.get('AI_ROOT_SPLIT_WORKERS', '0'))
+
+# Chế độ node budget (AI_NODE_BUDGET=1): giới hạn search theo số node thay vì thời gian
+NODE_BUDGET_MODE = os.environ.get('AI_NODE_BUDGET', '0') == '1'
+
+# Ở chế độ node budget search không bị giới hạn theo thời gian của level; engine pool chờ
+# worker tối đa thời gian của level nhân hệ số này trước khi coi worker bị treo
+NODE_BUDGET_TIME_FACTOR = 3
+
+# Ở chế độ node budget, độ sâu do số node quyết định; depth_map không còn giới hạn
+NODE_BUDGET_MAX_DEPTH = 20
+
+# Late Move Reduction: chỉ giảm depth ở node còn >= LMR_MIN_DEPTH, từ nước thứ LMR_MIN_INDEX (tính từ 0)
+LMR_MIN_DEPTH = 3
+LMR_MIN_INDEX = 3
+LMR_MAX_DEPTH = 64
+LMR_MAX_MOVES = 128
+
+# Bảng killer theo ply (tính từ root)
+MAX_PLY = 64
+
+# Điểm history tối đa: vượt ngưỡng thì chia đôi cả bảng (giữ dưới điểm của killer / nước ăn)
+HISTORY_MAX = 6000
+
+# Điểm chiếu hết: bên bị hết ở ply p (tính từ root) nhận ∓(MATE_SCORE - p)
+# Mọi điểm có trị tuyệt đối > MATE_BOUND đều là điểm chiếu hết
+MATE_SCORE = 100000
+MATE_BOUND = MATE_SCORE - 1000
+
+# Cooperative mode: khoảng thời gian mục tiêu giữa 2 lần gọi yield_hook (giây)
+YIELD_INTERVAL = 0.01
+
+# Depth lớn nhất được coi là nút biên (áp dụng futility pruning / razoring)
+FRONTIER_DEPTH = 2
+
+
+def value_to_tt(value, ply: int):
+    """Điểm chiếu hết tính từ root -> tính từ node hiện tại (để lưu TT)"""
+    if value > MATE_BOUND:
+        return value + ply
+    if value < -MATE_BOUND:
+        return value - ply
+    return value
+
+
+def value_from_tt(value, ply: int):
+    """Điểm chiếu hết lưu trong TT (tính từ node) -> tính từ root ở ply hiện tại"""
+    if value > MATE_BOUND:
+        return value - ply
+    if value < -MATE_BOUND:
+        return value + ply
+    return value
+
+
+@functools.lru_cache(maxsize=None)
+def lmr_table(base: float, divisor: float):
+    """Bảng giảm depth LMR[depth][thứ tự nước] = base + ln(depth) * ln(thứ tự nước) / divisor"""
+    return tuple(
+        tuple(int(base + math.log(depth) * math.log(index) / divisor) if depth and index else 0
+              for index in range(LMR_MAX_MOVES))
+        for depth in range(LMR_MAX_DEPTH)
+    )
 
 
 class TranspositionTable:
@@ -49,30 +145,27 @@ class TranspositionTable:
         self.max_size = max_size
     
     def hash_board(self, board: Board):
-        """Tạo hash từ trạng thái bàn cờ"""
-        # Đơn giản: tạo tuple từ grid
-        grid_tuple = tuple(
-            tuple((p['type'], p['color']) if p else None for p in row)
-            for row in board.grid
-        )
-        return hash((grid_tuple, board.turn))
-    
-    def lookup(self, board: Board, depth: int, alpha: float, beta: float):
-        """Tìm trong cache"""
+        """Lấy Zobrist key của bàn cờ (được cập nhật tăng dần trong make/unmake)"""
+        return board.zobrist_key
+    
+    def lookup(self, board: Board, depth: int, alpha: float, beta: float, ply: int = 0):
+        """Tìm trong cache (ply: khoảng cách từ root, để chỉnh điểm chiếu hết)"""
         key = self.hash_board(board)
         if key in self.table:
             entry = self.table[key]
             if entry['depth'] >= depth:
+                value = value_from_tt(entry['value'], ply)
                 if entry['flag'] == self.EXACT:
-                    return entry['value'], True
-                elif entry['flag'] == self.LOWER and entry['value'] >= beta:
-                    return entry['value'], True
-                elif entry['flag'] == self.UPPER and entry['value'] <= alpha:
-                    return entry['value'], True
+                    return value, True
+                elif entry['flag'] == self.LOWER and value >= beta:
+                    return value, True
+                elif entry['flag'] == self.UPPER and value <= alpha:
+                    return value, True
         return None, False
     
-    def store(self, board: Board, depth: int, value: float, flag: int):
-        """Lưu vào cache"""
+    def store(self, board: Board, depth: int, value: float, flag: int, move: int = None,
+              ply: int = 0):
+        """Lưu vào cache (kèm nước tốt nhất nếu có; move = None thì giữ nước đã lưu)"""
         if len(self.table) >= self.max_size:
             # Xóa 1/4 entries cũ nhất
             keys_to_remove = list(self.table.keys())[:self.max_size // 4]
@@ -80,17 +173,230 @@ class TranspositionTable:
                 del self.table[k]
         
         key = self.hash_board(board)
+        if move is None and key in self.table:
+            move = self.table[key]['move']
         self.table[key] = {
             'depth': depth,
-            'value': value,
-            'flag': flag
+            'value': value_to_tt(value, ply),
+            'flag': flag,
+            'move': move
         }
     
+    def probe_move(self, board: Board):
+        """Lấy nước tốt nhất đã lưu cho vị trí (None nếu không có)"""
+        entry = self.table.get(self.hash_board(board))
+        return entry['move'] if entry else None
+    
+    def resize(self, max_size: int):
+        """Đổi kích thước tối đa, bỏ các entry cũ nhất nếu đang vượt"""
+        self.max_size = max_size
+        excess = len(self.table) - max_size
+        if excess > 0:
+            for k in list(self.table.keys())[:excess]:
+                del self.table[k]
+    
     def clear(self):
         """Xóa cache"""
         self.table.clear()
 
 
+class MovePicker:
+    """
+    Sinh nước đi theo từng giai đoạn (lười): mỗi nhóm chỉ được chấm điểm / sắp xếp khi
+    nhóm trước đã xét hết, nên node cắt ở 1-2 nước đầu không tốn công cho phần còn lại
+    
+    Thứ tự:
+    1. Nước trong transposition table (hash move)
+    2. Ăn quân không thiệt (SEE >= 0), xếp theo MVV-LVA
+    3. Killer moves (theo ply)
+    4. Counter move (nước trả lời gây cắt cho nước vừa đi)
+    5. Ăn quân thiệt (SEE < 0), thiệt ít xếp trước
+    6. Nước yên lặng theo history [quân][ô đến]
+    
+    Args:
+        moves: toàn bộ nước hợp lệ (dạng số nguyên)
+        tt_move, killers, counter: nước ưu tiên (None nếu không có, bỏ qua nếu không hợp lệ)
+        history: bảng history của ChessAI
+    """
+    
+    def __init__(self, board: Board, moves: list, tt_move=None, killers=(None, None),
+                 counter=None, history=None):
+        self.board = board
+        self.moves = moves
+        self.tt_move = tt_move
+        self.killers = killers
+        self.counter = counter
+        self.history = history
+    
+    def __iter__(self):
+        board = self.board
+        grid = board.grid
+        tt_move = self.tt_move
+        
+        # Giai đoạn 1: hash move
+        if tt_move is not None and tt_move in self.moves:
+            yield tt_move
+        
+        captures = []
+        quiets = []
+        for move in self.moves:
+            if move == tt_move:
+                continue
+            _, _, tr, tc = MOVE_COORDS[move]
+            if grid[tr][tc]:
+                captures.append(move)
+            else:
+                quiets.append(move)
+        
+        # Giai đoạn 2: ăn quân không thiệt; chỉ cần SEE khi quân ăn đắt hơn quân bị ăn
+        good_captures = []
+        bad_captures = []
+        for move in captures:
+            fr, fc, tr, tc = MOVE_COORDS[move]
+            victim_value = PIECE_VALUES[grid[tr][tc]['type']]
+            attacker_value = PIECE_VALUES[grid[fr][fc]['type']]
+            if victim_value < attacker_value:
+                see = board.see(fr, fc, tr, tc)
+                if see < 0:
+                    bad_captures.append((see, move))
+                    continue
+            good_captures.append((victim_value * 10 - attacker_value, move))
+        good_captures.sort(reverse=True)
+        for _, move in good_captures:
+            yield move
+        
+        # Giai đoạn 3-4: killer và counter move (chỉ nước yên lặng hợp lệ ở vị trí này)
+        special = []
+        for move in (*self.killers, self.counter):
+            if move is not None and move not in special and move in quiets:
+                special.append(move)
+                yield move
+        
+        # Giai đoạn 5: ăn quân thiệt (chưa có quiescence search nên ở sát lá nước ăn
+        # thiệt vẫn được đánh giá như được quân: xét trước nước yên lặng)
+        bad_captures.sort(key=lambda item: item[0], reverse=True)
+        for _, move in bad_captures:
+            yield move
+        
+        # Giai đoạn 6: nước yên lặng theo history
+        history = self.history
+        scored = []
+        for move in quiets:
+            if move in special:
+                continue
+            fr, fc, _, _ = MOVE_COORDS[move]
+            piece = grid[fr][fc]
+            scored.append((history[PIECE_INDEX[(piece['type'], piece['color'])] * 90 + move % 90], move))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        for _, move in scored:
+            yield move
+
+
+class SearchAborted(Exception):
+    """Search bị dừng giữa chừng (chạm giới hạn cứng) - kết quả dở dang bị bỏ, không lưu TT"""
+
+
+class CancelToken:
+    """
+    Tín hiệu hủy 1 lần search từ bên ngoài (vd game kết thúc trong lúc AI suy nghĩ);
+    search kiểm tra cùng lúc đọc đồng hồ nên dừng trong vài ms sau cancel()
+    """
+    
+    def __init__(self):
+        self.cancelled = False
+        self.reason = None
+    
+    def cancel(self, reason: str = None):
+        if not self.cancelled:
+            self.cancelled = True
+            self.reason = reason
+
+
+class TimeManager:
+    """
+    Quản lý thời gian suy nghĩ bằng đồng hồ monotonic (không bị ảnh hưởng khi đổi giờ hệ thống)
+    
+    - Giới hạn mềm (soft): hết mốc này thì không bắt đầu depth mới
+    - Giới hạn cứng (hard): vượt mốc này thì search dừng ngay (SearchAborted)
+    - Khoảng cách giữa 2 lần đọc đồng hồ được tính theo tốc độ nodes/giây đo được,
+      để lần đọc đồng hồ rơi vào khoảng mỗi CHECK_INTERVAL giây dù máy nhanh hay chậm
+    - Node budget (node_limit > 0): dừng đúng tại node thứ node_limit, giới hạn mềm tính
+      theo số node và giới hạn thời gian theo level bị bỏ nên kết quả không phụ thuộc tốc độ
+      máy; chỉ còn đồng hồ ván cờ (remaining_time) có thể dừng sớm khi sắp hết giờ
+    """
+    CHECK_INTERVAL = 0.005   # Đọc đồng hồ khoảng mỗi 5ms
+    MIN_CHECK_NODES = 16
+    MAX_CHECK_NODES = 4096
+    SOFT_RATIO = 0.5         # Depth kế tiếp thường tốn >= thời gian các depth trước cộng lại
+    CLOCK_SAFETY = 0.8       # Chỉ dùng tối đa 80% đồng hồ còn lại
+    CLOCK_MARGIN = 0.05      # Chừa 50ms cho độ trễ gửi nước đi
+    
+    def __init__(self):
+        self.start_time = 0.0
+        self.soft_limit = 0.0
+        self.hard_limit = 0.0
+        self.next_check = 0
+        self.nps = 0.0
+        self.stopped = False
+        self.node_limit = 0
+        self.check_interval = self.CHECK_INTERVAL
+    
+    def start(self, time_limit: float, remaining_time: float = None, node_limit: int = 0):
+        """
+        Bắt đầu tính giờ cho một lần chọn nước
+        
+        Args:
+            time_limit: thời gian tối đa theo level (giây), bỏ qua khi có node_limit
+            remaining_time: thời gian còn lại trên đồng hồ của bên AI (giây), nếu có
+            node_limit: số node tối đa (0 = không giới hạn theo node)
+        """
+        hard = math.inf if node_limit else time_limit
+        if remaining_time is not None:
+            hard = min(hard, max(self.CLOCK_MARGIN, remaining_time * self.CLOCK_SAFETY - self.CLOCK_MARGIN))
+        
+        self.start_time = time.monotonic()
+        self.hard_limit = hard
+        self.soft_limit = hard * self.SOFT_RATIO
+        self.node_limit = node_limit
+        self.next_check = min(self.MIN_CHECK_NODES, node_limit) if node_limit else self.MIN_CHECK_NODES
+        self.nps = 0.0
+        self.stopped = False
+    
+    def elapsed(self) -> float:
+        """Số giây đã trôi qua"""
+        return time.monotonic() - self.start_time
+    
+    def soft_exceeded(self, nodes: int = 0) -> bool:
+        """Đã qua giới hạn mềm chưa (không nên bắt đầu depth mới)"""
+        if self.node_limit and nodes >= self.node_limit * self.SOFT_RATIO:
+            return True
+        return self.stopped or self.elapsed() >= self.soft_limit
+    
+    def check(self, nodes: int) -> bool:
+        """
+        Đọc đồng hồ (chỉ gọi khi nodes >= next_check) và hẹn lần đọc kế tiếp
+        
+        Returns:
+            True nếu đã vượt giới hạn cứng (thời gian hoặc số node)
+        """
+        if self.node_limit and nodes >= self.node_limit:
+            self.stopped = True
+            return True
+        
+        elapsed = self.elapsed()
+        if elapsed >= self.hard_limit:
+            self.stopped = True
+            return True
+        
+        if elapsed > 0:
+            self.nps = nodes / elapsed
+        step = int(self.nps * self.check_interval)
+        self.next_check = nodes + max(self.MIN_CHECK_NODES, min(self.MAX_CHECK_NODES, step))
+        if self.node_limit:
+            self.next_check = min(self.next_check, self.node_limit)
+        return False
+
+
 class ChessAI:
     """
     AI cho game Cờ Tướng sử dụng thuật toán Minimax với Alpha-Beta Pruning
@@ -110,11 +416,14 @@ class ChessAI:
         self.nodes_evaluated = 0
         self.tt = TranspositionTable(max_size=50000)  # Giảm size để nhanh hơn
         
-        # Killer moves: lưu 2 killer moves cho mỗi depth
-        self.killer_moves = {}
+        # Killer moves: 2 nước gây cắt gần nhất ở mỗi ply
+        self.killer_moves = [[None, None] for _ in range(MAX_PLY)]
         
-        # History heuristic: điểm cho từng nước đi
-        self.history = {}
+        # History heuristic: điểm theo [quân (PIECE_INDEX) * 90 + ô đến]
+        self.history = [0] * (14 * 90)
+        
+        # Counter move: nước trả lời gây cắt, index = nước trước đó (dạng số nguyên)
+        self.counter_moves = [None] * (90 * 90)
         
         # Độ sâu tìm kiếm theo level
         # Với hàm evaluate mới (hiểu thế cờ), depth thấp hơn vẫn mạnh
@@ -131,58 +440,378 @@ class ChessAI:
             'hard': 10  # 10 giây cho hard để tính toán sâu hơn
         }
         
-        # Giới hạn số nước đi xét (branching factor)
-        self.max_moves = {
-            'easy': 50,
-            'medium': 40,
-            'hard': 30  # Chỉ xét top 30 nước đi tốt nhất
+        # LMR theo level: (base, divisor) của lmr_table, divisor lớn = giảm ít hơn
+        self.lmr_params = {
+            'easy': (0.5, 2.25),
+            'medium': (0.5, 2.5),
+            'hard': (0.4, 2.75)
+        }
+        
+        # Late move pruning theo level: ở depth 1..FRONTIER_DEPTH (index = depth) chỉ xét
+        # bấy nhiêu nước đầu, các nước yên lặng không chiếu sau đó bị bỏ
+        self.late_move_counts = {
+            'easy': (0, 12, 20),
+            'medium': (0, 16, 26),
+            'hard': (0, 20, 32)
+        }
+        
+        # Số helper process Lazy SMP theo level (0 = search 1 process)
+        self.smp_helpers = {
+            'easy': 0,
+            'medium': 0,
+            'hard': SMP_HELPERS
+        }
+        
+        # Số worker process chia nước ở root theo level (0 = tắt, không dùng cùng Lazy SMP)
+        self.root_split_workers = {
+            'easy': 0,
+            'medium': ROOT_SPLIT_WORKERS,
+            'hard': ROOT_SPLIT_WORKERS
+        }
+        self._root_workers = 0
+        
+        # Margin futility pruning / razoring theo level, index = depth còn lại (1..FRONTIER_DEPTH)
+        # Margin lớn = cắt ít hơn nhưng an toàn hơn (evaluate còn nhiều thành phần ngoài quân + vị trí)
+        self.futility_margins = {
+            'easy': (0, 250, 550),
+            'medium': (0, 300, 650),
+            'hard': (0, 350, 750)
         }
+        self.razor_margins = {
+            'easy': (0, 450, 800),
+            'medium': (0, 500, 900),
+            'hard': (0, 600, 1000)
+        }
+        
+        # Opening book theo level (server/opening_book.py): (số mũ tỉ lệ điểm trong trọng số,
+        # số ván tối thiểu của 1 nước); số mũ 0 = chọn theo độ phổ biến, lớn = gần như luôn
+        # chọn nước điểm cao nhất. Level easy không dùng book (vẫn đi ngẫu nhiên)
+        self.book_settings = {
+            'medium': (1, 2),
+            'hard': (4, 3)
+        }
+        
+        # Thống kê search của lần tìm gần nhất
+        self.stats = SearchStats()
+        
+        # Số node mỗi nước theo level khi chạy node budget (0 = level này vẫn chạy theo thời gian)
+        self.node_budget = {
+            'easy': 0,
+            'medium': 12000,
+            'hard': 40000
+        }
+        self.use_node_budget = NODE_BUDGET_MODE
+        
+        self.timer = TimeManager()
         
-        self.start_time = 0
-        self.time_up = False
+        # Callable trả True khi bên ngoài yêu cầu dừng search (kiểm tra cùng lúc đọc đồng hồ)
+        self.stop_check = None
+        
+        # CancelToken của lần search hiện tại (None = không hủy được); khác stop_check ở chỗ
+        # search bị hủy được ghi vào thống kê (số lần hủy, thời gian tiết kiệm)
+        self.cancel_token = None
+        
+        # Cooperative mode: callable gọi mỗi lần đọc đồng hồ để nhường event loop
+        # (vd socketio.sleep(0)), dùng khi search chạy trong greenlet của event loop;
+        # khi có hook, đồng hồ được đọc (và hook được gọi) ít nhất mỗi yield_interval giây
+        self.yield_hook = None
+        self.yield_interval = YIELD_INTERVAL
+        
+        # Thời gian tối đa cho 1 lần ponder (search trên giờ của người chơi)
+        self.ponder_time_limit = 60
+        
+        # Ghi vết lần search() kế tiếp (SearchTrace, tự gỡ sau khi dùng); xem server/trace.py
+        self.trace = None
+        self._tracer = None
+        
+        # In log từng depth ra stdout
+        self.verbose = True
+        self.last_depth = 0
+        self.last_score = 0  # Điểm root (góc nhìn Đỏ) của depth hoàn thành cuối
+        self._root_ply = 0   # len(board.hash_history) ở root, để tính ply
     
-    def choose_move(self, board: Board):
+    def choose_move(self, board: Board, remaining_time: float = None, node_limit: int = None):
         """
         Chọn nước đi tốt nhất cho AI sử dụng Iterative Deepening
+        
+        Args:
+            board: Trạng thái bàn cờ
+            remaining_time: thời gian còn lại trên đồng hồ của AI (giây), None = chỉ dùng giới hạn theo level
+            node_limit: số node tối đa riêng cho lần này (vd scheduler hạ cấp khi quá tải), None = theo level
+        
+        Returns:
+            Nước đi dạng số nguyên (board.decode_move để đổi sang (fr, fc, tr, tc)) hoặc None
         """
-        self.nodes_evaluated = 0
-        self.start_time = time.time()
-        self.time_up = False
+        return self.search(board, remaining_time, node_limit).move
+    
+    def search(self, board: Board, remaining_time: float = None, node_limit: int = None):
+        """
+        Như choose_move nhưng trả về SearchResult (nước đi, depth, điểm, thống kê);
+        thống kê được cộng vào STATS_REGISTRY theo level
+        """
+        self._reset_search()
+        self.start_timer(remaining_time, node_limit)
+        self._age_tables()
         
-        legal = board.legal_moves(self.color)
+        legal = board.legal_move_codes(self.color)
         if not legal:
-            return None
+            return SearchResult(None, 0, 0, self.stats)
+        
+        # Search trên bản sao bằng make/unmake, giữ nguyên stack hash của ván
+        board = board.clone()
         
         # Level easy: random với ưu tiên ăn quân
         if self.level == "easy":
-            return self._easy_move(board, legal)
+            move = self._easy_move(board, legal)
+            self.stats.finish(0, 0)
+            STATS_REGISTRY.record(self.level, self.stats)
+            return SearchResult(move, 0, 0, self.stats)
+        
+        # Nước khai cuộc trong opening book (thống kê từ các ván đã chơi): không search
+        if self.trace is None and self.level in self.book_settings:
+            move = OPENING_BOOK.choose(board, legal, *self.book_settings[self.level])
+            if move is not None:
+                self.stats.book_hits = 1
+                self.stats.finish(0, 0)
+                STATS_REGISTRY.record(self.level, self.stats)
+                return SearchResult(move, 0, 0, self.stats)
+        
+        # Vị trí khai cuộc đã được search (game khác hoặc file nạp sẵn) tới depth của level
+        if self.trace is None:
+            cached = OPENING_CACHE.probe(board, self.level, self.depth_map.get(self.level, 3))
+            if cached is not None and cached[0] in legal:
+                move, score, depth = cached
+                self.last_depth = depth
+                self.last_score = score
+                self.stats.opening_cache_hits = 1
+                self.stats.finish(0, depth)
+                STATS_REGISTRY.record(self.level, self.stats)
+                return SearchResult(move, depth, score, self.stats)
+        
+        trace = self.trace or SearchTrace.for_level(self.level)
+        self.trace = None
+        if trace:
+            trace.begin(self, board, remaining_time)
+            trace.attach(self)
+        
+        # Sử dụng Iterative Deepening (song song Lazy SMP nếu level có cấu hình helper)
+        # Node budget cần kết quả tất định, trace chỉ ghi được process này: không search song song
+        sequential = self.timer.node_limit or trace
+        max_depth = NODE_BUDGET_MAX_DEPTH if self.timer.node_limit else self.depth_map.get(self.level, 3)
+        helpers = 0 if sequential else self.smp_helpers.get(self.level, 0)
+        
+        try:
+            if helpers > 0:
+                from server.smp import LazySMP
+                self._root_workers = 0
+                best_move, depth = LazySMP.get(helpers).search(self, board, max_depth)
+            else:
+                self._root_workers = 0 if sequential else self.root_split_workers.get(self.level, 0)
+                best_move, depth = self._iterative_deepening(board, max_depth)
+        finally:
+            if trace:
+                trace.detach(self)
         
-        # Sử dụng Iterative Deepening
+        if best_move is None:
+            best_move = random.choice(legal)
+        
+        self.last_depth = depth
+        self.stats.finish(self.nodes_evaluated, depth)
+        if self.cancel_token is not None and self.cancel_token.cancelled:
+            # Phần giới hạn cứng chưa dùng tới là CPU đã tiết kiệm được
+            self.stats.cancelled = 1
+            self.stats.time_saved = max(0.0, self.timer.hard_limit - self.timer.elapsed())
+        elif node_limit is None:
+            # Search hạ cấp (node_limit của scheduler) yếu hơn bình thường, không lưu
+            OPENING_CACHE.store(board, self.level, best_move, self.last_score, depth)
+        STATS_REGISTRY.record(self.level, self.stats)
+        if self.verbose:
+            print(f"AI ({self.level}) tổng: {self.score_text(self.last_score)}, {self.stats.summary()}")
+        
+        result = SearchResult(best_move, depth, self.last_score, self.stats)
+        if trace:
+            trace.end(result)
+        return result
+    
+    def _reset_search(self):
+        """Đặt lại bộ đếm node và thống kê trước 1 lần search, chọn chu kỳ đọc đồng hồ"""
+        self.nodes_evaluated = 0
+        self.stats = SearchStats()
+        self.timer.check_interval = TimeManager.CHECK_INTERVAL
+        if self.yield_hook:
+            self.timer.check_interval = min(TimeManager.CHECK_INTERVAL, self.yield_interval)
+    
+    def start_timer(self, remaining_time: float = None, node_limit: int = None):
+        """
+        Bắt đầu giới hạn cho 1 nước: theo thời gian của level, hoặc theo node budget nếu bật
+        (node_limit truyền vào thay node budget của level); có node limit thì chỉ số node
+        và đồng hồ ván cờ giới hạn search, không còn thời gian của level
+        """
+        if not node_limit and self.use_node_budget:
+            node_limit = self.node_budget.get(self.level, 0)
+        self.timer.start(self.time_limit.get(self.level, 5), remaining_time, node_limit or 0)
+    
+    def predict_reply(self, board: Board):
+        """
+        Đoán nước đối thủ sẽ đi ở vị trí board (nước thứ 2 của PV, lấy từ TT)
+        
+        Returns:
+            Nước đi dạng số nguyên hoặc None nếu TT không có / nước không hợp lệ
+        """
+        move = self.tt.probe_move(board)
+        if move is not None and move in board.legal_move_codes(board.turn):
+            return move
+        return None
+    
+    def fallback_move(self, board: Board, move: int = None):
+        """
+        Nước AI sẽ đi ở vị trí board: move nếu hợp lệ, nếu không (search lỗi, không tìm được
+        nước) thì nước hợp lệ đầu tiên, để ván không bị treo ở lượt của AI
+        
+        Returns:
+            Nước đi dạng số nguyên hoặc None nếu bên đến lượt không còn nước hợp lệ
+        """
+        legal = board.legal_move_codes(board.turn)
+        if move in legal:
+            return move
+        return legal[0] if legal else None
+    
+    def ponder(self, board: Board):
+        """
+        Search vị trí board (đến lượt AI) trên giờ của người chơi
+        Dừng khi đủ depth, hết ponder_time_limit hoặc stop_check() báo dừng;
+        khi ponder hit, bên gọi start lại self.timer theo giờ thật để search tiếp
+        
+        Returns:
+            (best_move, depth) hoặc (None, 0)
+        """
+        self._reset_search()
+        self.timer.start(self.ponder_time_limit)
+        self._root_workers = 0
+        
+        board = board.clone()
         max_depth = self.depth_map.get(self.level, 3)
-        time_limit = self.time_limit.get(self.level, 5)
-        maximizing = (self.color == 'red')
+        best_move, depth = self._iterative_deepening(board, max_depth)
+        self.stats.finish(self.nodes_evaluated, depth)
+        return best_move, depth
+    
+    def analyze(self, board: Board, num_pv: int = 3, max_depth: int = None, time_limit: float = None,
+                node_limit: int = 0):
+        """
+        Multi-PV: tìm num_pv nước tốt nhất của bên đang đi trong 1 lần search (gợi ý nước đi,
+        xem lại ván). Các line dùng chung TT; chỉ num_pv nước đầu được search full window,
+        các nước còn lại search null window theo điểm của line thứ num_pv (PVS) nên chi phí
+        tăng chậm hơn nhiều so với chạy num_pv lần search riêng.
+        
+        node_limit: số node tối đa (0 = chỉ giới hạn theo thời gian)
         
-        best_move = random.choice(legal)
+        Returns:
+            {'depth', 'nodes', 'lines': [{'move', 'score', 'mate', 'pv'}]} - lines xếp từ tốt
+            đến kém, score theo góc nhìn bên đang đi, mate = số nước đến chiếu hết
+            (dương = bên đang đi thắng, None nếu không phải điểm chiếu hết);
+            move và các nước trong pv ở dạng số nguyên
+        """
+        self._reset_search()
+        self.timer.start(time_limit or self.time_limit.get(self.level, 5), node_limit=node_limit or 0)
+        self._root_workers = 0
+        
+        board = board.clone()
+        maximizing = board.turn == 'red'
+        max_depth = max_depth or self.depth_map.get(self.level, 3)
+        moves = list(self._move_picker(board, board.legal_move_codes(board.turn), 0))
         
-        # Iterative Deepening: tìm từ depth 1 đến max_depth
+        scored = []
+        completed = 0
         for depth in range(1, max_depth + 1):
-            if time.time() - self.start_time > time_limit * 0.9:
+            if depth > 1 and self.timer.soft_exceeded(self.nodes_evaluated):
+                break
+            try:
+                result = self._multipv_root(board, moves, depth, maximizing, num_pv)
+            except SearchAborted:
+                self.stats.end_iteration(depth, self.nodes_evaluated, False)
+                break
+            self.stats.end_iteration(depth, self.nodes_evaluated)
+            scored = result
+            completed = depth
+            # Thứ tự của depth này là move ordering cho depth sau
+            moves = [move for _, move in scored]
+            if self.verbose:
+                print(f"AI multi-PV depth {depth}: {self.nodes_evaluated} nodes, "
+                      f"{self.timer.elapsed():.2f}s")
+        
+        self.last_depth = completed
+        self.stats.finish(self.nodes_evaluated, completed)
+        
+        lines = []
+        for value, move in scored[:num_pv]:
+            score = value if maximizing else -value
+            mate = None
+            if abs(score) > MATE_BOUND:
+                mate = (MATE_SCORE - abs(score) + 1) // 2
+                mate = mate if score > 0 else -mate
+            lines.append({
+                'move': move,
+                'score': score,
+                'mate': mate,
+                'pv': self._extract_pv(board, move, completed)
+            })
+        
+        return {'depth': completed, 'nodes': self.nodes_evaluated, 'lines': lines,
+                'stats': self.stats.to_dict()}
+    
+    def _iterative_deepening(self, board: Board, max_depth: int, start_depth: int = 1, on_depth=None):
+        """
+        Iterative Deepening: tìm từ start_depth đến max_depth
+        
+        Args:
+            on_depth: callback(depth, move, value) sau mỗi depth hoàn thành (dùng cho Lazy SMP)
+        
+        Returns:
+            (best_move, depth đã hoàn thành) - (None, 0) nếu chưa xong depth nào
+        """
+        maximizing = (self.color == 'red')
+        best_move = None
+        completed = 0
+        
+        for depth in range(start_depth, max_depth + 1):
+            # Giới hạn mềm: không bắt đầu depth mới (depth đầu luôn chạy để có nước đi)
+            if depth > start_depth and self.timer.soft_exceeded(self.nodes_evaluated):
                 break
             
-            move = self._minimax_root(board, depth, maximizing)
-            if move and not self.time_up:
+            try:
+                move, value = self._minimax_root(board, depth, maximizing)
+            except SearchAborted:
+                # Giới hạn cứng: bỏ kết quả depth dở dang, giữ nước của depth trước
+                self.stats.end_iteration(depth, self.nodes_evaluated, False)
+                if self.verbose:
+                    print(f"AI depth {depth}: dừng sau {self.nodes_evaluated} nodes")
+                break
+            
+            self.stats.end_iteration(depth, self.nodes_evaluated)
+            if move is not None:
                 best_move = move
+                completed = depth
+                self.last_score = value
+                if on_depth:
+                    on_depth(depth, move, value)
             
-            elapsed = time.time() - self.start_time
-            print(f"AI depth {depth}: {self.nodes_evaluated} nodes, {elapsed:.2f}s")
+            if self.verbose:
+                print(f"AI depth {depth}: {self.nodes_evaluated} nodes, {self.score_text(value)}, "
+                      f"{self.timer.elapsed():.2f}s")
             
-            # Nếu đã hết thời gian, dừng
-            if self.time_up:
+            # Đã thấy chiếu hết trong tầm depth này: search sâu hơn không tìm được đường hết ngắn hơn
+            if move is not None and abs(value) >= MATE_SCORE - depth:
                 break
         
-        print(f"AI ({self.level}) tổng: {self.nodes_evaluated} nodes, {time.time() - self.start_time:.2f}s")
-        
-        return best_move
+        return best_move, completed
+    
+    def score_text(self, value):
+        """Hiển thị điểm root theo góc nhìn AI: 'mate in N' / 'mated in N' hoặc 'score X'"""
+        if value > MATE_BOUND or value < -MATE_BOUND:
+            moves = (MATE_SCORE - abs(value) + 1) // 2
+            winning = (value > 0) == (self.color == 'red')
+            return f"mate in {moves}" if winning else f"mated in {moves}"
+        return f"score {value if self.color == 'red' else -value}"
     
     def _easy_move(self, board: Board, legal_moves):
         """
@@ -191,10 +820,10 @@ class ChessAI:
         - 30% chọn nước ăn quân nếu có
         """
         capture_moves = []
-        for fr, fc, tr, tc in legal_moves:
-            target = board.get_piece(tr, tc)
-            if target:
-                capture_moves.append((fr, fc, tr, tc))
+        for move in legal_moves:
+            _, _, tr, tc = MOVE_COORDS[move]
+            if board.grid[tr][tc]:
+                capture_moves.append(move)
         
         if capture_moves and random.random() < 0.3:
             return random.choice(capture_moves)
@@ -202,64 +831,151 @@ class ChessAI:
         return random.choice(legal_moves)
     
     def _check_time(self):
-        """Kiểm tra đã hết thời gian chưa"""
-        if time.time() - self.start_time > self.time_limit.get(self.level, 5):
-            self.time_up = True
-            return True
-        return False
+        """Kiểm tra giới hạn cứng và tín hiệu dừng từ bên ngoài, dừng search ngay nếu cần"""
+        if self.nodes_evaluated >= self.timer.next_check:
+            if self.timer.check(self.nodes_evaluated):
+                raise SearchAborted()
+            if self.stop_check and self.stop_check():
+                raise SearchAborted()
+            if self.cancel_token is not None and self.cancel_token.cancelled:
+                raise SearchAborted()
+            if self.yield_hook:
+                stats = self.stats
+                gap = time.monotonic() - stats.last_yield
+                if gap > stats.max_yield_gap:
+                    stats.max_yield_gap = gap
+                stats.yields += 1
+                self.yield_hook()
+                stats.last_yield = time.monotonic()
     
     def _minimax_root(self, board: Board, depth: int, maximizing: bool):
-        """Minimax ở nút gốc với move ordering và giới hạn số nước"""
+        """
+        Minimax ở nút gốc với move ordering và giới hạn số nước
+        
+        Returns:
+            (best_move, best_value) - best_value theo góc nhìn Đỏ
+        """
         best_move = None
         color = 'red' if maximizing else 'black'
         
-        legal_moves = board.legal_moves(color)
-        legal_moves = self._order_moves(board, legal_moves, depth)
+        legal_moves = list(self._move_picker(board, board.legal_move_codes(color), 0))
         
-        # Giới hạn số nước đi xét ở root
-        max_moves = self.max_moves.get(self.level, 40)
-        legal_moves = legal_moves[:max_moves]
+        # Chia nước ở root cho các worker process (xem server/smp.py)
+        if self._root_workers > 0 and depth >= 2 and len(legal_moves) > 1:
+            from server.smp import RootSplitter
+            return RootSplitter.get(self._root_workers).search_root(
+                self, board, legal_moves, depth, maximizing)
         
         best_value = -math.inf if maximizing else math.inf
+        table = lmr_table(*self.lmr_params.get(self.level, self.lmr_params['medium']))
+        in_check = board.is_in_check(color)
         
-        for i, (fr, fc, tr, tc) in enumerate(legal_moves):
-            if self._check_time():
-                break
+        for i, move in enumerate(legal_moves):
+            self._check_time()
             
-            new_board = board.clone()
-            new_board.move(fr, fc, tr, tc)
+            # LMR ở root: nước yên lặng, không chiếu, xếp sau
+            reduction = 0
+            fr, fc, tr, tc = MOVE_COORDS[move]
+            if (depth >= LMR_MIN_DEPTH and i >= LMR_MIN_INDEX and not in_check
+                    and not board.grid[tr][tc] and not board.gives_check(fr, fc, tr, tc)):
+                reduction = min(table[min(depth, LMR_MAX_DEPTH - 1)][min(i, LMR_MAX_MOVES - 1)], depth - 2)
             
-            # Principal Variation Search (PVS)
-            if i == 0:
-                # Nước đầu tiên: tìm đầy đủ
-                value = self._minimax(new_board, depth - 1, -math.inf, math.inf, 
-                                      not maximizing, depth)
-            else:
-                # Các nước sau: null window search trước
-                if maximizing:
-                    value = self._minimax(new_board, depth - 1, best_value, best_value + 1,
-                                          False, depth)
-                    if value > best_value:
-                        # Re-search với full window
-                        value = self._minimax(new_board, depth - 1, value, math.inf,
-                                              False, depth)
-                else:
-                    value = self._minimax(new_board, depth - 1, best_value - 1, best_value,
-                                          True, depth)
-                    if value < best_value:
-                        value = self._minimax(new_board, depth - 1, -math.inf, value,
-                                              True, depth)
+            value = self._search_root_move(board, move, depth, maximizing, best_value, i == 0, reduction)
             
             if maximizing:
                 if value > best_value:
                     best_value = value
-                    best_move = (fr, fc, tr, tc)
+                    best_move = move
             else:
                 if value < best_value:
                     best_value = value
-                    best_move = (fr, fc, tr, tc)
+                    best_move = move
+        
+        return best_move, best_value
+    
+    def _multipv_root(self, board: Board, moves: list, depth: int, maximizing: bool, num_pv: int):
+        """
+        Search mọi nước ở root cho multi-PV
+        
+        Returns:
+            list (value, move) xếp từ tốt đến kém (theo góc nhìn Đỏ); chỉ num_pv phần tử
+            đầu là điểm chính xác, các nước sau chỉ là cận trên/dưới
+        """
+        scored = []
+        for move in moves:
+            self._check_time()
+            if len(scored) < num_pv:
+                value = self._search_root_move(board, move, depth, maximizing, None, True)
+            else:
+                value = self._search_root_move(board, move, depth, maximizing,
+                                               scored[num_pv - 1][0], False)
+            scored.append((value, move))
+            scored.sort(key=lambda item: item[0], reverse=maximizing)
+        return scored
+    
+    def _extract_pv(self, board: Board, move: int, length: int):
+        """Principal variation bắt đầu bằng move, nối tiếp bằng nước tốt nhất lưu trong TT"""
+        pv = [move]
+        board.make_move(*MOVE_COORDS[move])
+        while len(pv) < length and not board.find_repetitions():
+            next_move = self.tt.probe_move(board)
+            if next_move is None or next_move not in board.legal_move_codes(board.turn):
+                break
+            pv.append(next_move)
+            board.make_move(*MOVE_COORDS[next_move])
+        for _ in pv:
+            board.unmake_move()
+        return pv
+    
+    def _search_root_move(self, board: Board, move: int, depth: int, maximizing: bool,
+                          best_value: float, first: bool, reduction: int = 0):
+        """
+        Search 1 nước ở root theo Principal Variation Search (PVS)
+        
+        Args:
+            best_value: giá trị tốt nhất ở root đến lúc này (làm cận cho null window)
+            first: nước đầu tiên thì search full window
+            reduction: số depth giảm (LMR) cho lần search null window đầu tiên
+        """
+        self._root_ply = len(board.hash_history)
+        nodes = self.nodes_evaluated
+        fr, fc, tr, tc = MOVE_COORDS[move]
+        board.make_move(fr, fc, tr, tc)
         
-        return best_move
+        if first:
+            # Nước đầu tiên: tìm đầy đủ
+            value = self._minimax(board, depth - 1, -math.inf, math.inf, 
+                                  not maximizing, depth)
+        else:
+            # Các nước sau: null window search trước (ở depth đã giảm nếu có LMR)
+            if maximizing:
+                value = self._minimax(board, depth - 1 - reduction, best_value, best_value + 1,
+                                      False, depth)
+                if reduction and value > best_value:
+                    self.stats.lmr_researches += 1
+                    value = self._minimax(board, depth - 1, best_value, best_value + 1,
+                                          False, depth)
+                if value > best_value:
+                    # Re-search với full window
+                    value = self._minimax(board, depth - 1, value, math.inf,
+                                          False, depth)
+            else:
+                value = self._minimax(board, depth - 1 - reduction, best_value - 1, best_value,
+                                      True, depth)
+                if reduction and value < best_value:
+                    self.stats.lmr_researches += 1
+                    value = self._minimax(board, depth - 1, best_value - 1, best_value,
+                                          True, depth)
+                if value < best_value:
+                    value = self._minimax(board, depth - 1, -math.inf, value,
+                                          True, depth)
+        
+        if reduction:
+            self.stats.lmr_reductions += 1
+        board.unmake_move()
+        if self._tracer:
+            self._tracer.root(move, depth, value, self.nodes_evaluated - nodes)
+        return value
     
     def _minimax(self, board: Board, depth: int, alpha: float, beta: float, 
                  maximizing: bool, root_depth: int):
@@ -267,144 +983,240 @@ class ChessAI:
         Minimax với Alpha-Beta Pruning và Transposition Table
         """
         self.nodes_evaluated += 1
+        stats = self.stats
         
-        # Kiểm tra thời gian mỗi 500 nodes (thường xuyên hơn)
-        if self.nodes_evaluated % 500 == 0 and self._check_time():
-            return 0
+        # Kiểm tra thời gian (tần suất theo nodes/giây đo được)
+        self._check_time()
+        
+        # Lặp lại vị trí: hòa, hoặc bên chiếu dai / đuổi dai bị xử thua
+        # (phụ thuộc đường đi nên không lưu vào transposition table)
+        ply = len(board.hash_history) - self._root_ply
+        repeats = board.find_repetitions()
+        if repeats:
+            stats.repetitions += 1
+            loser = board.repetition_loser(repeats[0])
+            if loser is None:
+                return 0
+            return -(MATE_SCORE - ply) if loser == 'red' else MATE_SCORE - ply
+        
+        # Mate Distance Pruning: điểm ở node này nằm trong [bị hết ngay, hết ở nước kế tiếp],
+        # cắt nếu cửa sổ không còn chỗ cho đường hết ngắn hơn đường đã tìm thấy
+        if maximizing:
+            alpha = max(alpha, -(MATE_SCORE - ply))
+            beta = min(beta, MATE_SCORE - ply - 1)
+        else:
+            alpha = max(alpha, -(MATE_SCORE - ply - 1))
+            beta = min(beta, MATE_SCORE - ply)
+        if alpha >= beta:
+            stats.mate_distance_cuts += 1
+            return alpha if maximizing else beta
+        
+        # Tablebase cờ tàn: kết quả chính xác theo góc nhìn bên đang đi (root vẫn search để chọn nước)
+        if ply > 0 and board.piece_count <= TABLEBASES.max_pieces:
+            probed = TABLEBASES.probe(board)
+            if probed is not None:
+                stats.tablebase_hits += 1
+                result, distance = probed
+                if result == DRAW:
+                    return 0
+                value = MATE_SCORE - (ply + distance)
+                if result != WIN:
+                    value = -value
+                return value if maximizing else -value
         
         # Lookup trong transposition table
-        tt_value, found = self.tt.lookup(board, depth, alpha, beta)
+        stats.tt_probes += 1
+        tt_value, found = self.tt.lookup(board, depth, alpha, beta, ply)
         if found:
+            stats.tt_hits += 1
             return tt_value
         
         # Điều kiện dừng
         if depth == 0:
+            stats.leaf_nodes += 1
             value = self._evaluate(board)
+            stats.tt_stores += 1
             self.tt.store(board, depth, value, TranspositionTable.EXACT)
             return value
         
+        stats.interior_nodes += 1
         color = 'red' if maximizing else 'black'
-        legal_moves = board.legal_moves(color)
+        legal_moves = board.legal_move_codes(color)
         
+        in_check = board.is_in_check(color)
         if not legal_moves:
-            if board.is_in_check(color):
-                return -math.inf if maximizing else math.inf
+            if in_check:
+                return -(MATE_SCORE - ply) if maximizing else MATE_SCORE - ply
             return 0
         
-        # Sắp xếp và giới hạn nước đi
-        legal_moves = self._order_moves(board, legal_moves, depth)
-        
-        # Giới hạn số nước đi ở các node sâu hơn
-        if depth < root_depth:
-            max_moves = min(25, len(legal_moves))  # Chỉ xét top 25 ở node con
-            legal_moves = legal_moves[:max_moves]
+        # Nút biên: razoring (cắt cả node) và futility pruning (bỏ nước yên lặng)
+        # dựa trên điểm nhanh board.material; không áp dụng khi đang bị chiếu
+        futility_value = None
+        late_moves = 0
+        if depth <= FRONTIER_DEPTH:
+            stats.frontier_nodes += 1
+            if not in_check:
+                late_moves = self.late_move_counts.get(self.level, self.late_move_counts['medium'])[depth]
+                static = board.material
+                razor = self.razor_margins.get(self.level, self.razor_margins['medium'])[depth]
+                if (static + razor <= alpha) if maximizing else (static - razor >= beta):
+                    # Xác nhận bằng evaluate đầy đủ (thay cho quiescence search)
+                    value = self._evaluate(board)
+                    if (value <= alpha) if maximizing else (value >= beta):
+                        stats.razored += 1
+                        return value
+                
+                margin = self.futility_margins.get(self.level, self.futility_margins['medium'])[depth]
+                if maximizing and static + margin <= alpha:
+                    futility_value = static + margin
+                elif not maximizing and static - margin >= beta:
+                    futility_value = static - margin
         
+        # Cửa sổ ban đầu (alpha / beta bị thu hẹp trong vòng lặp) để xác định loại cận khi lưu TT
         original_alpha = alpha
+        original_beta = beta
         best_value = -math.inf if maximizing else math.inf
         best_move = None
         
-        for i, (fr, fc, tr, tc) in enumerate(legal_moves):
-            new_board = board.clone()
-            new_board.move(fr, fc, tr, tc)
+        futility_pruned = False
+        if depth <= FRONTIER_DEPTH:
+            stats.frontier_moves += len(legal_moves)
+        table = lmr_table(*self.lmr_params.get(self.level, self.lmr_params['medium']))
+        can_reduce = depth >= LMR_MIN_DEPTH and not in_check
+        
+        # Xét nước theo giai đoạn (không cắt bớt: nước xếp sau được giảm depth / cắt có điều kiện)
+        for i, move in enumerate(self._move_picker(board, legal_moves, ply)):
+            fr, fc, tr, tc = MOVE_COORDS[move]
+            captured = board.make_move(fr, fc, tr, tc)
             
-            # Late Move Reduction: giảm depth cho các nước đi sau
+            # Nước yên lặng không chiếu tướng xếp sau: futility pruning, late move pruning
+            # hoặc Late Move Reduction theo bảng (chỉ kiểm tra chiếu khi cần)
             reduction = 0
-            if i >= 4 and depth >= 3 and not board.get_piece(tr, tc):
-                reduction = 1
+            if (i > 0 and not captured
+                    and (futility_value is not None or (late_moves and i >= late_moves)
+                         or (can_reduce and i >= LMR_MIN_INDEX))
+                    and not board.is_in_check(board.turn)):
+                if futility_value is not None:
+                    board.unmake_move()
+                    stats.futility_pruned += 1
+                    futility_pruned = True
+                    continue
+                if late_moves and i >= late_moves:
+                    board.unmake_move()
+                    stats.late_move_pruned += 1
+                    continue
+                if can_reduce and i >= LMR_MIN_INDEX:
+                    reduction = min(table[min(depth, LMR_MAX_DEPTH - 1)][min(i, LMR_MAX_MOVES - 1)],
+                                    depth - 2)
             
-            eval_score = self._minimax(new_board, depth - 1 - reduction, alpha, beta, 
+            eval_score = self._minimax(board, depth - 1 - reduction, alpha, beta, 
                                        not maximizing, root_depth)
             
             # Re-search nếu LMR tìm được giá trị tốt
             if reduction > 0:
-                if maximizing and eval_score > alpha:
-                    eval_score = self._minimax(new_board, depth - 1, alpha, beta, 
-                                              not maximizing, root_depth)
-                elif not maximizing and eval_score < beta:
-                    eval_score = self._minimax(new_board, depth - 1, alpha, beta, 
+                stats.lmr_reductions += 1
+                if (eval_score > alpha) if maximizing else (eval_score < beta):
+                    stats.lmr_researches += 1
+                    eval_score = self._minimax(board, depth - 1, alpha, beta, 
                                               not maximizing, root_depth)
             
+            board.unmake_move()
+            
             if maximizing:
                 if eval_score > best_value:
                     best_value = eval_score
-                    best_move = (fr, fc, tr, tc)
+                    best_move = move
                 alpha = max(alpha, eval_score)
             else:
                 if eval_score < best_value:
                     best_value = eval_score
-                    best_move = (fr, fc, tr, tc)
+                    best_move = move
                 beta = min(beta, eval_score)
             
             if beta <= alpha:
-                # Lưu killer move
-                self._add_killer_move(depth, (fr, fc, tr, tc))
-                # Cập nhật history
-                self._update_history((fr, fc, tr, tc), depth)
+                stats.beta_cutoffs += 1
+                if i == 0:
+                    stats.first_move_cutoffs += 1
+                if not captured:
+                    piece = board.grid[fr][fc]
+                    history_index = PIECE_INDEX[(piece['type'], piece['color'])] * 90 + move % 90
+                    if ply < MAX_PLY and move in self.killer_moves[ply]:
+                        stats.killer_cutoffs += 1
+                    elif self.history[history_index] > 0:
+                        stats.history_cutoffs += 1
+                    # Killer, history và counter move chỉ dành cho nước yên lặng
+                    self._add_killer_move(ply, move)
+                    self._update_history(history_index, depth)
+                    previous = board.last_move()
+                    if previous:
+                        pfr, pfc, ptr, ptc = previous
+                        self.counter_moves[(pfr * 9 + pfc) * 90 + ptr * 9 + ptc] = move
                 break
         
+        # Có nước bị futility cắt: điểm của chúng bị chặn bởi điểm nhanh + margin
+        if futility_pruned:
+            if maximizing:
+                best_value = max(best_value, futility_value)
+            else:
+                best_value = min(best_value, futility_value)
+        
         # Lưu vào transposition table
         if best_value <= original_alpha:
             flag = TranspositionTable.UPPER
-        elif best_value >= beta:
+        elif best_value >= original_beta:
             flag = TranspositionTable.LOWER
         else:
             flag = TranspositionTable.EXACT
         
-        self.tt.store(board, depth, best_value, flag)
+        # Không nước nào vượt được cửa sổ (Đỏ: UPPER, Đen: LOWER): nước "tốt nhất" chỉ là
+        # cận không có ý nghĩa cho move ordering - giữ hash move cũ
+        if flag == (TranspositionTable.UPPER if maximizing else TranspositionTable.LOWER):
+            best_move = None
+        
+        stats.tt_stores += 1
+        self.tt.store(board, depth, best_value, flag, best_move, ply)
         
         return best_value
     
-    def _add_killer_move(self, depth: int, move: tuple):
-        """Thêm killer move"""
-        if depth not in self.killer_moves:
-            self.killer_moves[depth] = [None, None]
-        
-        killers = self.killer_moves[depth]
+    def _add_killer_move(self, ply: int, move: int):
+        """Thêm killer move ở ply"""
+        if ply >= MAX_PLY:
+            return
+        killers = self.killer_moves[ply]
         if move != killers[0]:
             killers[1] = killers[0]
             killers[0] = move
     
-    def _update_history(self, move: tuple, depth: int):
-        """Cập nhật history heuristic"""
-        if move not in self.history:
-            self.history[move] = 0
-        self.history[move] += depth * depth
+    def _update_history(self, index: int, depth: int):
+        """Cập nhật history heuristic, chia đôi cả bảng khi 1 ô vượt HISTORY_MAX"""
+        history = self.history
+        history[index] += depth * depth
+        if history[index] > HISTORY_MAX:
+            self._halve_history()
+    
+    def _halve_history(self):
+        """Chia đôi history tại chỗ: các MovePicker đang mở giữ cùng list vẫn thấy bảng mới"""
+        history = self.history
+        for i in range(len(history)):
+            history[i] >>= 1
     
-    def _order_moves(self, board: Board, moves: list, depth: int):
+    def _age_tables(self):
         """
-        Sắp xếp nước đi để cải thiện Alpha-Beta Pruning
-        Thứ tự ưu tiên:
-        1. Ăn quân lớn bằng quân nhỏ (MVV-LVA)
-        2. Killer moves
-        3. History heuristic
-        4. Di chuyển thường
+        Làm cũ bảng giữa 2 lần chọn nước: history chia đôi, killer dời 2 ply
+        (root mới sâu hơn root cũ 2 ply: 1 nước của AI + 1 nước của đối thủ)
         """
-        def move_score(move):
-            fr, fc, tr, tc = move
-            score = 0
-            
-            target = board.get_piece(tr, tc)
-            attacker = board.get_piece(fr, fc)
-            
-            # MVV-LVA: Most Valuable Victim - Least Valuable Attacker
-            if target:
-                victim_value = PIECE_VALUES.get(target['type'], 0)
-                attacker_value = PIECE_VALUES.get(attacker['type'], 0) if attacker else 0
-                score += 10000 + victim_value * 10 - attacker_value
-            
-            # Killer moves bonus
-            if depth in self.killer_moves:
-                if move == self.killer_moves[depth][0]:
-                    score += 9000
-                elif move == self.killer_moves[depth][1]:
-                    score += 8000
-            
-            # History heuristic
-            score += self.history.get(move, 0)
-            
-            return score
-        
-        return sorted(moves, key=move_score, reverse=True)
+        self._halve_history()
+        self.killer_moves = self.killer_moves[2:] + [[None, None], [None, None]]
+    
+    def _move_picker(self, board: Board, moves: list, ply: int):
+        """MovePicker cho node ở ply: hash move từ TT, killer, counter move và history của AI"""
+        killers = self.killer_moves[ply] if ply < MAX_PLY else (None, None)
+        counter = None
+        previous = board.last_move()
+        if previous:
+            pfr, pfc, ptr, ptc = previous
+            counter = self.counter_moves[(pfr * 9 + pfc) * 90 + ptr * 9 + ptc]
+        return MovePicker(board, moves, self.tt.probe_move(board), killers, counter, self.history)
     
     def _evaluate(self, board: Board):
         """Đánh giá trạng thái bàn cờ"""
@@ -432,35 +1244,6 @@ class ChessAI:
             return f"{name}{fc + 1}-{tc + 1}"
 
 
-class AIManager:
-    """
-    Quản lý AI instances cho các game
-    """
-    
-    _instances = {}
-    
-    @classmethod
-    def get_ai(cls, game_id: str, level: str = "medium", color: str = "black"):
-        """Lấy hoặc tạo AI instance cho game"""
-        key = f"{game_id}_{color}"
-        if key not in cls._instances:
-            cls._instances[key] = ChessAI(level=level, color=color)
-        return cls._instances[key]
-    
-    @classmethod
-    def remove_ai(cls, game_id: str, color: str = None):
-        """Xóa AI instance"""
-        if color:
-            key = f"{game_id}_{color}"
-            if key in cls._instances:
-                del cls._instances[key]
-        else:
-            # Xóa tất cả AI của game
-            keys_to_remove = [k for k in cls._instances if k.startswith(f"{game_id}_")]
-            for key in keys_to_remove:
-                del cls._instances[key]
-
-
 # Hàm tiện ích
 def get_ai_move(board: Board, level: str = "medium", color: str = "black"):
     """
@@ -472,7 +1255,7 @@ def get_ai_move(board: Board, level: str = "medium", color: str = "black"):
         color: Màu quân AI
     
     Returns:
-        (from_row, from_col, to_row, to_col) hoặc None
+        Nước đi dạng số nguyên (board.decode_move để đổi sang tuple) hoặc None
     """
     ai = ChessAI(level=level, color=color)
     return ai.choose_move(board)
@@ -490,8 +1273,8 @@ if __name__ == "__main__":
     print("\nAI đang suy nghĩ...")
     move = ai.choose_move(board)
     
-    if move:
-        fr, fc, tr, tc = move
+    if move is not None:
+        fr, fc, tr, tc = MOVE_COORDS[move]
         print(f"AI chọn: ({fr}, {fc}) -> ({tr}, {tc})")
     else:
         print("AI không có nước đi!")
@@ -0,0 +1,175 @@
+"""
+Quản lý ChessAI của các game PvE trong process web, trong giới hạn bộ nhớ chung
+
+Mỗi ChessAI chủ yếu tốn bộ nhớ ở transposition table (~TT_ENTRY_BYTES / entry, tối đa
+50000 entry ~ 17MB), nên số game PvE đang mở (kể cả game bị bỏ dở) quyết định bộ nhớ
+của server. AIManager:
+- Giữ engine theo (game_id, màu) trong LRU; game lấy engine qua get_ai() mỗi lần dùng,
+  không giữ tham chiếu riêng, nên engine bị bỏ khỏi manager là được giải phóng
+- Giữ tổng dung lượng đã cấp (reserved: phần cố định + max_size TT của mọi engine), cập nhật
+  khi thêm / đổi kích thước / bỏ engine; chỉ khi tổng vượt ngân sách (memory_budget) mới chia
+  lại: engine rảnh quá idle_seconds chỉ được min_tt_entries, phần còn lại chia đều cho engine
+  đang dùng (tối đa max_tt_entries); TT vượt phần của mình bị thu nhỏ (bỏ entry cũ nhất).
+  Engine đã bị thu nhỏ được nới lại từ phần ngân sách còn trống khi được dùng
+- Ngân sách không đủ cho min_tt_entries của mọi engine: bỏ engine dùng lâu nhất;
+  game đó đi nước kế tiếp với engine mới (TT, history, killer trống)
+- Engine pool bật: reserve_workers() cắt phần ngân sách cho engine trong các worker process
+  (mỗi engine 1 TT cố định, tính như engine đầy), phần còn lại mới chia cho engine trong process web
+- memory(): số engine, số entry TT, bộ nhớ ước tính, số lần thu nhỏ / bỏ engine
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from server.ai import ChessAI
+
+# Bộ nhớ ước tính (byte) của 1 entry TT (key + dict depth/value/flag/move) và phần cố định
+# của 1 ChessAI (history, killer, counter move...), đo bằng tracemalloc trên CPython 3
+TT_ENTRY_BYTES = 336
+ENGINE_BASE_BYTES = 82 * 1024
+
+
+class AIManager:
+    """
+    LRU các ChessAI theo (game_id, màu) với ngân sách bộ nhớ chung cho TT
+    
+    Args:
+        memory_budget: tổng bộ nhớ cho các engine (byte)
+        max_tt_entries: số entry TT tối đa của 1 engine
+        min_tt_entries: số entry TT tối thiểu, ít hơn thì bỏ hẳn engine dùng lâu nhất
+        idle_seconds: engine không được dùng quá chừng này giây bị thu về min_tt_entries
+    """
+    
+    def __init__(self, memory_budget: int = 256 * 1024 * 1024, max_tt_entries: int = 50000,
+                 min_tt_entries: int = 2000, idle_seconds: float = 300):
+        self.memory_budget = memory_budget
+        self.max_tt_entries = max_tt_entries
+        self.min_tt_entries = min(min_tt_entries, max_tt_entries)
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.engines = OrderedDict()  # (game_id, color) -> [ChessAI, lần dùng cuối (monotonic)]
+        self.reserved = 0  # Byte đã cấp cho các engine (ENGINE_BASE_BYTES + max_size TT)
+        self.worker_engines = 0
+        self.worker_tt_entries = 0
+        self.worker_reserved = 0  # Byte cắt cho engine trong worker process (reserve_workers)
+        self.created = 0
+        self.evictions = 0
+        self.shrinks = 0
+        self.rebalances = 0
+    
+    def get_ai(self, game_id, level: str = "medium", color: str = "black") -> ChessAI:
+        """Engine của game (tạo mới nếu chưa có, đã bị bỏ hoặc đổi level) và đánh dấu vừa dùng"""
+        key = (game_id, color)
+        with self.lock:
+            entry = self.engines.pop(key, None)
+            if entry is not None and entry[0].level != level:
+                self.reserved -= self._capacity(entry[0])
+                entry = None
+            if entry is None:
+                ai = ChessAI(level=level, color=color)
+                ai.tt.max_size = self.max_tt_entries
+                entry = [ai, 0.0]
+                self.reserved += self._capacity(ai)
+                self.created += 1
+            entry[1] = time.monotonic()
+            self.engines[key] = entry
+            
+            if self.reserved > self.local_budget:
+                self._rebalance()
+            else:
+                self._grow(entry[0])
+            return entry[0]
+    
+    def remove_ai(self, game_id, color: str = None):
+        """Bỏ engine của game (color = None: mọi màu)"""
+        with self.lock:
+            for key in [key for key in self.engines if key[0] == game_id and color in (None, key[1])]:
+                self.reserved -= self._capacity(self.engines.pop(key)[0])
+    
+    @property
+    def local_budget(self) -> int:
+        """Ngân sách cho engine trong process web (trừ phần của worker process)"""
+        return max(0, self.memory_budget - self.worker_reserved)
+    
+    def reserve_workers(self, engines: int, share: float = 0.5) -> int:
+        """
+        Cắt phần ngân sách (share) cho engines engine trong các worker process của engine pool
+        
+        Returns:
+            Số entry TT tối đa của mỗi engine trong worker (min_tt_entries..max_tt_entries)
+        """
+        with self.lock:
+            if engines <= 0:
+                self.worker_engines = self.worker_tt_entries = self.worker_reserved = 0
+                return 0
+            if engines == self.worker_engines:
+                return self.worker_tt_entries
+            pool_budget = int(self.memory_budget * share) - engines * ENGINE_BASE_BYTES
+            tt_entries = max(self.min_tt_entries, min(self.max_tt_entries, pool_budget // engines // TT_ENTRY_BYTES))
+            self.worker_engines = engines
+            self.worker_tt_entries = tt_entries
+            self.worker_reserved = engines * (ENGINE_BASE_BYTES + tt_entries * TT_ENTRY_BYTES)
+            if self.reserved > self.local_budget:
+                self._rebalance()
+            return tt_entries
+    
+    @staticmethod
+    def _capacity(ai: ChessAI) -> int:
+        """Byte cấp cho engine: phần cố định + TT đầy tới max_size"""
+        return ENGINE_BASE_BYTES + ai.tt.max_size * TT_ENTRY_BYTES
+    
+    def _grow(self, ai: ChessAI):
+        """Nới TT của engine (đã bị thu nhỏ) trong phần ngân sách còn trống"""
+        grow = min(self.max_tt_entries - ai.tt.max_size, (self.local_budget - self.reserved) // TT_ENTRY_BYTES)
+        if grow > 0:
+            ai.tt.resize(ai.tt.max_size + grow)
+            self.reserved += grow * TT_ENTRY_BYTES
+    
+    def _rebalance(self):
+        """Chia lại số entry TT cho các engine theo ngân sách, bỏ engine dùng lâu nhất nếu thiếu"""
+        self.rebalances += 1
+        budget_entries = (self.local_budget - len(self.engines) * ENGINE_BASE_BYTES) // TT_ENTRY_BYTES
+        while len(self.engines) > 1 and budget_entries < len(self.engines) * self.min_tt_entries:
+            self.engines.popitem(last=False)
+            self.evictions += 1
+            budget_entries = (self.local_budget - len(self.engines) * ENGINE_BASE_BYTES) // TT_ENTRY_BYTES
+        
+        idle_before = time.monotonic() - self.idle_seconds
+        active = [entry[0] for entry in self.engines.values() if entry[1] >= idle_before]
+        idle = [entry[0] for entry in self.engines.values() if entry[1] < idle_before]
+        share = self.max_tt_entries
+        if active:
+            share = (budget_entries - len(idle) * self.min_tt_entries) // len(active)
+            share = max(self.min_tt_entries, min(self.max_tt_entries, share))
+        
+        for ai, size in [(ai, share) for ai in active] + [(ai, self.min_tt_entries) for ai in idle]:
+            if ai.tt.max_size != size:
+                if len(ai.tt.table) > size:
+                    self.shrinks += 1
+                ai.tt.resize(size)
+        self.reserved = sum(self._capacity(entry[0]) for entry in self.engines.values())
+    
+    def memory(self):
+        """Bộ nhớ ước tính của các engine trong process web cho API / log (kèm phần cắt cho worker)"""
+        with self.lock:
+            tt_entries = sum(len(entry[0].tt.table) for entry in self.engines.values())
+            tt_capacity = sum(entry[0].tt.max_size for entry in self.engines.values())
+            estimated = len(self.engines) * ENGINE_BASE_BYTES + tt_entries * TT_ENTRY_BYTES
+            return {
+                'engines': len(self.engines),
+                'tt_entries': tt_entries,
+                'tt_capacity': tt_capacity,
+                'estimated_bytes': estimated,
+                'reserved_bytes': self.reserved,
+                'budget_bytes': self.memory_budget,
+                'local_budget_bytes': self.local_budget,
+                'budget_used': round(estimated / self.memory_budget, 4) if self.memory_budget else 0.0,
+                'worker_engines': self.worker_engines,
+                'worker_tt_entries': self.worker_tt_entries,
+                'worker_reserved_bytes': self.worker_reserved,
+                'created': self.created,
+                'evictions': self.evictions,
+                'shrinks': self.shrinks,
+                'rebalances': self.rebalances
+            }
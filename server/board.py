@@ -6,6 +6,7 @@ Bao gồm:
 - Sinh các nước đi có thể
 - Kiểm tra chiếu tướng, chiếu hết
 """
+import random
 from copy import deepcopy
 
 
@@ -163,6 +164,63 @@ POSITION_TABLES = {
     'P': PAWN_PST
 }
 
+# Zobrist hashing - mỗi (quân, ô) có 1 số ngẫu nhiên 64-bit
+# Seed cố định để mọi process (AI, server) sinh cùng một key cho cùng vị trí
+PIECE_INDEX = {
+    ('K', 'red'): 0, ('A', 'red'): 1, ('E', 'red'): 2, ('R', 'red'): 3,
+    ('N', 'red'): 4, ('C', 'red'): 5, ('P', 'red'): 6,
+    ('K', 'black'): 7, ('A', 'black'): 8, ('E', 'black'): 9, ('R', 'black'): 10,
+    ('N', 'black'): 11, ('C', 'black'): 12, ('P', 'black'): 13
+}
+
+_zobrist_rng = random.Random(20240607)
+ZOBRIST_PIECES = [[_zobrist_rng.getrandbits(64) for _ in range(90)] for _ in range(14)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_rng.getrandbits(64)
+
+# Điểm quân + vị trí (góc nhìn Đỏ) của mỗi (quân, ô), dùng cho đánh giá nhanh tăng dần
+PIECE_SQUARE_SCORES = [[0] * 90 for _ in range(14)]
+for (_ptype, _color), _index in PIECE_INDEX.items():
+    for _sq in range(90):
+        _r, _c = divmod(_sq, 9)
+        _pst = POSITION_TABLES[_ptype][_r if _color == 'red' else 9 - _r][_c]
+        _score = PIECE_VALUES[_ptype] + _pst
+        PIECE_SQUARE_SCORES[_index][_sq] = _score if _color == 'red' else -_score
+
+# Nước đi dạng số nguyên (dùng trong AI search): ô đi * 90 + ô đến, ô = hàng * 9 + cột
+# Giá trị 0..8099 (vừa 13 bit); MOVE_COORDS[move] = (fr, fc, tr, tc) tạo sẵn, giải mã không cấp phát
+MOVE_COORDS = tuple((from_sq // 9, from_sq % 9, to_sq // 9, to_sq % 9)
+                    for from_sq in range(90) for to_sq in range(90))
+
+
+def encode_move(fr, fc, tr, tc):
+    """(fr, fc, tr, tc) -> nước đi dạng số nguyên"""
+    return (fr * 9 + fc) * 90 + tr * 9 + tc
+
+
+def decode_move(move):
+    """Nước đi dạng số nguyên -> (fr, fc, tr, tc)"""
+    return MOVE_COORDS[move]
+
+
+def mirror_move(move):
+    """Nước đi đối xứng trái-phải (cột c <-> 8 - c)"""
+    fr, fc, tr, tc = MOVE_COORDS[move]
+    return (fr * 9 + 8 - fc) * 90 + tr * 9 + 8 - tc
+
+
+# Ký hiệu FEN (chuẩn cờ tướng quốc tế: chữ hoa = Đỏ, chữ thường = Đen, Tượng = 'b')
+FEN_SYMBOLS = {'K': 'k', 'A': 'a', 'E': 'b', 'R': 'r', 'N': 'n', 'C': 'c', 'P': 'p'}
+FEN_PIECES = {v: k for k, v in FEN_SYMBOLS.items()}
+
+# Số nước tối đa nhìn lại khi tìm lặp lại (không tính qua nước ăn quân)
+REPETITION_WINDOW = 100
+
+# Phần tử undo_stack của 1 lần mất lượt (Board.pass_turn), so sánh bằng `is`
+PASS_ENTRY = (None, None, None, None, None)
+
+# Quân được phép "đuổi" liên tục theo luật châu Á (Tướng và Tốt được phép)
+CHASING_PIECES = ('R', 'N', 'C', 'A', 'E')
+
 
 class Board:
     """Class đại diện cho bàn cờ tướng"""
@@ -171,6 +229,13 @@ class Board:
         self.grid = [[None for _ in range(9)] for _ in range(10)]
         self.turn = 'red'  # Đỏ đi trước
         self.move_history = []
+        self._piece_key = 0       # Zobrist key của phần quân (không tính lượt đi)
+        self.material = 0         # Điểm quân + vị trí (góc nhìn Đỏ), cập nhật tăng dần
+        self.piece_count = 0      # Số quân trên bàn (cả 2 bên), cập nhật tăng dần
+        self.ply = 0              # Số lượt đã qua từ đầu ván (nước đi + mất lượt), giữ qua serialize / to_dict
+        self.hash_history = []    # Stack key các vị trí đã qua, phần tử cuối = vị trí hiện tại
+        self.undo_stack = []      # Stack (fr, fc, tr, tc, captured) cho make/unmake
+        self.end_reason = None    # Lý do kết thúc, được get_game_state() cập nhật
         self.reset()
     
     def reset(self):
@@ -179,6 +244,7 @@ class Board:
         self.grid = [[None for _ in range(9)] for _ in range(10)]
         self.turn = 'red'
         self.move_history = []
+        self.ply = 0
         
         # === QUÂN ĐEN (phía trên, hàng 0-4) ===
         # Hàng 0: Xe, Mã, Tượng, Sĩ, Tướng, Sĩ, Tượng, Mã, Xe
@@ -219,6 +285,8 @@ class Board:
         # Hàng 6: Tốt
         for c in range(0, 9, 2):
             self.grid[6][c] = {'type': 'P', 'color': 'red'}  # Tốt
+        
+        self._reset_hash()
     
     def clone(self):
         """Tạo bản sao của bàn cờ"""
@@ -226,8 +294,147 @@ class Board:
         b.grid = deepcopy(self.grid)
         b.turn = self.turn
         b.move_history = self.move_history.copy()
+        b._piece_key = self._piece_key
+        b.material = self.material
+        b.piece_count = self.piece_count
+        b.ply = self.ply
+        b.hash_history = self.hash_history.copy()
+        b.undo_stack = self.undo_stack.copy()
         return b
     
+    # ============================================
+    # ZOBRIST HASH & MAKE/UNMAKE
+    # ============================================
+    
+    @property
+    def zobrist_key(self):
+        """Zobrist key của vị trí hiện tại (bao gồm lượt đi)"""
+        if self.turn == 'black':
+            return self._piece_key ^ ZOBRIST_BLACK_TO_MOVE
+        return self._piece_key
+    
+    def mirror_zobrist_key(self):
+        """Zobrist key (gồm lượt đi) của vị trí đối xứng trái-phải, cột c <-> 8 - c"""
+        key = ZOBRIST_BLACK_TO_MOVE if self.turn == 'black' else 0
+        for r in range(10):
+            for c in range(9):
+                piece = self.grid[r][c]
+                if piece:
+                    key ^= ZOBRIST_PIECES[PIECE_INDEX[(piece['type'], piece['color'])]][r * 9 + 8 - c]
+        return key
+    
+    def compute_piece_key(self):
+        """Tính lại toàn bộ Zobrist key phần quân từ grid"""
+        key = 0
+        for r in range(10):
+            for c in range(9):
+                piece = self.grid[r][c]
+                if piece:
+                    key ^= ZOBRIST_PIECES[PIECE_INDEX[(piece['type'], piece['color'])]][r * 9 + c]
+        return key
+    
+    def compute_material(self):
+        """Tính lại toàn bộ điểm quân + vị trí (góc nhìn Đỏ) từ grid"""
+        score = 0
+        for r in range(10):
+            for c in range(9):
+                piece = self.grid[r][c]
+                if piece:
+                    score += PIECE_SQUARE_SCORES[PIECE_INDEX[(piece['type'], piece['color'])]][r * 9 + c]
+        return score
+    
+    def _reset_hash(self):
+        """Khởi tạo lại key, điểm quân và stack lịch sử (vị trí hiện tại là gốc)"""
+        self._piece_key = self.compute_piece_key()
+        self.material = self.compute_material()
+        self.piece_count = sum(1 for row in self.grid for piece in row if piece)
+        self.hash_history = [self.zobrist_key]
+        self.undo_stack = []
+    
+    def make_move(self, fr, fc, tr, tc):
+        """
+        Thực hiện nước đi KHÔNG kiểm tra hợp lệ (dùng cho AI search)
+        Cập nhật Zobrist key tăng dần và đẩy vào stack lịch sử
+        
+        Returns:
+            Quân bị ăn (hoặc None)
+        """
+        grid = self.grid
+        piece = grid[fr][fc]
+        captured = grid[tr][tc]
+        
+        index = PIECE_INDEX[(piece['type'], piece['color'])]
+        from_sq = fr * 9 + fc
+        to_sq = tr * 9 + tc
+        table = ZOBRIST_PIECES[index]
+        key = self._piece_key ^ table[from_sq] ^ table[to_sq]
+        scores = PIECE_SQUARE_SCORES[index]
+        material = self.material - scores[from_sq] + scores[to_sq]
+        if captured:
+            captured_index = PIECE_INDEX[(captured['type'], captured['color'])]
+            key ^= ZOBRIST_PIECES[captured_index][to_sq]
+            material -= PIECE_SQUARE_SCORES[captured_index][to_sq]
+            self.piece_count -= 1
+        self._piece_key = key
+        self.material = material
+        
+        grid[tr][tc] = piece
+        grid[fr][fc] = None
+        self.turn = 'black' if self.turn == 'red' else 'red'
+        self.ply += 1
+        
+        self.undo_stack.append((fr, fc, tr, tc, captured))
+        self.hash_history.append(self.zobrist_key)
+        return captured
+    
+    def pass_turn(self):
+        """
+        Mất lượt: đổi bên đi (Zobrist key đổi theo lượt) và đẩy key mới vào stack lịch sử
+        Trong undo_stack là PASS_ENTRY, được coi như nước không thể đảo ngược (giống nước ăn
+        quân) khi tìm vị trí lặp lại
+        """
+        self.turn = 'black' if self.turn == 'red' else 'red'
+        self.ply += 1
+        self.undo_stack.append(PASS_ENTRY)
+        self.hash_history.append(self.zobrist_key)
+    
+    def last_move(self):
+        """Nước đi cuối trong undo_stack (fr, fc, tr, tc), None nếu chưa có hoặc là mất lượt"""
+        if not self.undo_stack or self.undo_stack[-1] is PASS_ENTRY:
+            return None
+        return self.undo_stack[-1][:4]
+    
+    def unmake_move(self):
+        """Hoàn tác nước đi cuối cùng của make_move() (hoặc pass_turn())"""
+        entry = self.undo_stack.pop()
+        self.hash_history.pop()
+        self.ply -= 1
+        if entry is PASS_ENTRY:
+            self.turn = 'black' if self.turn == 'red' else 'red'
+            return
+        fr, fc, tr, tc, captured = entry
+        
+        grid = self.grid
+        piece = grid[tr][tc]
+        grid[fr][fc] = piece
+        grid[tr][tc] = captured
+        self.turn = 'black' if self.turn == 'red' else 'red'
+        
+        index = PIECE_INDEX[(piece['type'], piece['color'])]
+        from_sq = fr * 9 + fc
+        to_sq = tr * 9 + tc
+        table = ZOBRIST_PIECES[index]
+        key = self._piece_key ^ table[from_sq] ^ table[to_sq]
+        scores = PIECE_SQUARE_SCORES[index]
+        material = self.material + scores[from_sq] - scores[to_sq]
+        if captured:
+            captured_index = PIECE_INDEX[(captured['type'], captured['color'])]
+            key ^= ZOBRIST_PIECES[captured_index][to_sq]
+            material += PIECE_SQUARE_SCORES[captured_index][to_sq]
+            self.piece_count += 1
+        self._piece_key = key
+        self.material = material
+    
     def get_piece(self, r, c):
         """Lấy quân cờ tại vị trí (r, c)"""
         if not in_bounds(r, c):
@@ -237,7 +444,20 @@ class Board:
     def set_piece(self, r, c, piece):
         """Đặt quân cờ tại vị trí (r, c)"""
         if in_bounds(r, c):
+            old = self.grid[r][c]
+            if old:
+                index = PIECE_INDEX[(old['type'], old['color'])]
+                self._piece_key ^= ZOBRIST_PIECES[index][r * 9 + c]
+                self.material -= PIECE_SQUARE_SCORES[index][r * 9 + c]
+                self.piece_count -= 1
+            if piece:
+                index = PIECE_INDEX[(piece['type'], piece['color'])]
+                self._piece_key ^= ZOBRIST_PIECES[index][r * 9 + c]
+                self.material += PIECE_SQUARE_SCORES[index][r * 9 + c]
+                self.piece_count += 1
             self.grid[r][c] = piece
+            if self.hash_history:
+                self.hash_history[-1] = self.zobrist_key
     
     def find_king(self, color):
         """Tìm vị trí Tướng của một bên"""
@@ -463,18 +683,252 @@ class Board:
             return True  # Không tìm thấy tướng = thua
         
         enemy_color = 'black' if color == 'red' else 'red'
+        return self.is_square_attacked(king_pos[0], king_pos[1], enemy_color)
+    
+    def is_square_attacked(self, r, c, by_color):
+        """
+        Kiểm tra ô (r, c) có bị quân của by_color khống chế không
+        (không quan tâm quân đang đứng ở ô đó là của bên nào)
+        Dò ngược từ ô đích thay vì sinh nước đi cho mọi quân
+        """
+        grid = self.grid
+        target = grid[r][c]
         
-        # Kiểm tra tất cả quân địch có thể ăn Tướng không
-        for r in range(10):
-            for c in range(9):
-                piece = self.get_piece(r, c)
-                if piece and piece['color'] == enemy_color:
-                    moves = self.generate_moves_for(r, c)
-                    if king_pos in moves:
+        # Xe, Pháo, Tướng (kể cả "đối mặt tướng") theo 4 hướng thẳng
+        for dr, dc in ((0, 1), (0, -1), (1, 0), (-1, 0)):
+            nr, nc = r + dr, c + dc
+            screens = 0
+            distance = 1
+            while 0 <= nr < 10 and 0 <= nc < 9:
+                piece = grid[nr][nc]
+                if piece:
+                    if piece['color'] == by_color:
+                        ptype = piece['type']
+                        if screens == 0:
+                            if ptype == 'R':
+                                return True
+                            if ptype == 'K':
+                                if distance == 1 and in_palace(r, c, by_color):
+                                    return True
+                                if dc == 0 and target and target['type'] == 'K':
+                                    return True
+                        elif ptype == 'C':
+                            return True
+                    screens += 1
+                    if screens > 1:
+                        break
+                nr, nc = nr + dr, nc + dc
+                distance += 1
+        
+        # Mã: đứng ở vị trí chữ nhật và chân mã không bị cản
+        for dr, dc in ((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (1, -2), (-1, 2), (1, 2)):
+            nr, nc = r + dr, c + dc
+            if 0 <= nr < 10 and 0 <= nc < 9:
+                piece = grid[nr][nc]
+                if piece and piece['type'] == 'N' and piece['color'] == by_color:
+                    # Chân mã nằm cạnh Mã, theo hướng bước dài về phía ô đích
+                    if abs(dr) == 2:
+                        leg_r, leg_c = nr - dr // 2, nc
+                    else:
+                        leg_r, leg_c = nr, nc - dc // 2
+                    if not grid[leg_r][leg_c]:
+                        return True
+        
+        # Tốt: phía sau (theo hướng tiến) hoặc hai bên nếu đã qua sông
+        if by_color == 'red':
+            pawn_r, crossed = r + 1, r <= 4
+        else:
+            pawn_r, crossed = r - 1, r >= 5
+        if 0 <= pawn_r < 10:
+            piece = grid[pawn_r][c]
+            if piece and piece['type'] == 'P' and piece['color'] == by_color:
+                return True
+        if crossed:
+            for nc in (c - 1, c + 1):
+                if 0 <= nc < 9:
+                    piece = grid[r][nc]
+                    if piece and piece['type'] == 'P' and piece['color'] == by_color:
+                        return True
+        
+        # Sĩ: chéo 1 ô trong cung
+        if in_palace(r, c, by_color):
+            for dr, dc in ((1, 1), (1, -1), (-1, 1), (-1, -1)):
+                nr, nc = r + dr, c + dc
+                if in_palace(nr, nc, by_color):
+                    piece = grid[nr][nc]
+                    if piece and piece['type'] == 'A' and piece['color'] == by_color:
                         return True
         
+        # Tượng: chéo 2 ô, mắt tượng trống, không qua sông
+        if in_own_half(r, by_color):
+            for dr, dc in ((2, 2), (2, -2), (-2, 2), (-2, -2)):
+                nr, nc = r + dr, c + dc
+                if 0 <= nr < 10 and 0 <= nc < 9 and in_own_half(nr, by_color):
+                    piece = grid[nr][nc]
+                    if piece and piece['type'] == 'E' and piece['color'] == by_color:
+                        if not grid[r + dr // 2][c + dc // 2]:
+                            return True
+        
         return False
     
+    def _least_valuable_attacker(self, r, c, by_color):
+        """
+        Tìm quân rẻ nhất của by_color đang khống chế ô (r, c) trên grid hiện tại
+        (dùng cho SEE, bỏ qua luật tướng đối mặt)
+        
+        Returns:
+            (giá trị, row, col) hoặc None
+        """
+        grid = self.grid
+        best = None
+        
+        # Xe, Pháo, Tướng theo 4 hướng thẳng (ngòi Pháo tính trên grid hiện tại)
+        for dr, dc in ((0, 1), (0, -1), (1, 0), (-1, 0)):
+            nr, nc = r + dr, c + dc
+            screens = 0
+            distance = 1
+            while 0 <= nr < 10 and 0 <= nc < 9:
+                piece = grid[nr][nc]
+                if piece:
+                    if piece['color'] == by_color:
+                        ptype = piece['type']
+                        if ((screens == 0 and (ptype == 'R' or (ptype == 'K' and distance == 1
+                                                                 and in_palace(r, c, by_color))))
+                                or (screens == 1 and ptype == 'C')):
+                            value = PIECE_VALUES[ptype]
+                            if best is None or value < best[0]:
+                                best = (value, nr, nc)
+                    screens += 1
+                    if screens > 1:
+                        break
+                nr, nc = nr + dr, nc + dc
+                distance += 1
+        
+        # Mã
+        for dr, dc in ((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (1, -2), (-1, 2), (1, 2)):
+            nr, nc = r + dr, c + dc
+            if 0 <= nr < 10 and 0 <= nc < 9:
+                piece = grid[nr][nc]
+                if piece and piece['type'] == 'N' and piece['color'] == by_color:
+                    if abs(dr) == 2:
+                        leg_r, leg_c = nr - dr // 2, nc
+                    else:
+                        leg_r, leg_c = nr, nc - dc // 2
+                    if not grid[leg_r][leg_c] and (best is None or PIECE_VALUES['N'] < best[0]):
+                        best = (PIECE_VALUES['N'], nr, nc)
+        
+        # Tốt là quân rẻ nhất, gặp là trả về luôn
+        if by_color == 'red':
+            pawn_r, crossed = r + 1, r <= 4
+        else:
+            pawn_r, crossed = r - 1, r >= 5
+        if 0 <= pawn_r < 10:
+            piece = grid[pawn_r][c]
+            if piece and piece['type'] == 'P' and piece['color'] == by_color:
+                return (PIECE_VALUES['P'], pawn_r, c)
+        if crossed:
+            for nc in (c - 1, c + 1):
+                if 0 <= nc < 9:
+                    piece = grid[r][nc]
+                    if piece and piece['type'] == 'P' and piece['color'] == by_color:
+                        return (PIECE_VALUES['P'], r, nc)
+        
+        # Sĩ
+        if in_palace(r, c, by_color):
+            for dr, dc in ((1, 1), (1, -1), (-1, 1), (-1, -1)):
+                nr, nc = r + dr, c + dc
+                if in_palace(nr, nc, by_color):
+                    piece = grid[nr][nc]
+                    if (piece and piece['type'] == 'A' and piece['color'] == by_color
+                            and (best is None or PIECE_VALUES['A'] < best[0])):
+                        best = (PIECE_VALUES['A'], nr, nc)
+        
+        # Tượng
+        if in_own_half(r, by_color):
+            for dr, dc in ((2, 2), (2, -2), (-2, 2), (-2, -2)):
+                nr, nc = r + dr, c + dc
+                if 0 <= nr < 10 and 0 <= nc < 9 and in_own_half(nr, by_color):
+                    piece = grid[nr][nc]
+                    if (piece and piece['type'] == 'E' and piece['color'] == by_color
+                            and not grid[r + dr // 2][c + dc // 2]
+                            and (best is None or PIECE_VALUES['E'] < best[0])):
+                        best = (PIECE_VALUES['E'], nr, nc)
+        
+        return best
+    
+    def see(self, fr, fc, tr, tc):
+        """
+        Static Exchange Evaluation: điểm quân thắng/thua (góc nhìn bên đi) nếu hai bên
+        lần lượt ăn trao đổi trên ô (tr, tc), mỗi lần bằng quân rẻ nhất.
+        Quân rời ô được nhấc khỏi grid nên ngòi Pháo xuất hiện / biến mất đúng theo
+        thứ tự trao đổi, Xe sau Xe cũng được tính. Mỗi bên có thể dừng ăn bất kỳ lúc nào.
+        Không kiểm tra ghim quân.
+        
+        Returns:
+            int: >= 0 là nước ăn không thiệt
+        """
+        grid = self.grid
+        piece = grid[fr][fc]
+        target = grid[tr][tc]
+        if not piece:
+            return 0
+        
+        gains = [PIECE_VALUES[target['type']] if target else 0]
+        removed = [(fr, fc, piece)]
+        grid[fr][fc] = None
+        grid[tr][tc] = piece
+        on_square = PIECE_VALUES[piece['type']]
+        side = 'black' if piece['color'] == 'red' else 'red'
+        
+        while True:
+            attacker = self._least_valuable_attacker(tr, tc, side)
+            if not attacker:
+                break
+            value, ar, ac = attacker
+            gains.append(on_square - gains[-1])
+            # Cả hai lựa chọn (ăn hay dừng) đều thua: không cần xét tiếp
+            if max(-gains[-2], gains[-1]) < 0:
+                break
+            removed.append((ar, ac, grid[ar][ac]))
+            grid[tr][tc] = grid[ar][ac]
+            grid[ar][ac] = None
+            on_square = value
+            side = 'black' if side == 'red' else 'red'
+        
+        # Khôi phục grid
+        for r, c, p in removed:
+            grid[r][c] = p
+        grid[tr][tc] = target
+        
+        # Lan ngược: mỗi bên chọn giữa dừng ăn và tiếp tục
+        for i in range(len(gains) - 1, 0, -1):
+            gains[i - 1] = -max(-gains[i - 1], gains[i])
+        return gains[0]
+    
+    def gives_check(self, fr, fc, tr, tc):
+        """Nước đi có chiếu Tướng đối phương không (thử tại chỗ trên grid, không đổi hash)"""
+        grid = self.grid
+        piece = grid[fr][fc]
+        captured = grid[tr][tc]
+        grid[tr][tc] = piece
+        grid[fr][fc] = None
+        check = self.is_in_check('black' if piece['color'] == 'red' else 'red')
+        grid[fr][fc] = piece
+        grid[tr][tc] = captured
+        return check
+    
+    def _leaves_king_safe(self, fr, fc, tr, tc, color):
+        """Thử nước đi tại chỗ (không clone) và kiểm tra Tướng không bị chiếu"""
+        grid = self.grid
+        piece = grid[fr][fc]
+        captured = grid[tr][tc]
+        grid[tr][tc] = piece
+        grid[fr][fc] = None
+        safe = not self.is_in_check(color)
+        grid[fr][fc] = piece
+        grid[tr][tc] = captured
+        return safe
+    
     def is_valid_move(self, fr, fc, tr, tc):
         """
         Kiểm tra nước đi có hợp lệ không
@@ -494,11 +948,7 @@ class Board:
             return False, "Nước đi không hợp lệ"
         
         # Thử đi và kiểm tra có để vua bị chiếu không
-        test_board = self.clone()
-        test_board.grid[tr][tc] = test_board.grid[fr][fc]
-        test_board.grid[fr][fc] = None
-        
-        if test_board.is_in_check(piece['color']):
+        if not self._leaves_king_safe(fr, fc, tr, tc, piece['color']):
             return False, "Nước đi này để Tướng bị chiếu"
         
         return True, ""
@@ -525,30 +975,21 @@ class Board:
             'captured': deepcopy(captured)
         })
         
-        # Thực hiện di chuyển
-        self.grid[tr][tc] = piece
-        self.grid[fr][fc] = None
-        
-        # Đổi lượt
-        self.turn = 'black' if self.turn == 'red' else 'red'
+        # Thực hiện di chuyển, đổi lượt và cập nhật hash
+        self.make_move(fr, fc, tr, tc)
         
         return True, "OK", captured
     
     def undo_move(self):
-        """Hoàn tác nước đi cuối cùng"""
+        """Hoàn tác nước đi cuối cùng (kèm các lần mất lượt sau nó)"""
         if not self.move_history:
             return False
         
-        last_move = self.move_history.pop()
-        fr, fc = last_move['from']
-        tr, tc = last_move['to']
-        
-        # Đặt lại quân
-        self.grid[fr][fc] = last_move['piece']
-        self.grid[tr][tc] = last_move['captured']
-        
-        # Đổi lượt về
-        self.turn = 'black' if self.turn == 'red' else 'red'
+        self.move_history.pop()
+        while self.undo_stack and self.undo_stack[-1] is PASS_ENTRY:
+            self.unmake_move()
+        if self.undo_stack:
+            self.unmake_move()
         
         return True
     
@@ -560,20 +1001,28 @@ class Board:
         Returns:
             List of (from_row, from_col, to_row, to_col) tuples
         """
+        return [MOVE_COORDS[move] for move in self.legal_move_codes(color)]
+    
+    def legal_move_codes(self, color):
+        """
+        Như legal_moves nhưng trả về nước đi dạng số nguyên (xem encode_move), dùng cho AI search
+        
+        Returns:
+            List of int (ô đi * 90 + ô đến)
+        """
         moves = []
+        grid = self.grid
         
         for r in range(10):
+            row = grid[r]
             for c in range(9):
-                piece = self.get_piece(r, c)
+                piece = row[c]
                 if piece and piece['color'] == color:
+                    base = (r * 9 + c) * 90
                     for tr, tc in self.generate_moves_for(r, c):
                         # Kiểm tra nước đi không để vua bị chiếu
-                        test_board = self.clone()
-                        test_board.grid[tr][tc] = test_board.grid[r][c]
-                        test_board.grid[r][c] = None
-                        
-                        if not test_board.is_in_check(color):
-                            moves.append((r, c, tr, tc))
+                        if self._leaves_king_safe(r, c, tr, tc, color):
+                            moves.append(base + tr * 9 + tc)
         
         return moves
     
@@ -583,32 +1032,160 @@ class Board:
             return False
         
         # Chiếu hết khi đang bị chiếu và không còn nước đi hợp lệ
-        return len(self.legal_moves(color)) == 0
+        return len(self.legal_move_codes(color)) == 0
     
     def is_stalemate(self, color):
         """Kiểm tra hết nước đi (hòa do bế tắc)"""
         if self.is_in_check(color):
             return False
         
-        return len(self.legal_moves(color)) == 0
+        return len(self.legal_move_codes(color)) == 0
+    
+    # ============================================
+    # LẶP LẠI VỊ TRÍ (Luật châu Á: chiếu dai / đuổi dai)
+    # ============================================
+    
+    def find_repetitions(self):
+        """
+        Tìm các lần vị trí hiện tại đã xuất hiện trước đó trong stack hash
+        Chỉ nhìn lại các nước không ăn quân (nước ăn quân là không thể đảo ngược)
+        
+        Returns:
+            List index trong hash_history (gần nhất trước) của các lần trùng
+        """
+        history = self.hash_history
+        undo = self.undo_stack
+        current = history[-1]
+        found = []
+        
+        # hash_history[i] là vị trí TRƯỚC nước undo_stack[i]
+        i = len(undo) - 1
+        limit = max(0, len(undo) - REPETITION_WINDOW)
+        while i >= limit:
+            if undo[i][4] or undo[i] is PASS_ENTRY:  # Nước ăn quân / mất lượt: dừng
+                break
+            if history[i] == current:
+                found.append(i)
+            i -= 1
+        return found
+    
+    def _cycle_violations(self, start):
+        """
+        Phân tích chu kỳ nước đi undo_stack[start:] (đi lại từng nước trên bàn cờ)
+        
+        Returns:
+            dict color -> mức vi phạm: 2 = chiếu dai, 1 = đuổi dai (hoặc chiếu + đuổi), 0 = không
+        """
+        cycle = self.undo_stack[start:]
+        for _ in cycle:
+            self.unmake_move()
+        
+        all_check = {'red': True, 'black': True}
+        all_forcing = {'red': True, 'black': True}
+        moved = {'red': False, 'black': False}
+        
+        for fr, fc, tr, tc, _ in cycle:
+            mover = self.grid[fr][fc]
+            color = mover['color']
+            enemy = 'black' if color == 'red' else 'red'
+            attacked_before = self.generate_moves_for(fr, fc)
+            self.make_move(fr, fc, tr, tc)
+            
+            gives_check = self.is_in_check(enemy)
+            chases = not gives_check and self._is_chase(tr, tc, attacked_before)
+            
+            moved[color] = True
+            all_check[color] = all_check[color] and gives_check
+            all_forcing[color] = all_forcing[color] and (gives_check or chases)
+        
+        violations = {}
+        for color in ('red', 'black'):
+            if moved[color] and all_check[color]:
+                violations[color] = 2
+            elif moved[color] and all_forcing[color]:
+                violations[color] = 1
+            else:
+                violations[color] = 0
+        return violations
+    
+    def _is_chase(self, r, c, attacked_before):
+        """
+        Nước vừa đi tới (r, c) có phải "đuổi" không:
+        quân vừa đi đe dọa MỚI một quân địch (không phải Tướng, không phải Tốt chưa qua sông)
+        mà quân đó không được bảo vệ hoặc có giá trị lớn hơn quân đuổi
+        """
+        piece = self.grid[r][c]
+        if piece['type'] not in CHASING_PIECES:
+            return False
+        
+        enemy = 'black' if piece['color'] == 'red' else 'red'
+        for vr, vc in self.generate_moves_for(r, c):
+            if (vr, vc) in attacked_before:
+                continue
+            victim = self.grid[vr][vc]
+            if not victim or victim['type'] == 'K':
+                continue
+            if victim['type'] == 'P' and in_own_half(vr, enemy):
+                continue
+            if PIECE_VALUES[victim['type']] > PIECE_VALUES[piece['type']]:
+                return True
+            if not self.is_square_attacked(vr, vc, enemy):
+                return True
+        return False
+    
+    def repetition_loser(self, start):
+        """
+        Phân xử chu kỳ lặp bắt đầu tại undo_stack[start]
+        
+        Returns:
+            Màu bên thua ('red'/'black'), hoặc None nếu hòa
+        """
+        violations = self._cycle_violations(start)
+        if violations['red'] > violations['black']:
+            return 'red'
+        if violations['black'] > violations['red']:
+            return 'black'
+        return None
     
-    def get_game_state(self):
+    def get_game_state(self, repetition_limit=3):
         """
         Lấy trạng thái game hiện tại
         
+        Args:
+            repetition_limit: số lần một vị trí xuất hiện thì phân xử lặp lại
+        
         Returns:
             'playing', 'red_wins', 'black_wins', 'draw'
+            (lý do cụ thể được lưu vào self.end_reason)
         """
+        self.end_reason = None
+        
         # Kiểm tra chiếu hết
         if self.is_checkmate('red'):
+            self.end_reason = 'checkmate'
             return 'black_wins'
         if self.is_checkmate('black'):
+            self.end_reason = 'checkmate'
             return 'red_wins'
         
         # Kiểm tra hòa
         if self.is_stalemate(self.turn):
+            self.end_reason = 'stalemate'
             return 'draw'
         
+        # Kiểm tra lặp lại vị trí
+        repeats = self.find_repetitions()
+        if len(repeats) + 1 >= repetition_limit:
+            # Phân xử trên chu kỳ gần nhất
+            violations = self._cycle_violations(repeats[0])
+            red, black = violations['red'], violations['black']
+            if red == black:
+                self.end_reason = 'repetition'
+                return 'draw'
+            loser_level = max(red, black)
+            self.end_reason = 'perpetual_check' if loser_level == 2 else 'perpetual_chase'
+            return 'black_wins' if red > black else 'red_wins'
+        
         return 'playing'
     
     def evaluate(self, color):
@@ -959,13 +1536,112 @@ class Board:
         return {
             'grid': self.grid,
             'turn': self.turn,
-            'move_count': len(self.move_history)
+            'move_count': len(self.move_history),
+            'ply': self.ply
         }
     
     def from_dict(self, data):
         """Khôi phục bàn cờ từ dictionary"""
         self.grid = data.get('grid', [[None for _ in range(9)] for _ in range(10)])
         self.turn = data.get('turn', 'red')
+        self.ply = data.get('ply', data.get('move_count', 0))
+        self._reset_hash()
+    
+    def to_fen(self, full: bool = False):
+        """
+        Chuyển vị trí hiện tại sang chuỗi FEN (hàng 0 = phía Đen)
+        full = True: FEN đủ 6 trường, số nước (fullmove) lấy từ ply để bên nhận khôi phục ply
+        """
+        rows = []
+        for r in range(10):
+            row = ''
+            empty = 0
+            for c in range(9):
+                piece = self.grid[r][c]
+                if piece:
+                    if empty:
+                        row += str(empty)
+                        empty = 0
+                    symbol = FEN_SYMBOLS[piece['type']]
+                    row += symbol.upper() if piece['color'] == 'red' else symbol
+                else:
+                    empty += 1
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        fen = '/'.join(rows) + (' w' if self.turn == 'red' else ' b')
+        if full:
+            fen += f' - - 0 {self.ply // 2 + 1}'
+        return fen
+    
+    def serialize(self):
+        """
+        Dạng gọn để gửi bàn cờ sang process khác (không pickle grid dict):
+        FEN của vị trí đầu chuỗi nước không ăn quân + các nước đi sau đó,
+        đủ để bên nhận dựng lại stack hash cho việc phát hiện lặp lại
+        
+        Returns:
+            (fen, moves) - moves là list (fr, fc, tr, tc)
+        """
+        tail = []
+        for i in range(len(self.undo_stack) - 1, -1, -1):
+            entry = self.undo_stack[i]
+            if entry[4] or entry is PASS_ENTRY or len(tail) >= REPETITION_WINDOW:
+                break
+            tail.append(entry[:4])
+        tail.reverse()
+        
+        for _ in tail:
+            self.unmake_move()
+        fen = self.to_fen(full=True)
+        for fr, fc, tr, tc in tail:
+            self.make_move(fr, fc, tr, tc)
+        return fen, tail
+    
+    @classmethod
+    def from_fen(cls, fen, moves=()):
+        """
+        Tạo bàn cờ từ FEN, rồi đi tiếp các nước trong moves (không kiểm tra hợp lệ)
+        Đọc trường vị trí, bên đi ('w' / 'b', thiếu = 'w') và số nước (trường thứ 6, thiếu = 1)
+        để tính ply; các trường khác bỏ qua. FEN sai định dạng: ValueError
+        """
+        board = cls()
+        fields = fen.split() if isinstance(fen, str) else []
+        if not fields:
+            raise ValueError("FEN rỗng")
+        placement = fields[0]
+        side = fields[1] if len(fields) > 1 else 'w'
+        if side not in ('w', 'b'):
+            raise ValueError(f"Bên đi không hợp lệ: {side}")
+        fullmove = fields[5] if len(fields) > 5 else '1'
+        if not fullmove.isascii() or not fullmove.isdigit():
+            raise ValueError(f"Số nước không hợp lệ: {fullmove}")
+        
+        rows = placement.split('/')
+        if len(rows) != 10:
+            raise ValueError(f"FEN cần 10 hàng, có {len(rows)}")
+        board.grid = [[None for _ in range(9)] for _ in range(10)]
+        for r, row in enumerate(rows):
+            c = 0
+            for ch in row:
+                if ch in '123456789':
+                    c += int(ch)
+                elif ch.lower() in FEN_PIECES and c < 9:
+                    board.grid[r][c] = {
+                        'type': FEN_PIECES[ch.lower()],
+                        'color': 'red' if ch.isupper() else 'black'
+                    }
+                    c += 1
+                else:
+                    raise ValueError(f"Ký tự không hợp lệ ở hàng {r}: {ch}")
+            if c != 9:
+                raise ValueError(f"Hàng {r} có {c} cột thay vì 9")
+        board.turn = 'black' if side == 'b' else 'red'
+        board.ply = max(0, int(fullmove) - 1) * 2 + (1 if side == 'b' else 0)
+        board._reset_hash()
+        for fr, fc, tr, tc in moves:
+            board.make_move(fr, fc, tr, tc)
+        return board
     
     def get_board_string(self):
         """Tạo chuỗi biểu diễn bàn cờ (để debug)"""
@@ -0,0 +1,428 @@
+"""
+Engine pool - search của AI chạy trong các process riêng, không chặn event loop
+
+Production chạy gunicorn 1 worker eventlet: search đồng bộ trong handler Socket.IO
+(tới 10 giây ở level hard) làm đứng mọi game, chat và request HTTP khác. EnginePool:
+- N worker process cố định (AI_ENGINE_WORKERS, 0 = tắt, search tại chỗ như trước)
+- Mỗi worker nối với process chính bằng 1 Pipe: lệnh gồm bàn cờ dạng Board.serialize()
+  + level / màu / thời gian còn lại, kết quả là nước đi + thống kê search
+- Mỗi game luôn đi vào cùng 1 worker (theo game_id) nên TT / killer / history của engine
+  trong worker vẫn ấm giữa các nước; mỗi worker giữ tối đa ENGINES_PER_WORKER engine (LRU),
+  TT mỗi engine tối đa tt_entries entry (phần ngân sách AIManager.reserve_workers() cắt cho pool)
+- Bên chờ kết quả chỉ poll Pipe (không chặn) và nhường event loop bằng sleep giữa các
+  lần poll, các greenlet khác vẫn chạy trong lúc AI suy nghĩ
+- Health check định kỳ: worker đã thoát, không trả lời ping hoặc search quá hạn
+  bị khởi động lại (lệnh đang chờ của worker đó trả về None, bên gọi tự search tại chỗ)
+- Hủy search (CancelToken của bên gọi): bên chờ ghi job_id vào ô nhớ dùng chung của worker,
+  search trong worker thấy ở lần đọc đồng hồ kế tiếp và dừng; kết quả trả về sau đó chỉ
+  được cộng vào thống kê
+"""
+
+import atexit
+import itertools
+import logging
+import multiprocessing as mp
+import threading
+import time
+from collections import OrderedDict
+
+from server.ai import ChessAI, NODE_BUDGET_TIME_FACTOR
+from server.ai_manager import ENGINE_BASE_BYTES, TT_ENTRY_BYTES
+from server.board import Board
+from server.search_stats import SearchStats, STATS_REGISTRY
+from server.tablebase import TABLEBASES, configure_tablebases
+
+logger = logging.getLogger(__name__)
+
+# Số engine (game) tối đa mỗi worker giữ trong bộ nhớ, engine dùng lâu nhất bị bỏ trước
+ENGINES_PER_WORKER = 32
+
+
+class _SharedCancel:
+    """CancelToken phía worker: job bị hủy khi process chính ghi job_id của nó vào ô nhớ dùng chung"""
+    
+    def __init__(self, value, job_id: int):
+        self.value = value
+        self.job_id = job_id
+    
+    @property
+    def cancelled(self) -> bool:
+        return self.value.value == self.job_id
+
+
+def _worker_main(index, conn, cancel, tablebase=(None, 0), tt_entries=None):
+    """
+    Vòng lặp của worker process (tablebase: TABLEBASES.settings() của process chính,
+    tt_entries: số entry TT tối đa của mỗi engine, None = mặc định của ChessAI)
+    
+    Lệnh:   ('search', job_id, game_key, fen, moves, level, color, remaining_time, use_node_budget, node_limit)
+            ('ping', token) | ('release', game_key) | None để thoát
+    Trả về: ('result', job_id, move, depth, score, stats) | ('error', job_id, message)
+            | ('pong', token, số engine, tổng entry TT, tổng max_size TT)
+    """
+    configure_tablebases(*tablebase)
+    engines = OrderedDict()  # (game_key, color) -> ChessAI
+    
+    while True:
+        try:
+            command = conn.recv()
+        except (EOFError, OSError):
+            break
+        if command is None:
+            break
+        
+        kind = command[0]
+        if kind == 'ping':
+            conn.send(('pong', command[1], len(engines), sum(len(ai.tt.table) for ai in engines.values()),
+                       sum(ai.tt.max_size for ai in engines.values())))
+            continue
+        if kind == 'release':
+            for key in [key for key in engines if key[0] == command[1]]:
+                del engines[key]
+            continue
+        
+        _, job_id, game_key, fen, moves, level, color, remaining_time, use_node_budget, node_limit = command
+        key = (game_key, color)
+        ai = engines.pop(key, None)
+        if ai is None or ai.level != level:
+            ai = ChessAI(level=level, color=color)
+            ai.verbose = False
+            if tt_entries:
+                ai.tt.max_size = tt_entries
+            # Worker là daemon process, không tạo được process con: không Lazy SMP / root
+            # splitting trong worker (song song hóa đã có ở mức nhiều worker)
+            ai.smp_helpers = dict.fromkeys(ai.smp_helpers, 0)
+            ai.root_split_workers = dict.fromkeys(ai.root_split_workers, 0)
+        engines[key] = ai
+        while len(engines) > ENGINES_PER_WORKER:
+            engines.popitem(last=False)
+        
+        ai.use_node_budget = use_node_budget
+        ai.cancel_token = _SharedCancel(cancel, job_id)
+        try:
+            result = ai.search(Board.from_fen(fen, moves), remaining_time, node_limit)
+            conn.send(('result', job_id, result.move, result.depth, result.score, result.stats.to_dict()))
+        except Exception as e:
+            logger.exception(f"[engine {index}] Lỗi search")
+            conn.send(('error', job_id, repr(e)))
+        finally:
+            ai.cancel_token = None
+    
+    conn.close()
+
+
+class EngineWorker:
+    """Phía process chính của 1 worker: process, Pipe và các lệnh đang chờ kết quả"""
+    
+    def __init__(self, index: int, context, tt_entries: int = None):
+        self.index = index
+        self.context = context
+        self.tt_entries = tt_entries
+        self.process = None
+        self.conn = None
+        self.generation = 0    # Tăng mỗi lần khởi động lại, lệnh của đời trước coi như thất bại
+        self.pending = {}      # job_id -> deadline (monotonic)
+        self.replies = {}      # job_id -> kết quả đã nhận, chờ bên gọi lấy
+        self.abandoned = {}    # job_id -> level của job đã hủy, kết quả chỉ cộng vào thống kê
+        # job_id của job bị hủy (ô nhớ dùng chung, giữ qua các lần khởi động lại); chỉ 1 ô nên
+        # 2 game hủy cùng lúc trên 1 worker thì job ghi trước chạy tiếp tới giới hạn thời gian
+        self.cancel = context.Value('q', 0, lock=False)
+        self.pongs = set()
+        self.jobs = 0
+        self.restarts = 0
+        self.last_reply = 0.0
+        self.memory = (0, 0, 0)  # (số engine, entry TT, max_size TT) theo pong gần nhất
+        self.start()
+    
+    def start(self):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker_main,
+            args=(self.index, child_conn, self.cancel, TABLEBASES.settings(), self.tt_entries),
+            daemon=True,
+            name=f"ai-engine-{self.index}"
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.generation += 1
+        self.pending.clear()
+        self.abandoned.clear()
+        self.pongs.clear()
+        self.memory = (0, 0, 0)
+    
+    def alive(self) -> bool:
+        return self.process.is_alive()
+    
+    def restart(self, reason: str):
+        """Dừng hẳn process hiện tại (kể cả đang search) và khởi động process mới"""
+        logger.warning(f"[engine {self.index}] Khởi động lại: {reason}")
+        self.stop(timeout=0)
+        self.restarts += 1
+        self.start()
+    
+    def stop(self, timeout: float = 1.0):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(1.0)
+        self.conn.close()
+    
+    def send(self, command):
+        self.conn.send(command)
+    
+    def drain(self):
+        """Đọc mọi tin nhắn đã tới (không chặn); False nếu Pipe đã đóng (process chết)"""
+        try:
+            while self.conn.poll():
+                message = self.conn.recv()
+                self.last_reply = time.monotonic()
+                if message[0] == 'pong':
+                    self.pongs.add(message[1])
+                    self.memory = message[2:5]
+                else:
+                    self.pending.pop(message[1], None)
+                    level = self.abandoned.pop(message[1], None)
+                    if level is None:
+                        self.replies[message[1]] = message
+                    elif message[0] == 'result':
+                        STATS_REGISTRY.record(level, SearchStats.from_dict(message[5]))
+        except (EOFError, OSError):
+            return False
+        return True
+    
+    def status(self):
+        return {
+            'index': self.index,
+            'pid': self.process.pid,
+            'alive': self.alive(),
+            'pending': len(self.pending),
+            'jobs': self.jobs,
+            'restarts': self.restarts,
+            'idle_for': round(time.monotonic() - self.last_reply, 1) if self.last_reply else None
+        }
+
+
+class EnginePool:
+    """
+    Pool worker process search nước đi cho AI (1 pool dùng chung cho cả server)
+    
+    Args:
+        num_workers: số worker process
+        spawn: hàm chạy task nền, vd socketio.start_background_task (None = không health check định kỳ)
+        sleep: hàm sleep nhường event loop, vd socketio.sleep
+        health_interval: chu kỳ health check (giây)
+        tt_entries: số entry TT tối đa của mỗi engine trong worker (AIManager.reserve_workers()),
+            None = mặc định của ChessAI
+    """
+    
+    # Khoảng nghỉ giữa 2 lần poll kết quả (giây)
+    WAIT_INTERVAL = 0.01
+    
+    # Thời gian chờ thêm ngoài giới hạn thời gian của search (khởi động process, gửi nhận)
+    TIMEOUT_MARGIN = 5.0
+    
+    # Thời gian chờ trả lời ping (giây)
+    PING_TIMEOUT = 2.0
+    
+    _instance = None
+    _instance_lock = threading.Lock()
+    
+    def __init__(self, num_workers: int, spawn=None, sleep=time.sleep, health_interval: float = 30,
+                 tt_entries: int = None):
+        self.context = mp.get_context('spawn')  # Không fork process đang chạy event loop
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        self.tt_entries = tt_entries
+        self.workers = [EngineWorker(index, self.context, tt_entries) for index in range(num_workers)]
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.health_interval = health_interval
+        if spawn:
+            spawn(self._health_loop)
+        atexit.register(self.shutdown)
+        logger.info(f"Engine pool: {num_workers} worker process")
+    
+    @classmethod
+    def get(cls, num_workers: int, spawn=None, sleep=time.sleep, health_interval: float = 30,
+            tt_entries: int = None):
+        """Lấy pool dùng chung (tạo khi dùng lần đầu, không tạo lúc import module)"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(num_workers, spawn, sleep, health_interval, tt_entries)
+            return cls._instance
+    
+    def _worker_for(self, game_id) -> EngineWorker:
+        return self.workers[hash(game_id) % len(self.workers)]
+    
+    def choose_move(self, game_id, ai: ChessAI, board: Board, remaining_time: float = None,
+                    node_limit: int = None, cancel_token=None):
+        """
+        Như ai.choose_move nhưng search trong worker của game; ai (ở process chính) nhận
+        lại thống kê, depth và điểm của lần search
+        
+        Returns:
+            Nước đi dạng số nguyên, None nếu hết nước, bị hủy (cancel_token) hoặc worker lỗi / quá hạn
+        """
+        worker = self._worker_for(game_id)
+        fen, moves = board.serialize()
+        timeout = ai.time_limit.get(ai.level, 5) + self.TIMEOUT_MARGIN
+        if ai.use_node_budget or node_limit:
+            timeout = ai.time_limit.get(ai.level, 5) * NODE_BUDGET_TIME_FACTOR + self.TIMEOUT_MARGIN
+        
+        with self.lock:
+            if not worker.alive():
+                worker.restart("process đã thoát")
+            job_id = next(self.job_ids)
+            # Worker search tuần tự: chờ thêm thời gian của các lệnh xếp trước
+            deadline = time.monotonic() + timeout * (len(worker.pending) + 1)
+            worker.pending[job_id] = deadline
+            worker.jobs += 1
+            generation = worker.generation
+            worker.send(('search', job_id, game_id, fen, moves, ai.level, ai.color,
+                         remaining_time, ai.use_node_budget, node_limit))
+        
+        reply = self._wait(worker, job_id, generation, deadline, ai.level, cancel_token)
+        if cancel_token is not None and cancel_token.cancelled:
+            return None
+        if reply is None or reply[0] == 'error':
+            self.failed += 1
+            if reply:
+                logger.error(f"[engine {worker.index}] {reply[2]}")
+            return None
+        
+        _, _, move, depth, score, stats_data = reply
+        ai.stats = SearchStats.from_dict(stats_data)
+        ai.last_depth = depth
+        ai.last_score = score
+        STATS_REGISTRY.record(ai.level, ai.stats)
+        self.completed += 1
+        return move
+    
+    def _wait(self, worker: EngineWorker, job_id: int, generation: int, deadline: float,
+              level: str, cancel_token=None):
+        """Chờ kết quả của job_id (hoặc tới khi cancel_token bị hủy), nhường event loop giữa các lần poll"""
+        while True:
+            with self.lock:
+                if worker.generation != generation:
+                    return None  # Worker đã bị khởi động lại, lệnh bị mất
+                if cancel_token is not None and cancel_token.cancelled:
+                    # Kết quả có thể đã tới (greenlet khác drain giúp): bỏ luôn
+                    if worker.replies.pop(job_id, None) is None and job_id in worker.pending:
+                        worker.cancel.value = job_id
+                        worker.abandoned[job_id] = level
+                    self.cancelled += 1
+                    return None
+                if not worker.drain():
+                    worker.restart("Pipe đóng")
+                    return None
+                reply = worker.replies.pop(job_id, None)
+                if reply is not None:
+                    return reply
+                if time.monotonic() > deadline:
+                    worker.restart(f"search quá hạn (job {job_id})")
+                    return None
+            self.sleep(self.WAIT_INTERVAL)
+    
+    def release(self, game_id):
+        """Game kết thúc: worker bỏ engine của game (không chờ)"""
+        worker = self._worker_for(game_id)
+        with self.lock:
+            if worker.alive():
+                worker.send(('release', game_id))
+    
+    def check_health(self):
+        """
+        Kiểm tra từng worker: process còn chạy, worker rảnh trả lời ping trong PING_TIMEOUT
+        (worker đang search được kiểm tra bằng deadline của lệnh); worker lỗi được khởi động lại
+        
+        Returns:
+            health()
+        """
+        for worker in self.workers:
+            with self.lock:
+                if not worker.alive():
+                    worker.restart("process đã thoát")
+                    continue
+                if worker.pending:
+                    if min(worker.pending.values()) < time.monotonic():
+                        worker.restart("search quá hạn")
+                    continue
+                token = next(self.job_ids)
+                generation = worker.generation
+                worker.send(('ping', token))
+            
+            deadline = time.monotonic() + self.PING_TIMEOUT
+            while True:
+                with self.lock:
+                    if worker.generation != generation:
+                        break
+                    if not worker.drain():
+                        worker.restart("Pipe đóng")
+                        break
+                    if token in worker.pongs:
+                        worker.pongs.discard(token)
+                        break
+                    if time.monotonic() > deadline:
+                        # Có lệnh search mới xếp trước pong: để deadline của lệnh đó kiểm tra
+                        if not worker.pending:
+                            worker.restart("không trả lời ping")
+                        break
+                self.sleep(self.WAIT_INTERVAL)
+        return self.health()
+    
+    def _health_loop(self):
+        """Task nền: health check định kỳ"""
+        while True:
+            self.sleep(self.health_interval)
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.error(f"[engine pool] Lỗi health check: {e}")
+    
+    def health(self):
+        """Trạng thái pool cho API / log"""
+        with self.lock:
+            workers = [worker.status() for worker in self.workers]
+        return {
+            'workers': workers,
+            'alive': sum(1 for worker in workers if worker['alive']),
+            'completed': self.completed,
+            'failed': self.failed,
+            'cancelled': self.cancelled
+        }
+    
+    def memory(self):
+        """
+        Bộ nhớ ước tính của engine trong các worker cho API / log, theo pong của lần health
+        check gần nhất (check_health()); reserved_bytes: phần đã cắt từ ngân sách (engine đầy)
+        """
+        with self.lock:
+            usage = [worker.memory for worker in self.workers]
+        engines = sum(item[0] for item in usage)
+        tt_entries = sum(item[1] for item in usage)
+        max_engines = len(self.workers) * ENGINES_PER_WORKER
+        reserved = None
+        if self.tt_entries:
+            reserved = max_engines * (ENGINE_BASE_BYTES + self.tt_entries * TT_ENTRY_BYTES)
+        return {
+            'workers': len(self.workers),
+            'engines': engines,
+            'max_engines': max_engines,
+            'tt_entries': tt_entries,
+            'tt_capacity': sum(item[2] for item in usage),
+            'tt_entries_per_engine': self.tt_entries,
+            'estimated_bytes': engines * ENGINE_BASE_BYTES + tt_entries * TT_ENTRY_BYTES,
+            'reserved_bytes': reserved
+        }
+    
+    def shutdown(self):
+        """Dừng mọi worker"""
+        for worker in self.workers:
+            worker.stop()
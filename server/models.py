@@ -374,6 +374,18 @@ class GameModel:
         """
         return db.execute_query(query, tuple(params))
     
+    @staticmethod
+    def get_finished_games(after_id=0, limit=500):
+        """Lấy 1 lô game đã kết thúc có kết quả, game_id > after_id (duyệt toàn bộ theo từng lô)"""
+        query = """
+            SELECT TOP (?) game_id, game_type, ai_difficulty, winner, end_reason,
+                   red_player_name, black_player_name
+            FROM Games
+            WHERE status = 'finished' AND winner IS NOT NULL AND game_id > ?
+            ORDER BY game_id
+        """
+        return db.execute_query(query, (limit, after_id))
+    
     @staticmethod
     def delete_game(game_id):
         """Xóa game (dùng khi host rời phòng chờ)"""
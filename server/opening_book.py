@@ -0,0 +1,256 @@
+"""
+Opening book - nước khai cuộc thống kê từ các ván đã kết thúc (bảng Moves), file nhị phân đọc bằng mmap
+
+Builder (offline) duyệt từng lô game đã kết thúc (GameModel.get_finished_games +
+MoveModel.get_game_moves / sp_GetGameMoves), đi lại từng ván tới max_plies nước và cộng
+thắng / hòa / thua (theo bên đi nước đó) cho mỗi (vị trí, nước đi). Nước của AI level easy
+(đi ngẫu nhiên) không được tính.
+
+Đối xứng trái-phải: vị trí và ảnh gương của nó (cột c <-> 8 - c) dùng chung entry - key là
+Zobrist key nhỏ hơn trong 2 key, nước đi được lưu theo hướng của key đó; vị trí tự đối xứng
+(vd vị trí đầu) lưu nước nhỏ hơn trong cặp đối xứng và được chọn ngẫu nhiên 1 trong 2 hướng.
+
+Định dạng file (little-endian), record sắp xếp theo (key, move), tra bằng binary search
+trực tiếp trên mmap (không nạp cả file vào RAM, các process dùng chung page cache):
+    Header 16 byte: magic b'XQBK', version (u16), kích thước record (u16), số record (u32),
+                    max_plies (u16), 2 byte trống
+    Record 16 byte: key (u64), move (u16), thắng (u16), hòa (u16), thua (u16)
+
+Tạo book:
+    python -m server.opening_book <file.bin> [max_plies] [min_games]
+"""
+
+import logging
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+
+from server.board import Board, encode_move, mirror_move
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<4sHHIH2x')
+RECORD = struct.Struct('<QHHHH')
+KEY = struct.Struct('<Q')
+MAGIC = b'XQBK'
+VERSION = 1
+
+# Bộ đếm thắng / hòa / thua trong file là u16
+COUNT_MAX = 0xFFFF
+
+# File book ChessAI dùng (rỗng = không dùng book), mở khi tra lần đầu trong mỗi process
+OPENING_BOOK_FILE = os.environ.get('AI_OPENING_BOOK_FILE', '')
+
+# Mặc định của builder: số nước đầu mỗi ván được thống kê, số ván tối thiểu để 1 nước vào book
+BOOK_PLIES = 20
+BOOK_MIN_GAMES = 2
+
+
+def canonical_key(board: Board):
+    """
+    Key của vị trí trong book
+    
+    Returns:
+        (key, mirrored, symmetric) - mirrored: key là của ảnh gương (nước đi phải lật);
+        symmetric: vị trí tự đối xứng
+    """
+    key = board.zobrist_key
+    mirror_key = board.mirror_zobrist_key()
+    if mirror_key < key:
+        return mirror_key, True, False
+    return key, False, key == mirror_key
+
+
+class OpeningBook:
+    """
+    Đọc file book bằng mmap và chọn nước theo thống kê thắng / hòa / thua
+    
+    Args:
+        path: file book, mở khi tra lần đầu (None = book rỗng)
+    """
+    
+    def __init__(self, path: str = None):
+        self.path = path
+        self.loaded = not path
+        self.lock = threading.Lock()
+        self.mm = None
+        self.count = 0
+        self.max_plies = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def open(self, path: str):
+        """Mở file book (ValueError nếu sai định dạng)"""
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, count, max_plies = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            mm.close()
+            raise ValueError(f"{path} không phải opening book v{VERSION}")
+        if HEADER.size + count * RECORD.size > len(mm):
+            mm.close()
+            raise ValueError(f"{path} bị cắt cụt")
+        self.mm, self.count, self.max_plies = mm, count, max_plies
+    
+    def _open_once(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            try:
+                self.open(self.path)
+                logger.info(f"Opening book: {self.count} record, {self.max_plies} nước đầu, từ {self.path}")
+            except (OSError, ValueError, struct.error) as e:
+                logger.error(f"Opening book: không mở được {self.path}: {e}")
+    
+    def lookup(self, key: int):
+        """Các record của key: [(move, thắng, hòa, thua)] (move theo hướng của key)"""
+        mm = self.mm
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if KEY.unpack_from(mm, HEADER.size + mid * RECORD.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        entries = []
+        for index in range(lo, self.count):
+            record = RECORD.unpack_from(mm, HEADER.size + index * RECORD.size)
+            if record[0] != key:
+                break
+            entries.append(record[1:])
+        return entries
+    
+    def choose(self, board: Board, legal: list, variety: float = 1.0, min_games: int = 1, rng=random):
+        """
+        Chọn ngẫu nhiên 1 nước trong book cho vị trí, trọng số = số ván * tỉ lệ điểm ^ variety
+        (tỉ lệ điểm = (thắng + hòa / 2) / số ván của bên đang đi)
+        
+        Args:
+            legal: nước hợp lệ (dạng số nguyên), nước trong book phải thuộc danh sách này
+            variety: 0 = theo độ phổ biến, lớn = gần như luôn chọn nước điểm cao nhất
+            min_games: bỏ nước có ít ván hơn
+        
+        Returns:
+            Nước đi dạng số nguyên, None nếu vị trí không có trong book
+        """
+        if not self.loaded:
+            self._open_once()
+        if self.mm is None or board.ply >= self.max_plies:
+            return None
+        
+        key, mirrored, symmetric = canonical_key(board)
+        candidates = []
+        weights = []
+        for move, wins, draws, losses in self.lookup(key):
+            games = wins + draws + losses
+            if games < min_games:
+                continue
+            if mirrored or (symmetric and rng.random() < 0.5):
+                move = mirror_move(move)
+            if move not in legal:
+                continue
+            candidates.append(move)
+            weights.append(games * ((wins + draws / 2) / games) ** variety)
+        
+        if not candidates or sum(weights) <= 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return rng.choices(candidates, weights)[0]
+    
+    def snapshot(self):
+        """Số liệu book cho API / log"""
+        return {
+            'records': self.count,
+            'max_plies': self.max_plies,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+# Book dùng chung cho cả process
+OPENING_BOOK = OpeningBook(OPENING_BOOK_FILE or None)
+
+
+def iter_db_games(batch: int = 500):
+    """Duyệt mọi game đã kết thúc trong database: (game, danh sách nước của sp_GetGameMoves)"""
+    from server.models import GameModel, MoveModel
+    
+    after_id = 0
+    while True:
+        games = GameModel.get_finished_games(after_id, batch)
+        if not games:
+            return
+        for game in games:
+            after_id = game['game_id']
+            yield game, MoveModel.get_game_moves(game['game_id']) or []
+
+
+def build(path: str, games, max_plies: int = BOOK_PLIES, min_games: int = BOOK_MIN_GAMES):
+    """
+    Thống kê các ván và ghi file book
+    
+    Args:
+        games: iterable (game, moves) như iter_db_games(); game cần 'winner' ('red' / 'black' /
+            'draw'), tên người chơi để nhận ra AI easy; moves là các dòng của bảng Moves
+        min_games: chỉ ghi nước có ít nhất chừng này ván
+    
+    Returns:
+        Số record đã ghi
+    """
+    counts = {}  # key -> {move: [thắng, hòa, thua]}
+    for game, moves in games:
+        winner = game.get('winner')
+        if winner not in ('red', 'black', 'draw'):
+            continue
+        skip_colors = {color for color in ('red', 'black')
+                       if (game.get(f'{color}_player_name') or '').startswith('AI (easy')}
+        
+        board = Board()
+        for row in moves[:max_plies]:
+            if row.get('from_row') is None or row.get('player') != board.turn:
+                break
+            fr, fc, tr, tc = row['from_row'], row['from_col'], row['to_row'], row['to_col']
+            key, mirrored, symmetric = canonical_key(board)
+            color = board.turn
+            move = encode_move(fr, fc, tr, tc)
+            if not board.move(fr, fc, tr, tc)[0]:
+                break
+            if color in skip_colors:
+                continue
+            if mirrored:
+                move = mirror_move(move)
+            elif symmetric:
+                move = min(move, mirror_move(move))
+            result = counts.setdefault(key, {}).setdefault(move, [0, 0, 0])
+            result[0 if winner == color else 1 if winner == 'draw' else 2] += 1
+    
+    records = sorted(
+        (key, move, *(min(COUNT_MAX, n) for n in result))
+        for key, moves in counts.items()
+        for move, result in moves.items()
+        if sum(result) >= min_games
+    )
+    
+    # Ghi file tạm rồi đổi tên: process đang mmap file cũ vẫn đọc được tới khi mở lại
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, len(records), max_plies))
+        for record in records:
+            f.write(RECORD.pack(*record))
+    os.replace(temp_path, path)
+    return len(records)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    written = build(sys.argv[1], iter_db_games(),
+                    int(sys.argv[2]) if len(sys.argv) > 2 else BOOK_PLIES,
+                    int(sys.argv[3]) if len(sys.argv) > 3 else BOOK_MIN_GAMES)
+    print(f"Đã ghi {written} record vào {sys.argv[1]}")
@@ -0,0 +1,179 @@
+"""
+Opening cache - kết quả search của các vị trí khai cuộc, dùng chung cho mọi game trong process
+
+Mọi ván PvE bắt đầu từ cùng 1 vị trí và vài nước đầu thường rơi vào số ít thế khai cuộc
+quen thuộc, nhưng mỗi ChessAI có TT riêng nên vẫn search lại từ đầu. OpeningCache:
+- Key = (Zobrist key, level), giá trị = (nước đi, điểm, depth, FEN); chỉ lưu vị trí trong
+  OPENING_CACHE_PLIES nước đầu, depth sâu hơn thay kết quả cũ
+- Được điền bởi các lần ChessAI.search() hoàn thành, và nạp sẵn từ file JSON
+  (AI_OPENING_CACHE_FILE, nạp khi tra lần đầu trong mỗi process)
+- ChessAI.search() tra cache trước khi search: có kết quả đủ depth của level thì trả về ngay
+
+Tạo file nạp sẵn (search các vị trí theo width nước tốt nhất mỗi bên, sâu plies nước):
+    python -m server.opening_cache <file.json> [level] [plies] [width]
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+
+from server.board import Board, decode_move, encode_move
+
+logger = logging.getLogger(__name__)
+
+# Chỉ lưu vị trí có số nước đã đi (cả 2 bên) nhỏ hơn chừng này
+OPENING_CACHE_PLIES = int(os.environ.get('AI_OPENING_CACHE_PLIES', 12))
+
+# File JSON nạp sẵn vào cache (rỗng = không nạp)
+OPENING_CACHE_FILE = os.environ.get('AI_OPENING_CACHE_FILE', '')
+
+# Số vị trí tối đa (đầy thì chỉ cập nhật vị trí đã có)
+OPENING_CACHE_MAX_ENTRIES = 50000
+
+
+class OpeningCache:
+    """
+    Cache kết quả search theo (Zobrist key, level), đọc nhiều ghi ít
+    
+    Args:
+        max_plies: chỉ lưu vị trí trong max_plies nước đầu
+        max_entries: số vị trí tối đa
+        path: file JSON nạp sẵn khi tra lần đầu (None = không nạp)
+    """
+    
+    def __init__(self, max_plies: int = OPENING_CACHE_PLIES, max_entries: int = OPENING_CACHE_MAX_ENTRIES,
+                 path: str = None):
+        self.max_plies = max_plies
+        self.max_entries = max_entries
+        self.path = path
+        self.loaded = not path
+        self.lock = threading.Lock()
+        self.entries = {}  # (zobrist_key, level) -> (move, score, depth, fen)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+    
+    def probe(self, board: Board, level: str, min_depth: int = 0):
+        """
+        Kết quả đã lưu của vị trí cho level (depth >= min_depth)
+        
+        Returns:
+            (move, score, depth) hoặc None; move ở dạng số nguyên, score theo góc nhìn Đỏ
+        """
+        if board.ply >= self.max_plies:
+            return None
+        if not self.loaded:
+            self._load_once()
+        entry = self.entries.get((board.zobrist_key, level))
+        if entry is None or entry[2] < min_depth:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[:3]
+    
+    def store(self, board: Board, level: str, move: int, score, depth: int):
+        """Lưu kết quả search của vị trí (bỏ qua nếu ngoài khai cuộc hoặc đã có kết quả sâu hơn)"""
+        if move is None or depth <= 0 or board.ply >= self.max_plies:
+            return
+        key = (board.zobrist_key, level)
+        with self.lock:
+            old = self.entries.get(key)
+            if old is not None and old[2] >= depth:
+                return
+            if old is None and len(self.entries) >= self.max_entries:
+                return
+            self.entries[key] = (move, score, depth, board.to_fen())
+            self.stores += 1
+    
+    def _load_once(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+        try:
+            count = self.load(self.path)
+            logger.info(f"Opening cache: nạp {count} vị trí từ {self.path}")
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Opening cache: không nạp được {self.path}: {e}")
+    
+    def load(self, path: str) -> int:
+        """Nạp các vị trí từ file JSON (save()), giữ kết quả sâu hơn nếu trùng; trả về số vị trí đọc được"""
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        count = 0
+        for item in data.get('entries', []):
+            board = Board.from_fen(item['fen'])
+            move = encode_move(*item['move'])
+            if move not in board.legal_move_codes(board.turn):
+                continue
+            key = (board.zobrist_key, item['level'])
+            with self.lock:
+                old = self.entries.get(key)
+                if old is None or old[2] < item['depth']:
+                    self.entries[key] = (move, item['score'], item['depth'], item['fen'])
+            count += 1
+        return count
+    
+    def save(self, path: str):
+        """Ghi toàn bộ cache ra file JSON (key bằng FEN, không phụ thuộc bảng Zobrist)"""
+        with self.lock:
+            entries = [
+                {'fen': fen, 'level': level, 'move': list(decode_move(move)), 'score': score, 'depth': depth}
+                for (_, level), (move, score, depth, fen) in self.entries.items()
+            ]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'entries': entries}, f)
+    
+    def snapshot(self):
+        """Số liệu cache cho API / log"""
+        return {
+            'entries': len(self.entries),
+            'max_plies': self.max_plies,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores
+        }
+
+
+# Cache dùng chung cho cả process
+OPENING_CACHE = OpeningCache(path=OPENING_CACHE_FILE or None)
+
+
+def build(path: str, level: str = 'hard', plies: int = 4, width: int = 3):
+    """Search các vị trí khai cuộc (width nước tốt nhất mỗi vị trí, sâu plies nước) và ghi ra file"""
+    from server.ai import ChessAI
+    # Chạy bằng python -m thì module này là __main__: dùng cache của server.opening_cache (ChessAI ghi vào đó)
+    from server.opening_cache import OPENING_CACHE as cache
+    
+    if os.path.exists(path):
+        cache.load(path)
+    cache.loaded = True
+    
+    def expand(board: Board, ply: int):
+        ai = ChessAI(level=level, color=board.turn)
+        ai.verbose = False
+        result = ai.search(board)
+        print(f"ply {ply}: {board.to_fen()} -> {decode_move(result.move) if result.move is not None else None}"
+              f" (depth {result.depth}, điểm {result.score})")
+        if ply + 1 >= plies:
+            return
+        for line in ai.analyze(board, num_pv=width)['lines']:
+            child = board.clone()
+            child.make_move(*decode_move(line['move']))
+            expand(child, ply + 1)
+    
+    expand(Board(), 0)
+    cache.save(path)
+    print(f"Đã ghi {len(cache.entries)} vị trí vào {path}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    build(sys.argv[1],
+          sys.argv[2] if len(sys.argv) > 2 else 'hard',
+          int(sys.argv[3]) if len(sys.argv) > 3 else 4,
+          int(sys.argv[4]) if len(sys.argv) > 4 else 3)
@@ -0,0 +1,178 @@
+"""
+Pondering - AI suy nghĩ trên giờ của người chơi (PvE)
+
+Sau khi AI đi, trong lúc chờ người chơi:
+1. Đoán nước người chơi sẽ đi (nước thứ 2 của PV, lấy từ TT của AI)
+2. Search nền vị trí sau nước đoán đó, TT của AI luôn được làm ấm
+3. Khi nước thật đến:
+   - Ponder hit (đúng nước đoán): chuyển search nền sang giờ thật và dùng kết quả
+   - Ponder miss: dừng search nền, search lại bình thường (TT vẫn còn ấm)
+
+Số search nền chạy cùng lúc bị giới hạn toàn server (AI_PONDER_MAX_CONCURRENT). Ponder chạy
+trên ChessAI của process web nên chỉ có ích khi search cũng chạy ở đó (engine pool tắt);
+khi bật engine pool, app không ponder (TT ấm ở process web không giúp search trong worker)
+
+Session chỉ rời sessions khi search nền đã thoát (cả khi bị cancel()), nên finish() luôn
+chờ được search nền cũ trước khi lượt mới dùng lại cùng ChessAI
+"""
+
+import logging
+import threading
+
+from server.ai import ChessAI
+from server.board import Board, decode_move
+
+logger = logging.getLogger(__name__)
+
+
+class PonderSession:
+    """Một lần ponder cho 1 game"""
+    
+    def __init__(self, game_id, ai: ChessAI, predicted: int):
+        self.game_id = game_id
+        self.ai = ai
+        self.predicted = predicted
+        self.stop = False
+        self.done = False
+        self.finishing = False  # finish() đang chờ search nền (session vẫn nằm trong sessions để cancel() thấy)
+        self.result = None  # (best_move, depth)
+
+
+class Ponderer:
+    """
+    Quản lý các search nền (ponder) của mọi game PvE
+    
+    Args:
+        spawn: hàm chạy task nền, vd socketio.start_background_task
+        sleep: hàm sleep nhường event loop, vd socketio.sleep
+        max_concurrent: số ponder tối đa chạy cùng lúc
+    """
+    
+    # Khoảng nghỉ khi chờ search nền dừng (giây)
+    WAIT_INTERVAL = 0.005
+    
+    def __init__(self, spawn, sleep, max_concurrent: int = 2):
+        self.spawn = spawn
+        self.sleep = sleep
+        self.max_concurrent = max_concurrent
+        self.sessions = {}  # game_id -> PonderSession
+        self.active = 0     # Số search nền đang chạy (kể cả session đã bị hủy nhưng chưa thoát)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def start(self, game_id, ai: ChessAI, board: Board):
+        """
+        Bắt đầu ponder cho game (gọi sau khi AI đã đi, đến lượt người chơi)
+        
+        Returns:
+            True nếu đã bắt đầu search nền
+        """
+        # Node budget cần kết quả tất định, không ponder theo giờ người chơi
+        if ai.level == 'easy' or board.turn == ai.color or ai.use_node_budget:
+            return False
+        
+        with self.lock:
+            if game_id in self.sessions or self.active >= self.max_concurrent:
+                return False
+            
+            predicted = ai.predict_reply(board)
+            if predicted is None:
+                return False
+            
+            position = board.clone()
+            position.make_move(*decode_move(predicted))
+            session = PonderSession(game_id, ai, predicted)
+            self.sessions[game_id] = session
+            self.active += 1
+        
+        self.spawn(self._run, session, position)
+        return True
+    
+    def _run(self, session: PonderSession, board: Board):
+        """Task nền: search vị trí sau nước đoán"""
+        ai = session.ai
+        stop_check = ai.stop_check = lambda: session.stop
+        yield_hook = ai.yield_hook = lambda: self.sleep(0)
+        try:
+            session.result = ai.ponder(board)
+        except Exception as e:
+            logger.error(f"[ponder] Lỗi search nền: {e}")
+        finally:
+            # Chỉ gỡ hook của chính mình (không đụng search khác đã gắn hook vào AI)
+            if ai.stop_check is stop_check:
+                ai.stop_check = None
+            if ai.yield_hook is yield_hook:
+                ai.yield_hook = None
+            with self.lock:
+                self.active -= 1
+                session.done = True
+                # Session bị cancel() và không ai chờ: rời sessions khi search nền thoát
+                if session.stop and not session.finishing and self.sessions.get(session.game_id) is session:
+                    del self.sessions[session.game_id]
+    
+    def _wait(self, session: PonderSession, cancel_token=None):
+        """
+        Chờ search nền kết thúc (nhường event loop trong lúc chờ); cancel_token bị hủy
+        thì dừng search nền như cancel()
+        """
+        while not session.done:
+            if cancel_token is not None and cancel_token.cancelled:
+                session.stop = True
+            self.sleep(self.WAIT_INTERVAL)
+    
+    def finish(self, game_id, move: int, cancel_token=None):
+        """
+        Nước thật của người chơi (dạng số nguyên, board.encode_move) đã đến (đã đi trên bàn cờ)
+        move = None: dừng ponder và chờ search nền thoát (trước khi dùng lại AI)
+        
+        Session vẫn nằm trong sessions tới khi search nền thoát nên cancel(game_id) hoặc
+        cancel_token (CancelToken của lượt đi) dừng được cả search của ponder hit
+        
+        Returns:
+            Nước trả lời của AI nếu ponder hit, None nếu miss/không ponder/bị hủy
+            (khi None, AI search bình thường - TT đã ấm)
+        """
+        with self.lock:
+            session = self.sessions.get(game_id)
+            if not session or session.finishing:
+                return None
+            session.finishing = True
+        
+        try:
+            ai = session.ai
+            if move is not None and move == session.predicted:
+                # Ponder hit: search nền tiếp tục nhưng theo giờ thật tính từ bây giờ
+                self.hits += 1
+                if not session.done:
+                    ai.start_timer()
+                self._wait(session, cancel_token)
+                logger.info(f"[ponder] Hit game {game_id} ({self.hits} hit / {self.misses} miss)")
+                if session.stop or not session.result:
+                    return None
+                return session.result[0]
+            
+            # Ponder miss (hoặc dừng / đã bị hủy): dừng search nền
+            session.stop = True
+            self._wait(session)
+            if move is not None:
+                self.misses += 1
+                logger.info(f"[ponder] Miss game {game_id} ({self.hits} hit / {self.misses} miss)")
+            return None
+        finally:
+            with self.lock:
+                if self.sessions.get(game_id) is session:
+                    del self.sessions[game_id]
+    
+    def cancel(self, game_id):
+        """
+        Hủy ponder của game (game kết thúc / mất kết nối), không chờ search nền dừng; session
+        còn trong sessions tới khi search nền thoát để finish() của lượt sau chờ được
+        """
+        with self.lock:
+            session = self.sessions.get(game_id)
+            if session is None:
+                return
+            session.stop = True
+            if session.done and not session.finishing:
+                del self.sessions[game_id]
@@ -0,0 +1,235 @@
+"""
+Scheduler cho các lần search nước đi của AI (PvE)
+
+Mỗi nước AI phải đi là 1 job; thay vì search ngay khi handler được gọi:
+- Số search chạy cùng lúc bị giới hạn toàn server (max_running, thường = số worker của
+  engine pool) và theo từng level (level_limits, vd hard chỉ 1 job cùng lúc)
+- Job chưa được chạy nằm trong hàng đợi có giới hạn (max_queue), job ưu tiên cao chạy
+  trước: level dễ (search ngắn) và nước khai cuộc trước, cùng ưu tiên thì vào trước chạy trước
+- Hàng đợi đầy hoặc job chờ quá deadline (max_wait): job không chờ thêm mà chạy ngay
+  với node budget nhỏ (degraded_nodes) - AI đi yếu hơn nhưng không ai phải chờ vô hạn;
+  số search hạ cấp chạy cùng lúc vẫn bị giới hạn (max_degraded), quá thì chờ slot hạ cấp
+- Job có CancelToken bị hủy khi đang chờ (game kết thúc) rời hàng đợi ngay, không search
+- snapshot(): độ sâu hàng đợi, số job đang chạy, thời gian chờ theo level để chọn số worker
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+
+from server.board import Board
+
+# Số thời gian chờ gần nhất giữ lại mỗi level để tính trung bình / p95
+WAIT_SAMPLES = 500
+
+
+class AIJob:
+    """Một lần search nước đi đang chờ hoặc đang chạy"""
+    
+    def __init__(self, job_id: int, game_id, level: str, priority: int, deadline: float):
+        self.job_id = job_id
+        self.game_id = game_id
+        self.level = level
+        self.priority = priority   # Nhỏ hơn = chạy trước
+        self.deadline = deadline   # Thời điểm (monotonic) hết chờ, sau đó chạy ở chế độ hạ cấp
+        self.submitted = time.monotonic()
+        self.degraded = None       # Lý do hạ cấp: 'queue_full' | 'deadline' | None
+    
+    def sort_key(self):
+        return (self.priority, self.job_id)
+
+
+class AIScheduler:
+    """
+    Hàng đợi ưu tiên + giới hạn đồng thời cho search của AI (1 scheduler dùng chung cho cả server)
+    
+    Args:
+        sleep: hàm sleep nhường event loop, vd socketio.sleep
+        max_running: số search chạy cùng lúc tối đa (mọi level)
+        level_limits: level -> số search chạy cùng lúc tối đa của level đó (không có = max_running)
+        max_queue: số job chờ tối đa, job tới khi đầy chạy ngay ở chế độ hạ cấp
+        max_wait: thời gian chờ tối đa của 1 job (giây)
+        degraded_nodes: node budget của search hạ cấp
+        max_degraded: số search hạ cấp chạy cùng lúc tối đa
+    """
+    
+    # Khoảng nghỉ giữa 2 lần kiểm tra đến lượt (giây)
+    WAIT_INTERVAL = 0.01
+    
+    # Ưu tiên theo level (nhỏ hơn = chạy trước), nước khai cuộc được cộng thêm OPENING_BONUS;
+    # 'analysis' (phân tích theo yêu cầu, không có game chờ) chạy sau mọi nước đi của AI
+    LEVEL_PRIORITY = {'easy': 0, 'medium': 2, 'hard': 4, 'analysis': 6}
+    OPENING_BONUS = 1
+    
+    # Số nước đã đi (cả 2 bên, board.ply) còn tính là khai cuộc; job phân tích không được cộng
+    OPENING_PLIES = 10
+    ANALYSIS_LEVEL = 'analysis'
+    
+    def __init__(self, sleep=time.sleep, max_running: int = 1, level_limits=None,
+                 max_queue: int = 8, max_wait: float = 10.0, degraded_nodes: int = 3000,
+                 max_degraded: int = 4):
+        self.sleep = sleep
+        self.max_running = max(1, max_running)
+        self.level_limits = dict(level_limits or {})
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.degraded_nodes = degraded_nodes
+        self.max_degraded = max(1, max_degraded)
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        self.queue = []    # AIJob đang chờ (ít phần tử, chọn job kế tiếp bằng min)
+        self.running = {}  # level -> số search đang chạy (không tính search hạ cấp)
+        
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0  # Job bị hủy khi còn trong hàng đợi
+        self.degraded = {'queue_full': 0, 'deadline': 0}
+        self.running_degraded = 0
+        self.max_queue_depth = 0
+        self.waits = {}    # level -> deque thời gian chờ (giây) của các job gần nhất
+    
+    def priority(self, level: str, board: Board) -> int:
+        """Ưu tiên của job: level dễ và nước khai cuộc chạy trước"""
+        priority = self.LEVEL_PRIORITY.get(level, max(self.LEVEL_PRIORITY.values()))
+        if level != self.ANALYSIS_LEVEL and board.ply < self.OPENING_PLIES:
+            priority -= self.OPENING_BONUS
+        return priority
+    
+    def run(self, game_id, level: str, board: Board, search, cancel_token=None):
+        """
+        Chạy search(node_limit) khi tới lượt và trả về kết quả của nó (None nếu
+        cancel_token bị hủy trong lúc chờ)
+        
+        node_limit là None khi job được chạy bình thường, degraded_nodes khi hàng đợi
+        đầy hoặc job chờ quá deadline
+        """
+        job = self._submit(game_id, level, board)
+        if job.degraded is None and not self._wait(job, cancel_token):
+            with self.lock:
+                self.cancelled += 1
+            return None
+        if job.degraded and not self._wait_degraded(cancel_token):
+            with self.lock:
+                self.cancelled += 1
+            return None
+        
+        with self.lock:
+            self._record_wait(job)
+            if job.degraded:
+                self.degraded[job.degraded] += 1
+        
+        try:
+            result = search(self.degraded_nodes if job.degraded else None)
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            raise
+        finally:
+            with self.lock:
+                if job.degraded:
+                    self.running_degraded -= 1
+                else:
+                    self.running[job.level] -= 1
+        
+        with self.lock:
+            self.completed += 1
+        return result
+    
+    def _submit(self, game_id, level: str, board: Board) -> AIJob:
+        """Tạo job và xếp vào hàng đợi (hàng đợi đầy: job hạ cấp, không xếp)"""
+        priority = self.priority(level, board)
+        with self.lock:
+            job = AIJob(next(self.job_ids), game_id, level, priority, time.monotonic() + self.max_wait)
+            self.submitted += 1
+            if len(self.queue) >= self.max_queue:
+                job.degraded = 'queue_full'
+                return job
+            self.queue.append(job)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+        return job
+    
+    def _wait(self, job: AIJob, cancel_token=None) -> bool:
+        """
+        Chờ tới lượt job (nhường event loop giữa các lần kiểm tra) hoặc hết deadline
+        
+        Returns:
+            False nếu cancel_token bị hủy trong lúc chờ (job đã rời hàng đợi)
+        """
+        while True:
+            with self.lock:
+                if cancel_token is not None and cancel_token.cancelled:
+                    self.queue.remove(job)
+                    return False
+                if self._next_job() is job:
+                    self.queue.remove(job)
+                    self.running[job.level] = self.running.get(job.level, 0) + 1
+                    return True
+                if time.monotonic() > job.deadline:
+                    self.queue.remove(job)
+                    job.degraded = 'deadline'
+                    return True
+            self.sleep(self.WAIT_INTERVAL)
+    
+    def _wait_degraded(self, cancel_token=None) -> bool:
+        """
+        Chờ slot search hạ cấp (running_degraded < max_degraded) và giữ slot đó
+        
+        Returns:
+            False nếu cancel_token bị hủy trong lúc chờ
+        """
+        while True:
+            with self.lock:
+                if cancel_token is not None and cancel_token.cancelled:
+                    return False
+                if self.running_degraded < self.max_degraded:
+                    self.running_degraded += 1
+                    return True
+            self.sleep(self.WAIT_INTERVAL)
+    
+    def _next_job(self):
+        """Job ưu tiên cao nhất mà level của nó còn chỗ chạy (None nếu đã đủ search đang chạy)"""
+        if sum(self.running.values()) >= self.max_running:
+            return None
+        candidates = [job for job in self.queue
+                      if self.running.get(job.level, 0) < self.level_limits.get(job.level, self.max_running)]
+        if not candidates:
+            return None
+        return min(candidates, key=AIJob.sort_key)
+    
+    def _record_wait(self, job: AIJob):
+        waits = self.waits.get(job.level)
+        if waits is None:
+            waits = self.waits[job.level] = deque(maxlen=WAIT_SAMPLES)
+        waits.append(time.monotonic() - job.submitted)
+    
+    def snapshot(self):
+        """Số liệu hàng đợi cho API / log"""
+        with self.lock:
+            levels = {}
+            for level, waits in self.waits.items():
+                ordered = sorted(waits)
+                levels[level] = {
+                    'running': self.running.get(level, 0),
+                    'queued': sum(1 for job in self.queue if job.level == level),
+                    'samples': len(ordered),
+                    'avg_wait': round(sum(ordered) / len(ordered), 4),
+                    'p95_wait': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+                    'max_wait': round(ordered[-1], 4)
+                }
+            return {
+                'queue_depth': len(self.queue),
+                'max_queue_depth': self.max_queue_depth,
+                'queue_limit': self.max_queue,
+                'running': sum(self.running.values()),
+                'running_degraded': self.running_degraded,
+                'max_degraded': self.max_degraded,
+                'max_running': self.max_running,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'degraded': dict(self.degraded),
+                'levels': levels
+            }
@@ -0,0 +1,226 @@
+"""
+Thống kê search của AI
+
+- SearchStats: bộ đếm của 1 lần search (nodes trong/lá, TT, cắt tỉa, LMR, killer/history)
+  và số liệu từng depth của Iterative Deepening (nodes, thời gian, hệ số phân nhánh)
+- SearchResult: kết quả 1 lần search (nước đi + điểm + thống kê), ChessAI.search() trả về
+- StatsRegistry: cộng dồn thống kê mọi lần search trong process theo level (STATS_REGISTRY)
+"""
+
+import threading
+import time
+
+from server.board import decode_move
+
+
+class SearchStats:
+    """Bộ đếm của 1 lần search"""
+    
+    COUNTERS = (
+        'interior_nodes',      # Node có sinh nước đi
+        'leaf_nodes',          # Node depth 0 (gọi evaluate)
+        'repetitions',         # Node kết thúc do lặp lại vị trí
+        'mate_distance_cuts',  # Node bị cắt bởi Mate Distance Pruning
+        'tt_probes',           # Số lần tra transposition table
+        'tt_hits',             # Số lần TT trả về giá trị dùng được
+        'tt_stores',           # Số lần ghi TT
+        'beta_cutoffs',        # Số node bị cắt alpha-beta
+        'first_move_cutoffs',  # ... trong đó cắt ngay ở nước đầu tiên
+        'killer_cutoffs',      # ... trong đó nước gây cắt là killer move
+        'history_cutoffs',     # ... trong đó nước gây cắt là nước yên lặng có điểm history
+        'lmr_reductions',      # Số nước bị giảm depth (LMR)
+        'lmr_researches',      # Số lần phải search lại full depth sau LMR
+        'frontier_nodes',      # Node có depth 1..FRONTIER_DEPTH
+        'frontier_moves',      # Số nước được xét ở các node biên
+        'futility_pruned',     # Số nước yên lặng bị bỏ do futility
+        'late_move_pruned',    # Số nước yên lặng xếp sau bị bỏ do late move pruning
+        'razored',             # Số node biên bị cắt do razoring
+        'opening_cache_hits',  # Nước lấy từ opening cache (không search)
+        'book_hits',           # Nước lấy từ opening book (không search)
+        'tablebase_hits'       # Node có kết quả chính xác từ tablebase cờ tàn
+    )
+    
+    def __init__(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.nodes = 0
+        self.depth = 0
+        self.iterations = []  # [{'depth', 'nodes', 'time', 'ebf', 'completed'}]
+        self.start_time = time.monotonic()
+        self.elapsed = 0.0
+        # Cooperative mode: số lần nhường event loop, khoảng dài nhất search chạy liền
+        # không nhường (giây) - chính là độ trễ tối đa search gây ra cho greenlet khác
+        self.yields = 0
+        self.max_yield_gap = 0.0
+        self.last_yield = self.start_time
+        # Search bị hủy từ bên ngoài (CancelToken): 1 / 0 và phần giới hạn cứng chưa dùng (giây)
+        self.cancelled = 0
+        self.time_saved = 0.0
+    
+    def end_iteration(self, depth: int, nodes: int, completed: bool = True):
+        """Ghi số liệu sau mỗi depth của Iterative Deepening (nodes tính từ đầu search)"""
+        previous = self.iterations[-1]['nodes'] if self.iterations else 0
+        iteration_nodes = nodes - previous
+        ebf = 0.0
+        if len(self.iterations) >= 2:
+            previous_nodes = previous - self.iterations[-2]['nodes']
+            ebf = iteration_nodes / max(1, previous_nodes)
+        elif self.iterations:
+            ebf = iteration_nodes / max(1, previous)
+        self.iterations.append({
+            'depth': depth,
+            'nodes': nodes,
+            'time': round(time.monotonic() - self.start_time, 4),
+            'ebf': round(ebf, 2),
+            'completed': completed
+        })
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Dựng lại từ to_dict() (vd thống kê gửi về từ process khác)"""
+        stats = cls()
+        for name in cls.COUNTERS:
+            setattr(stats, name, data.get(name, 0))
+        stats.nodes = data.get('nodes', 0)
+        stats.depth = data.get('depth', 0)
+        stats.elapsed = data.get('elapsed', 0.0)
+        stats.iterations = list(data.get('iterations', []))
+        stats.yields = data.get('yields', 0)
+        stats.max_yield_gap = data.get('max_yield_gap', 0.0)
+        stats.cancelled = data.get('cancelled', 0)
+        stats.time_saved = data.get('time_saved', 0.0)
+        return stats
+    
+    def finish(self, nodes: int, depth: int):
+        """Chốt thống kê khi search kết thúc"""
+        self.nodes = nodes
+        self.depth = depth
+        self.elapsed = time.monotonic() - self.start_time
+        if self.yields:
+            # Đoạn cuối: từ lần nhường cuối đến khi search kết thúc
+            self.max_yield_gap = max(self.max_yield_gap, time.monotonic() - self.last_yield)
+    
+    @staticmethod
+    def _rate(part, total):
+        return part / total if total else 0.0
+    
+    def ebf(self) -> float:
+        """Hệ số phân nhánh hiệu dụng: nodes ^ (1 / depth)"""
+        if self.depth <= 0 or self.nodes <= 0:
+            return 0.0
+        return self.nodes ** (1.0 / self.depth)
+    
+    def to_dict(self):
+        """Chuyển sang dict (gồm các tỉ lệ tính sẵn)"""
+        data = {name: getattr(self, name) for name in self.COUNTERS}
+        data.update({
+            'nodes': self.nodes,
+            'depth': self.depth,
+            'elapsed': round(self.elapsed, 4),
+            'nps': round(self._rate(self.nodes, self.elapsed)),
+            'ebf': round(self.ebf(), 2),
+            'tt_hit_rate': round(self._rate(self.tt_hits, self.tt_probes), 4),
+            'first_move_cutoff_rate': round(self._rate(self.first_move_cutoffs, self.beta_cutoffs), 4),
+            'killer_hit_rate': round(self._rate(self.killer_cutoffs, self.beta_cutoffs), 4),
+            'history_hit_rate': round(self._rate(self.history_cutoffs, self.beta_cutoffs), 4),
+            'lmr_research_rate': round(self._rate(self.lmr_researches, self.lmr_reductions), 4),
+            'futility_rate': round(self._rate(self.futility_pruned, self.frontier_moves), 4),
+            'late_move_prune_rate': round(self._rate(self.late_move_pruned, self.frontier_moves), 4),
+            'razor_rate': round(self._rate(self.razored, self.frontier_nodes), 4),
+            'yields': self.yields,
+            'max_yield_gap': round(self.max_yield_gap, 4),
+            'cancelled': self.cancelled,
+            'time_saved': round(self.time_saved, 4),
+            'iterations': list(self.iterations)
+        })
+        return data
+    
+    def summary(self) -> str:
+        """Một dòng tóm tắt cho log"""
+        cooperative = ''
+        if self.yields:
+            cooperative = f", {self.yields} yield, nghẽn tối đa {self.max_yield_gap * 1000:.1f}ms"
+        return (f"{self.nodes} nodes, depth {self.depth}, {self.elapsed:.2f}s, "
+                f"{self._rate(self.nodes, self.elapsed):.0f} nps, ebf {self.ebf():.2f}, "
+                f"TT hit {self._rate(self.tt_hits, self.tt_probes):.0%}, "
+                f"cut@1 {self._rate(self.first_move_cutoffs, self.beta_cutoffs):.0%}, "
+                f"futility {self._rate(self.futility_pruned, self.frontier_moves):.0%}, "
+                f"razor {self._rate(self.razored, self.frontier_nodes):.0%}{cooperative}"
+                f"{', bị hủy' if self.cancelled else ''}")
+
+
+class SearchResult:
+    """Kết quả 1 lần search của ChessAI.search()"""
+    
+    def __init__(self, move, depth: int, score, stats: SearchStats):
+        self.move = move      # Nước đi dạng số nguyên (board.encode_move) hoặc None nếu hết nước
+        self.depth = depth    # Depth hoàn thành sâu nhất
+        self.score = score    # Điểm root theo góc nhìn Đỏ
+        self.stats = stats
+    
+    def to_dict(self):
+        return {
+            'move': list(decode_move(self.move)) if self.move is not None else None,
+            'depth': self.depth,
+            'score': self.score,
+            'stats': self.stats.to_dict()
+        }
+
+
+class StatsRegistry:
+    """Cộng dồn thống kê search của mọi game trong process, theo level"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.levels = {}  # level -> {'searches', 'nodes', 'elapsed', 'depth', 'yields', 'max_yield_gap',
+                          #           'cancelled', 'time_saved', <counters>}
+    
+    def record(self, level: str, stats: SearchStats):
+        """Cộng 1 lần search vào tổng của level"""
+        with self.lock:
+            total = self.levels.get(level)
+            if total is None:
+                total = dict.fromkeys(('searches', 'nodes', 'elapsed', 'depth', 'yields', 'max_yield_gap',
+                                       'cancelled', 'time_saved') + SearchStats.COUNTERS, 0)
+                self.levels[level] = total
+            total['searches'] += 1
+            total['nodes'] += stats.nodes
+            total['elapsed'] += stats.elapsed
+            total['depth'] += stats.depth
+            total['yields'] += stats.yields
+            total['max_yield_gap'] = max(total['max_yield_gap'], stats.max_yield_gap)
+            total['cancelled'] += stats.cancelled
+            total['time_saved'] += stats.time_saved
+            for name in SearchStats.COUNTERS:
+                total[name] += getattr(stats, name)
+    
+    def snapshot(self):
+        """Tổng theo level kèm các giá trị trung bình / tỉ lệ"""
+        rate = SearchStats._rate
+        with self.lock:
+            result = {}
+            for level, total in self.levels.items():
+                data = dict(total)
+                data.update({
+                    'elapsed': round(total['elapsed'], 3),
+                    'max_yield_gap': round(total['max_yield_gap'], 4),
+                    'time_saved': round(total['time_saved'], 3),
+                    'avg_nodes': round(rate(total['nodes'], total['searches'])),
+                    'avg_depth': round(rate(total['depth'], total['searches']), 2),
+                    'avg_time': round(rate(total['elapsed'], total['searches']), 3),
+                    'nps': round(rate(total['nodes'], total['elapsed'])),
+                    'tt_hit_rate': round(rate(total['tt_hits'], total['tt_probes']), 4),
+                    'first_move_cutoff_rate': round(rate(total['first_move_cutoffs'], total['beta_cutoffs']), 4),
+                    'killer_hit_rate': round(rate(total['killer_cutoffs'], total['beta_cutoffs']), 4),
+                    'history_hit_rate': round(rate(total['history_cutoffs'], total['beta_cutoffs']), 4)
+                })
+                result[level] = data
+            return result
+    
+    def reset(self):
+        with self.lock:
+            self.levels.clear()
+
+
+# Registry dùng chung cho cả process
+STATS_REGISTRY = StatsRegistry()
@@ -0,0 +1,543 @@
+"""
+Lazy SMP - Search song song nhiều process với Transposition Table dùng chung
+
+CPython có GIL nên thread không giúp gì cho search (toàn code Python thuần).
+Lazy SMP dùng process thay cho thread:
+- N helper process cùng search vị trí gốc bằng Iterative Deepening,
+  helper lẻ/chẵn bắt đầu ở depth lệch nhau để không đi cùng một cây
+- Tất cả dùng chung 1 Transposition Table đặt trong multiprocessing.shared_memory,
+  KHÔNG dùng khóa: mỗi entry lưu (key XOR data, data), entry bị ghi dở dang
+  sẽ không khớp key khi đọc và bị bỏ qua như cache miss
+- Process chính search như bình thường; khi xong (hết giờ hoặc đủ depth) báo dừng
+  qua 1 word trong shared memory rồi lấy nước của depth sâu nhất đã hoàn thành
+
+Bật bằng biến môi trường AI_SMP_HELPERS (số helper cho level hard), xem ChessAI.smp_helpers
+
+Ngoài ra có chế độ đơn giản hơn, chia nước ở root (RootSplitter):
+- Nước đầu tiên (thường là nước tốt nhất) search ở process chính để có cận
+- Các nước còn lại chia thành từng vòng, mỗi vòng mỗi worker của
+  ProcessPoolExecutor search 1 nhóm nước với null window quanh cận hiện tại
+- Hết mỗi vòng process chính gộp kết quả và cập nhật cận cho vòng sau
+- Worker nhận bàn cờ dạng FEN + các nước gần nhất (Board.serialize), không pickle grid
+Bật bằng biến môi trường AI_ROOT_SPLIT_WORKERS, xem ChessAI.root_split_workers
+
+Đo độ tăng tốc trên máy hiện tại:
+    python -m server.smp
+"""
+
+import atexit
+import concurrent.futures
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+from server.ai import ChessAI, SearchAborted, TranspositionTable, value_from_tt, value_to_tt
+from server.board import Board
+from server.tablebase import TABLEBASES, configure_tablebases
+
+logger = logging.getLogger(__name__)
+
+# Số entry của TT dùng chung (mỗi entry 16 bytes => 2^18 entries = 4MB)
+SHARED_TT_ENTRIES = 1 << 18
+
+# Giá trị lưu dạng số nguyên 32 bit có dấu (cộng offset), gồm cả điểm chiếu hết MATE_SCORE
+VALUE_OFFSET = 1 << 31
+
+# Số nước mỗi worker nhận trong 1 vòng chia root
+ROOT_SPLIT_CHUNK = 2
+
+# Thời gian tối đa chờ helper báo xong sau khi báo dừng (giây); helper dừng ở lần đọc đồng hồ
+# kế tiếp nên thường chỉ vài ms, quá hạn (helper chết / treo) thì bỏ qua helper đó
+HELPER_DONE_TIMEOUT = 1.0
+
+
+class SharedTranspositionTable:
+    """
+    Transposition Table trong shared memory, cùng interface với TranspositionTable
+    
+    Bố cục (mảng uint64):
+        [0]              id của search đang chạy (0 = dừng)
+        [1]              dự phòng
+        [2 + 2i]         key XOR data của entry i
+        [2 + 2i + 1]     data của entry i: value (32 bit) | depth (8 bit) | flag (2 bit)
+                         | move (14 bit, nước đi dạng số nguyên + 1, 0 = không có)
+    """
+    EXACT = TranspositionTable.EXACT
+    LOWER = TranspositionTable.LOWER
+    UPPER = TranspositionTable.UPPER
+    
+    HEADER_WORDS = 2
+    
+    def __init__(self, num_entries: int = SHARED_TT_ENTRIES, name: str = None):
+        """
+        Args:
+            num_entries: số entry (làm tròn lên lũy thừa của 2)
+            name: tên shared memory đã có (process con attach vào), None = tạo mới
+        """
+        self.num_entries = 1 << max(1, (num_entries - 1).bit_length())
+        self.mask = self.num_entries - 1
+        size = (self.HEADER_WORDS + 2 * self.num_entries) * 8
+        
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.name = self.shm.name
+        self.words = self.shm.buf[:size].cast('Q')
+    
+    def hash_board(self, board: Board):
+        """Lấy Zobrist key của bàn cờ"""
+        return board.zobrist_key
+    
+    def lookup(self, board: Board, depth: int, alpha: float, beta: float, ply: int = 0):
+        """Tìm trong cache (lock-free: entry ghi dở dang bị coi như không có)"""
+        key = board.zobrist_key
+        index = self.HEADER_WORDS + 2 * (key & self.mask)
+        words = self.words
+        data = words[index + 1]
+        if words[index] ^ data != key:
+            return None, False
+        
+        entry_depth = (data >> 32) & 0xFF
+        if entry_depth < depth:
+            return None, False
+        
+        value = value_from_tt((data & 0xFFFFFFFF) - VALUE_OFFSET, ply)
+        
+        flag = (data >> 40) & 0x3
+        if flag == self.EXACT:
+            return value, True
+        elif flag == self.LOWER and value >= beta:
+            return value, True
+        elif flag == self.UPPER and value <= alpha:
+            return value, True
+        return None, False
+    
+    def store(self, board: Board, depth: int, value: float, flag: int, move: int = None,
+              ply: int = 0):
+        """Lưu vào cache (luôn ghi đè slot; move = None thì giữ nước đã lưu của cùng vị trí)"""
+        packed_value = int(value_to_tt(value, ply))
+        
+        key = board.zobrist_key
+        index = self.HEADER_WORDS + 2 * (key & self.mask)
+        
+        packed_move = 0 if move is None else move + 1
+        if move is None:
+            # Cùng vị trí: giữ nước đã lưu
+            old = self.words[index + 1]
+            if self.words[index] ^ old == key:
+                packed_move = (old >> 42) & 0x3FFF
+        
+        data = (((packed_value + VALUE_OFFSET) & 0xFFFFFFFF) | ((depth & 0xFF) << 32)
+                | (flag << 40) | (packed_move << 42))
+        self.words[index] = key ^ data
+        self.words[index + 1] = data
+    
+    def probe_move(self, board: Board):
+        """Lấy nước tốt nhất đã lưu cho vị trí (None nếu không có)"""
+        key = board.zobrist_key
+        index = self.HEADER_WORDS + 2 * (key & self.mask)
+        data = self.words[index + 1]
+        if self.words[index] ^ data != key:
+            return None
+        packed_move = (data >> 42) & 0x3FFF
+        if not packed_move:
+            return None
+        return packed_move - 1
+    
+    def clear(self):
+        """Xóa cache (giữ nguyên header)"""
+        words = self.words
+        for i in range(self.HEADER_WORDS, len(words)):
+            words[i] = 0
+    
+    # Header: id search đang chạy, helper dừng khi id khác id nó đang search
+    
+    def active_search(self) -> int:
+        return self.words[0]
+    
+    def set_active_search(self, search_id: int):
+        self.words[0] = search_id
+    
+    def close(self):
+        """Giải phóng shared memory (process tạo ra thì unlink luôn)"""
+        self.words.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _helper_main(index, shm_name, num_entries, commands, results, tablebase=(None, 0)):
+    """
+    Vòng lặp của helper process (tablebase: TABLEBASES.settings() của process chính)
+    
+    Lệnh: (search_id, fen, moves, level, color, max_depth, time_limit) hoặc None để thoát
+    Kết quả: (search_id, index, depth, move, value, nodes) sau mỗi depth hoàn thành, và
+    (search_id, index, None, None, None, nodes) khi helper xong lệnh (kể cả lệnh bị bỏ qua)
+    """
+    configure_tablebases(*tablebase)
+    tt = SharedTranspositionTable(num_entries, name=shm_name)
+    engines = {}
+    
+    while True:
+        command = commands.get()
+        if command is None:
+            break
+        
+        search_id, fen, moves, level, color, max_depth, time_limit = command
+        if tt.active_search() != search_id:
+            # Search đã kết thúc trước khi helper kịp nhận lệnh
+            results.put((search_id, index, None, None, None, 0))
+            continue
+        
+        # Giữ engine theo (level, color) để killer/history còn dùng được giữa các lần search
+        ai = engines.get((level, color))
+        if ai is None:
+            ai = ChessAI(level=level, color=color)
+            ai.tt = tt
+            ai.verbose = False
+            engines[(level, color)] = ai
+        
+        # Như ChessAI.search: thống kê mới cho mỗi lần search, history / killer được làm cũ
+        ai._reset_search()
+        ai._age_tables()
+        ai.stop_check = lambda: tt.active_search() != search_id
+        ai.timer.start(time_limit)
+        
+        board = Board.from_fen(fen, moves)
+        # Helper chẵn bắt đầu ở depth 2, helper lẻ ở depth 1 (+ process chính) để lệch nhau
+        start_depth = min(max_depth, 1 + (index + 1) % 2)
+        
+        def report(depth, move, value):
+            results.put((search_id, index, depth, move, value, ai.nodes_evaluated))
+        
+        ai._iterative_deepening(board, max_depth, start_depth, on_depth=report)
+        results.put((search_id, index, None, None, None, ai.nodes_evaluated))
+    
+    tt.close()
+
+
+class LazySMP:
+    """
+    Pool helper process cho Lazy SMP (1 pool dùng chung cho cả server)
+    Mỗi lúc chỉ chạy 1 search song song; search khác đến khi pool bận sẽ tự search 1 process
+    """
+    
+    _instance = None
+    _instance_lock = threading.Lock()
+    
+    def __init__(self, num_helpers: int, tt_entries: int = SHARED_TT_ENTRIES):
+        self.context = mp.get_context('spawn')  # Không fork process đang chạy event loop
+        self.tt = SharedTranspositionTable(tt_entries)
+        self.results = self.context.Queue()
+        self.helpers = []
+        self.search_id = 0
+        self.busy = threading.Lock()
+        self.closed = False
+        self.add_helpers(num_helpers)
+        atexit.register(self.shutdown)
+    
+    @classmethod
+    def get(cls, num_helpers: int):
+        """Lấy pool dùng chung, tạo thêm helper nếu cần"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(num_helpers)
+            elif len(cls._instance.helpers) < num_helpers:
+                cls._instance.add_helpers(num_helpers - len(cls._instance.helpers))
+            return cls._instance
+    
+    def add_helpers(self, count: int):
+        """Khởi động thêm helper process"""
+        for _ in range(count):
+            index = len(self.helpers)
+            commands = self.context.Queue()
+            process = self.context.Process(
+                target=_helper_main,
+                args=(index, self.tt.name, self.tt.num_entries, commands, self.results,
+                      TABLEBASES.settings()),
+                daemon=True,
+                name=f"ai-smp-helper-{index}"
+            )
+            process.start()
+            self.helpers.append((process, commands))
+        logger.info(f"Lazy SMP: {len(self.helpers)} helper process")
+    
+    def search(self, ai: ChessAI, board: Board, max_depth: int, num_helpers: int = None):
+        """
+        Search song song cho ai trên board (ai.timer đã được start)
+        
+        Returns:
+            (best_move, depth) của depth sâu nhất đã hoàn thành trong mọi process;
+            ai.last_score là điểm của chính nước đó (của helper nếu nước lấy từ helper)
+        """
+        if not self.busy.acquire(blocking=False):
+            return ai._iterative_deepening(board, max_depth)
+        
+        private_tt = ai.tt
+        try:
+            self.search_id += 1
+            search_id = self.search_id
+            self.tt.set_active_search(search_id)
+            
+            fen, moves = board.serialize()
+            time_limit = max(0.0, ai.timer.hard_limit - ai.timer.elapsed())
+            helpers = self.helpers[:num_helpers] if num_helpers else self.helpers
+            started = 0
+            for process, commands in helpers:
+                if process.is_alive():
+                    commands.put((search_id, fen, moves, ai.level, ai.color, max_depth, time_limit))
+                    started += 1
+            
+            # Process chính search với TT dùng chung
+            ai.tt = self.tt
+            best_move, best_depth = ai._iterative_deepening(board, max_depth)
+            
+            # Báo helper dừng, chờ mọi helper báo xong rồi lấy kết quả depth sâu nhất; có
+            # yield_hook thì mỗi lần chỉ chờ tối đa ai.yield_interval rồi nhường event loop
+            self.tt.set_active_search(0)
+            helper_nodes = 0
+            finished = 0
+            deadline = time.monotonic() + HELPER_DONE_TIMEOUT
+            while finished < started:
+                remaining = max(0.0, deadline - time.monotonic())
+                try:
+                    result_id, _, depth, move, value, nodes = self.results.get(
+                        timeout=min(remaining, ai.yield_interval) if ai.yield_hook else remaining)
+                except queue.Empty:
+                    if time.monotonic() >= deadline:
+                        logger.warning(f"Lazy SMP: {started - finished} helper không báo xong search {search_id}")
+                        break
+                    ai.yield_hook()
+                    continue
+                if result_id != search_id:
+                    continue  # Báo cáo trễ của search trước
+                helper_nodes = max(helper_nodes, nodes)
+                if depth is None:
+                    finished += 1
+                elif depth > best_depth:
+                    best_move, best_depth = move, depth
+                    ai.last_score = value
+            
+            if ai.verbose:
+                print(f"Lazy SMP: {len(helpers)} helper, depth {best_depth}, helper nodes ~{helper_nodes}")
+            return best_move, best_depth
+        finally:
+            ai.tt = private_tt
+            self.busy.release()
+    
+    def shutdown(self):
+        """Dừng helper và giải phóng shared memory (gọi nhiều lần không sao)"""
+        if self.closed:
+            return
+        self.closed = True
+        self.tt.set_active_search(0)
+        for process, commands in self.helpers:
+            try:
+                commands.put(None)
+            except Exception:
+                pass
+        for process, _ in self.helpers:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        self.helpers = []
+        try:
+            self.tt.close()
+        except Exception:
+            pass
+
+
+# Engine của mỗi worker process, giữ lại giữa các lần gọi để TT riêng còn ấm
+_worker_engines = {}
+
+
+def _search_root_chunk(fen, history, level, color, depth, moves, bound, maximizing, time_limit):
+    """
+    Chạy trong worker process: search 1 nhóm nước ở root với cận bound
+    
+    Returns:
+        (results, nodes, aborted) - results là list (move, value) của các nước đã xong
+    """
+    ai = _worker_engines.get((level, color))
+    if ai is None:
+        ai = ChessAI(level=level, color=color)
+        ai.verbose = False
+        _worker_engines[(level, color)] = ai
+    
+    ai.nodes_evaluated = 0
+    ai.timer.start(time_limit)
+    board = Board.from_fen(fen, history)
+    
+    results = []
+    try:
+        for move in moves:
+            value = ai._search_root_move(board, move, depth, maximizing, bound, False)
+            results.append((move, value))
+            # Cận được siết ngay trong nhóm
+            if (maximizing and value > bound) or (not maximizing and value < bound):
+                bound = value
+    except SearchAborted:
+        return results, ai.nodes_evaluated, True
+    
+    return results, ai.nodes_evaluated, False
+
+
+class RootSplitter:
+    """
+    Chia các nước ở root cho ProcessPoolExecutor (1 pool dùng chung cho cả server)
+    """
+    
+    _instance = None
+    _instance_lock = threading.Lock()
+    
+    def __init__(self, num_workers: int):
+        self.num_workers = num_workers
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=mp.get_context('spawn'),
+            initializer=configure_tablebases,
+            initargs=TABLEBASES.settings()
+        )
+        self.active = 0  # Số search_root đang chạy (ở các greenlet / thread khác nhau)
+        atexit.register(self.shutdown)
+    
+    @classmethod
+    def get(cls, num_workers: int):
+        """
+        Lấy pool dùng chung, tạo lại nếu cần nhiều worker hơn; pool đang có search chạy
+        thì không bị thay (search mới dùng tạm số worker hiện có)
+        """
+        with cls._instance_lock:
+            instance = cls._instance
+            if instance is None or (instance.num_workers < num_workers and not instance.active):
+                if instance is not None:
+                    instance.shutdown()
+                cls._instance = cls(num_workers)
+                logger.info(f"Root splitting: {num_workers} worker process")
+            return cls._instance
+    
+    def search_root(self, ai: ChessAI, board: Board, moves: list, depth: int, maximizing: bool):
+        """
+        Search các nước ở root (đã sắp xếp) song song
+        
+        Returns:
+            (best_move, best_value); raise SearchAborted nếu hết giờ giữa chừng
+        """
+        with self._instance_lock:
+            self.active += 1
+        try:
+            return self._search_root(ai, board, moves, depth, maximizing)
+        finally:
+            with self._instance_lock:
+                self.active -= 1
+    
+    def _search_root(self, ai: ChessAI, board: Board, moves: list, depth: int, maximizing: bool):
+        # Nước đầu tiên search tại chỗ để có cận cho các vòng sau
+        best_move = moves[0]
+        best_value = ai._search_root_move(board, best_move, depth, maximizing, None, True)
+        
+        fen, history = board.serialize()
+        remaining = moves[1:]
+        round_size = self.num_workers * ROOT_SPLIT_CHUNK
+        
+        for start in range(0, len(remaining), round_size):
+            if ai.timer.check(ai.nodes_evaluated):
+                raise SearchAborted()
+            if ai.cancel_token is not None and ai.cancel_token.cancelled:
+                raise SearchAborted()
+            time_limit = max(0.0, ai.timer.hard_limit - ai.timer.elapsed())
+            
+            round_moves = remaining[start:start + round_size]
+            futures = [
+                self.executor.submit(
+                    _search_root_chunk, fen, history, ai.level, ai.color, depth,
+                    round_moves[i:i + ROOT_SPLIT_CHUNK], best_value, maximizing, time_limit)
+                for i in range(0, len(round_moves), ROOT_SPLIT_CHUNK)
+            ]
+            
+            aborted = False
+            for results, nodes, chunk_aborted in self._wait(ai, futures):
+                ai.nodes_evaluated += nodes
+                aborted = aborted or chunk_aborted
+                for move, value in results:
+                    if (maximizing and value > best_value) or (not maximizing and value < best_value):
+                        best_value = value
+                        best_move = move
+            
+            if aborted:
+                raise SearchAborted()
+        
+        return best_move, best_value
+    
+    @staticmethod
+    def _wait(ai: ChessAI, futures: list):
+        """
+        Kết quả các nhóm theo thứ tự xong trước; giống EnginePool._wait, có yield_hook thì
+        chỉ chờ tối đa ai.yield_interval mỗi lần rồi nhường event loop (không chặn game khác)
+        CancelToken bị hủy: bỏ các nhóm chưa xong (worker tự dừng khi hết giới hạn thời gian)
+        """
+        pending = set(futures)
+        timeout = ai.yield_interval if ai.yield_hook else None
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+            if pending:
+                if ai.cancel_token is not None and ai.cancel_token.cancelled:
+                    for future in pending:
+                        future.cancel()
+                    raise SearchAborted()
+                if ai.yield_hook:
+                    ai.yield_hook()
+    
+    def shutdown(self):
+        """Dừng pool"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def benchmark(max_helpers: int = None, level: str = 'hard', time_limit: float = 5.0):
+    """
+    Đo depth đạt được và thời gian tới depth đó với 0..max_helpers helper Lazy SMP,
+    rồi với 2..max_helpers+1 worker chia root (cùng vị trí, cùng giới hạn thời gian)
+    """
+    if max_helpers is None:
+        max_helpers = max(0, (os.cpu_count() or 1) - 1)
+    
+    board = Board()
+    for move in [(7, 1, 7, 4), (0, 1, 2, 2), (9, 1, 7, 2), (0, 7, 2, 6)]:
+        board.move(*move)
+    
+    for helpers in range(0, max_helpers + 1):
+        ai = ChessAI(level=level, color=board.turn)
+        ai.verbose = False
+        ai.depth_map[level] = 8
+        ai.time_limit[level] = time_limit
+        ai.smp_helpers[level] = helpers
+        
+        start = time.monotonic()
+        ai.choose_move(board)
+        elapsed = time.monotonic() - start
+        print(f"helpers={helpers}: depth {ai.last_depth} trong {elapsed:.2f}s "
+              f"({ai.last_depth / elapsed:.2f} depth/s)")
+    
+    for workers in range(2, max_helpers + 2):
+        ai = ChessAI(level=level, color=board.turn)
+        ai.verbose = False
+        ai.depth_map[level] = 8
+        ai.time_limit[level] = time_limit
+        ai.smp_helpers[level] = 0
+        ai.root_split_workers[level] = workers
+        
+        start = time.monotonic()
+        ai.choose_move(board)
+        elapsed = time.monotonic() - start
+        print(f"root split workers={workers}: depth {ai.last_depth} trong {elapsed:.2f}s "
+              f"({ai.last_depth / elapsed:.2f} depth/s)")
+
+
+if __name__ == "__main__":
+    benchmark()
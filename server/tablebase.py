@@ -0,0 +1,531 @@
+"""
+Tablebase cờ tàn - kết quả chính xác của các thế ít quân, tạo bằng phân tích ngược (retrograde analysis)
+
+Mỗi bộ quân (material signature) là 1 file, tên theo quân của 2 bên, vd KRvKAA = Tướng Xe
+đấu Tướng 2 Sĩ. Bộ quân chỉ lưu theo 1 hướng (bên mạnh hơn là Đỏ); vị trí có bên mạnh là Đen
+được lật dọc bàn cờ (hàng r <-> 9 - r, đổi màu quân và lượt đi) trước khi tra.
+
+Luật theo Board: hết nước mà đang bị chiếu là thua, hết nước mà không bị chiếu là hòa; lặp
+lại vị trí được coi là hòa (tablebase không xét luật chiếu dai / đuổi dai). Bộ quân không còn
+Xe / Mã / Pháo / Tốt ở cả 2 bên không thể chiếu nên luôn hòa, không cần file.
+
+Generator (offline):
+- Liệt kê mọi vị trí của bộ quân (Tướng / Sĩ / Tượng / Tốt chỉ đứng ở ô chúng tới được) và
+  sinh nước đi hợp lệ bằng Board; nước ăn quân dẫn sang bộ quân nhỏ hơn (được tạo trước, đệ quy)
+- Lan ngược theo khoảng cách tăng dần từ các vị trí bị chiếu hết: vị trí có nước tới vị trí
+  thua của đối phương là thắng, vị trí mọi nước đều tới vị trí thắng của đối phương là thua,
+  còn lại là hòa
+
+Định dạng file (little-endian), 1 byte / vị trí: 0 = hòa (hoặc vị trí không hợp lệ),
+1..127 = bên đi thắng, chiếu hết sau 2v - 1 ply; 128 + v = bên đi thua sau 2v ply. Mảng được
+chia khối BLOCK_SIZE vị trí, mỗi khối nén zlib; file được mmap, khối được giải nén khi tra và
+giữ trong cache LRU dùng chung:
+    Header 32 byte: magic b'XQTB', version (u16), 2 byte trống, tên bộ quân (16 byte ascii),
+                    số vị trí (u32), số vị trí mỗi khối (u32)
+    Bảng offset: (số khối + 1) x u32, tính từ đầu file
+    Các khối nén
+
+Tạo tablebase (kèm các bộ quân nhỏ hơn mà nước ăn quân dẫn tới):
+    python -m server.tablebase <thư mục> [bộ quân ...]
+"""
+
+import functools
+import itertools
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+
+from server.board import Board, PIECE_VALUES
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<4sH2x16sII')
+MAGIC = b'XQTB'
+VERSION = 1
+FILE_SUFFIX = '.xqtb'
+
+# Số vị trí mỗi khối nén
+BLOCK_SIZE = 4096
+
+# Số khối đã giải nén giữ trong cache (mỗi khối BLOCK_SIZE byte)
+TABLEBASE_CACHE_BLOCKS = 256
+
+# Bộ quân generator tạo khi không chỉ định; KPvK không cần ghi riêng (Tốt lẻ không thắng
+# được Tướng trơ theo luật của Board nên toàn hòa), vẫn được tạo khi KCPvK cần tới
+DEFAULT_SIGNATURES = ('KRvK', 'KNvK', 'KRvKA', 'KRvKE', 'KRvKAA', 'KCPvK')
+
+# Kết quả tra cho bên đang đi
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+# Thứ tự quân (không tính Tướng) trong tên bộ quân; ATTACKERS: quân chiếu được Tướng đối phương
+PIECE_ORDER = 'RNCPAE'
+ATTACKERS = 'RNCP'
+OTHER_COLOR = {'red': 'black', 'black': 'red'}
+
+
+def flip_square(sq: int) -> int:
+    """Ô đối xứng qua sông (hàng r <-> 9 - r)"""
+    return (9 - sq // 9) * 9 + sq % 9
+
+
+def _squares(cells):
+    return tuple(sorted(r * 9 + c for r, c in cells))
+
+
+# Các ô quân Đỏ có thể đứng (Đen: lật qua sông), đã sắp xếp tăng dần
+RED_DOMAINS = {
+    'K': _squares((r, c) for r in range(7, 10) for c in range(3, 6)),
+    'A': _squares(((9, 3), (9, 5), (8, 4), (7, 3), (7, 5))),
+    'E': _squares(((9, 2), (9, 6), (7, 0), (7, 4), (7, 8), (5, 2), (5, 6))),
+    # Tốt chưa qua sông chỉ đi thẳng trên cột xuất phát
+    'P': _squares([(r, c) for r in range(5) for c in range(9)] + [(r, c) for r in (5, 6) for c in range(0, 9, 2)]),
+    'R': tuple(range(90)),
+    'N': tuple(range(90)),
+    'C': tuple(range(90))
+}
+DOMAINS = {}
+for _type, _domain in RED_DOMAINS.items():
+    DOMAINS[(_type, 'red')] = _domain
+    DOMAINS[(_type, 'black')] = tuple(sorted(flip_square(sq) for sq in _domain))
+
+
+def side_string(types) -> str:
+    """Chuỗi quân (không tính Tướng) của 1 bên theo PIECE_ORDER, vd 'RAA'"""
+    return ''.join(sorted(types, key=PIECE_ORDER.index))
+
+
+def parse_name(name: str):
+    """'KRvKAA' -> ('R', 'AA'); ValueError nếu sai định dạng"""
+    match = re.fullmatch(r'K([RNCPAE]*)vK([RNCPAE]*)', name.strip(), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Bộ quân không hợp lệ: {name}")
+    return side_string(match.group(1).upper()), side_string(match.group(2).upper())
+
+
+def canonical(red: str, black: str):
+    """Hướng lưu của bộ quân (bên mạnh hơn là Đỏ): (red, black, có lật màu không)"""
+    strength = lambda side: (sum(PIECE_VALUES[t] for t in side), side)
+    if strength(black) > strength(red):
+        return black, red, True
+    return red, black, False
+
+
+def is_drawn(red: str, black: str) -> bool:
+    """Không bên nào còn quân chiếu được Tướng: luôn hòa"""
+    return not any(t in ATTACKERS for t in red + black)
+
+
+class Layout:
+    """
+    Cách đánh số vị trí của 1 bộ quân (hướng lưu): quân xếp theo Tướng Đỏ, Tướng Đen, quân
+    Đỏ, quân Đen; index = (cơ số hỗn hợp theo vị trí trong miền ô của từng quân) * 2 + lượt
+    đi (0 = Đỏ); các quân giống nhau của 1 bên được xếp theo ô tăng dần
+    """
+    
+    def __init__(self, red: str, black: str):
+        self.red = red
+        self.black = black
+        self.name = f"K{red}vK{black}"
+        self.pieces = ([('K', 'red'), ('K', 'black')] + [(t, 'red') for t in red]
+                       + [(t, 'black') for t in black])
+        self.domains = [DOMAINS[piece] for piece in self.pieces]
+        self.positions = [{sq: i for i, sq in enumerate(domain)} for domain in self.domains]
+        self.size = 2 * math.prod(len(domain) for domain in self.domains)
+        # Cặp (i, i + 1) cùng loại cùng màu: ô quân i phải nhỏ hơn ô quân i + 1
+        self.same_pairs = [i for i in range(len(self.pieces) - 1) if self.pieces[i] == self.pieces[i + 1]]
+    
+    def index(self, squares, turn: str):
+        """Index của vị trí (ô theo thứ tự self.pieces), None nếu có quân đứng ngoài miền ô"""
+        if self.same_pairs:
+            squares = self._sort_groups(list(squares))
+        index = 0
+        for positions, domain, sq in zip(self.positions, self.domains, squares):
+            position = positions.get(sq)
+            if position is None:
+                return None
+            index = index * len(domain) + position
+        return index * 2 + (turn == 'black')
+    
+    def _sort_groups(self, squares):
+        start = 0
+        pieces = self.pieces
+        for end in range(1, len(pieces) + 1):
+            if end == len(pieces) or pieces[end] != pieces[start]:
+                if end - start > 1:
+                    squares[start:end] = sorted(squares[start:end])
+                start = end
+        return squares
+    
+    def captures(self):
+        """Các bộ quân (hướng lưu) sau khi 1 quân không phải Tướng bị ăn"""
+        result = set()
+        for i in range(len(self.red)):
+            result.add(canonical(self.red[:i] + self.red[i + 1:], self.black)[:2])
+        for i in range(len(self.black)):
+            result.add(canonical(self.red, self.black[:i] + self.black[i + 1:])[:2])
+        return sorted(result)
+
+
+@functools.lru_cache(maxsize=None)
+def layout_for(red: str, black: str) -> Layout:
+    return Layout(red, black)
+
+
+def locate(pieces, turn: str):
+    """
+    Bộ quân và index của vị trí
+    
+    Args:
+        pieces: list (loại, màu, ô) mọi quân trên bàn
+        turn: bên đang đi
+    
+    Returns:
+        (Layout, index), Layout là None nếu bộ quân luôn hòa; index None nếu vị trí không
+        thuộc miền ô (vd thiếu Tướng)
+    """
+    red = side_string(t for t, color, _ in pieces if color == 'red' and t != 'K')
+    black = side_string(t for t, color, _ in pieces if color == 'black' and t != 'K')
+    red, black, flipped = canonical(red, black)
+    if is_drawn(red, black):
+        return None, None
+    if flipped:
+        pieces = [(t, OTHER_COLOR[color], flip_square(sq)) for t, color, sq in pieces]
+        turn = OTHER_COLOR[turn]
+    layout = layout_for(red, black)
+    by_piece = {}
+    for t, color, sq in pieces:
+        by_piece.setdefault((t, color), []).append(sq)
+    squares = []
+    for piece in layout.pieces:
+        group = by_piece.get(piece)
+        if not group:
+            return layout, None
+        squares.append(group.pop())
+    return layout, layout.index(squares, turn)
+
+
+def encode_value(result: int, distance: int) -> int:
+    """(WIN / LOSS / DRAW, số ply tới chiếu hết) -> 1 byte trong file"""
+    if result == DRAW:
+        return 0
+    moves = (distance + 1) // 2
+    if moves > 127:
+        raise ValueError(f"Khoảng cách {distance} ply vượt giới hạn của định dạng")
+    return moves if result == WIN else 128 + moves
+
+
+def decode_value(value: int):
+    """1 byte trong file -> (WIN / LOSS / DRAW, số ply tới chiếu hết)"""
+    if value == 0:
+        return DRAW, 0
+    if value < 128:
+        return WIN, 2 * value - 1
+    return LOSS, 2 * (value - 128)
+
+
+class Tablebase:
+    """1 file tablebase mở bằng mmap"""
+    
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, name, size, block_size = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or version != VERSION or block_size <= 0:
+                raise ValueError(f"{path} không phải tablebase v{VERSION}")
+            blocks = (size + block_size - 1) // block_size
+            self.offsets = struct.unpack_from(f'<{blocks + 1}I', mm, HEADER.size)
+            if self.offsets[-1] > len(mm):
+                raise ValueError(f"{path} bị cắt cụt")
+        except (ValueError, struct.error):
+            mm.close()
+            raise
+        self.mm = mm
+        self.name = name.rstrip(b'\0').decode('ascii')
+        self.red, self.black = parse_name(self.name)
+        self.pieces = 2 + len(self.red) + len(self.black)
+        self.size = size
+        self.block_size = block_size
+    
+    def read_block(self, block: int) -> bytes:
+        return zlib.decompress(self.mm[self.offsets[block]:self.offsets[block + 1]])
+
+
+class Tablebases:
+    """
+    Các tablebase trong 1 thư mục, tra theo vị trí của Board
+    
+    Args:
+        directory: thư mục chứa file *.xqtb (None = không có tablebase)
+        max_pieces: chỉ tra khi số quân không quá chừng này (0 = theo bộ quân lớn nhất)
+        cache_blocks: số khối đã giải nén giữ lại
+    """
+    
+    def __init__(self, directory: str = None, max_pieces: int = 0, cache_blocks: int = TABLEBASE_CACHE_BLOCKS):
+        self.tables = {}  # tên bộ quân -> Tablebase
+        self.directory = directory
+        self.limit = max_pieces
+        self.max_pieces = 0
+        self.cache_blocks = cache_blocks
+        self.cache = OrderedDict()  # (tên bộ quân, khối) -> bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            self.open_dir(directory)
+    
+    def configure(self, directory: str = None, max_pieces: int = 0):
+        """Dùng thư mục / giới hạn số quân mới (bỏ các bảng và cache đang có)"""
+        with self.lock:
+            self.tables = {}
+            self.cache.clear()
+        self.directory = directory or None
+        self.limit = max_pieces
+        self.max_pieces = 0
+        if self.directory:
+            self.open_dir(self.directory)
+    
+    def settings(self):
+        """(thư mục, giới hạn số quân) để cấu hình process con giống process này"""
+        return self.directory, self.limit
+    
+    def open_dir(self, directory: str):
+        """Mở mọi file tablebase trong thư mục (file lỗi được bỏ qua và ghi log)"""
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError as e:
+            logger.error(f"Tablebase: không đọc được {directory}: {e}")
+            return
+        for filename in names:
+            if not filename.endswith(FILE_SUFFIX):
+                continue
+            try:
+                table = Tablebase(os.path.join(directory, filename))
+            except (OSError, ValueError, struct.error) as e:
+                logger.error(f"Tablebase: bỏ qua {filename}: {e}")
+                continue
+            self.tables[table.name] = table
+        largest = max((table.pieces for table in self.tables.values()), default=0)
+        self.max_pieces = min(largest, self.limit) if self.limit else largest
+        if self.tables:
+            logger.info(f"Tablebase: {len(self.tables)} bộ quân (tối đa {largest} quân) từ {directory}")
+    
+    def probe(self, board: Board):
+        """
+        Kết quả chính xác của vị trí cho bên đang đi
+        
+        Returns:
+            (WIN / LOSS / DRAW, số ply tới chiếu hết) hoặc None nếu không có tablebase của bộ quân
+        """
+        if board.piece_count > self.max_pieces:
+            return None
+        pieces = [(piece['type'], piece['color'], r * 9 + c)
+                  for r, row in enumerate(board.grid) for c, piece in enumerate(row) if piece]
+        layout, index = locate(pieces, board.turn)
+        if layout is None:
+            self.hits += 1
+            return DRAW, 0
+        table = self.tables.get(layout.name)
+        if table is None or index is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        block, offset = divmod(index, table.block_size)
+        return decode_value(self._block(table, block)[offset])
+    
+    def _block(self, table: Tablebase, block: int) -> bytes:
+        key = (table.name, block)
+        with self.lock:
+            data = self.cache.get(key)
+            if data is not None:
+                self.cache.move_to_end(key)
+                return data
+        data = table.read_block(block)
+        with self.lock:
+            self.cache[key] = data
+            while len(self.cache) > self.cache_blocks:
+                self.cache.popitem(last=False)
+        return data
+    
+    def snapshot(self):
+        """Số liệu tablebase cho API / log"""
+        return {
+            'tables': sorted(self.tables),
+            'max_pieces': self.max_pieces,
+            'hits': self.hits,
+            'misses': self.misses,
+            'cached_blocks': len(self.cache)
+        }
+
+
+# Tablebase dùng chung cho cả process; app cấu hình theo Config.AI_TABLEBASE_DIR /
+# AI_TABLEBASE_PIECES, process con (engine pool, Lazy SMP, root splitting) nhận
+# TABLEBASES.settings() khi khởi động và gọi configure_tablebases
+TABLEBASES = Tablebases()
+
+
+def configure_tablebases(directory: str = None, max_pieces: int = 0):
+    """Cấu hình TABLEBASES của process hiện tại (hàm module: dùng được làm initializer của process con)"""
+    TABLEBASES.configure(directory, max_pieces)
+
+
+# ============================================
+# GENERATOR
+# ============================================
+
+def generate(layout: Layout, tables: dict, log=print) -> bytearray:
+    """
+    Tạo bảng của bộ quân bằng phân tích ngược (các bộ quân nhỏ hơn được tạo trước, đệ quy)
+    
+    Args:
+        tables: tên bộ quân -> bảng đã tạo (được thêm vào)
+    
+    Returns:
+        Mảng 1 byte / vị trí (encode_value)
+    """
+    if layout.name in tables:
+        return tables[layout.name]
+    for red, black in layout.captures():
+        if not is_drawn(red, black):
+            generate(layout_for(red, black), tables, log)
+    
+    started = time.monotonic()
+    size = layout.size
+    pieces = layout.pieces
+    values = bytearray(size)
+    pending = bytearray(size)          # 1 = vị trí hợp lệ chưa có kết quả
+    remaining = array('H', bytes(2 * size))  # Số nước chưa được biết là dẫn tới vị trí thắng của đối phương
+    edge_from = array('I')             # Nước đi không ăn quân (trong cùng bộ quân): vị trí đi -> vị trí đến
+    edge_to = array('I')
+    resolved = {}  # khoảng cách -> [vị trí có kết quả ở khoảng cách đó]
+    captures = {}  # khoảng cách -> [(vị trí, nước ăn quân dẫn tới vị trí thua của đối phương?)]
+    
+    board = Board()
+    for number, squares in enumerate(itertools.product(*layout.domains)):
+        if len(set(squares)) < len(squares) or any(squares[i] >= squares[i + 1] for i in layout.same_pairs):
+            continue
+        board.grid = [[None] * 9 for _ in range(10)]
+        for (t, color), sq in zip(pieces, squares):
+            board.grid[sq // 9][sq % 9] = {'type': t, 'color': color}
+        owner = {sq: i for i, sq in enumerate(squares)}
+        
+        for turn in ('red', 'black'):
+            # Bên vừa đi không được để Tướng của mình bị chiếu (kể cả đối mặt tướng)
+            if board.is_in_check(OTHER_COLOR[turn]):
+                continue
+            index = number * 2 + (turn == 'black')
+            moves = board.legal_move_codes(turn)
+            if not moves:
+                if board.is_in_check(turn):
+                    values[index] = encode_value(LOSS, 0)
+                    resolved.setdefault(0, []).append(index)
+                continue
+            pending[index] = 1
+            remaining[index] = len(moves)
+            for move in moves:
+                from_sq, to_sq = divmod(move, 90)
+                moved = list(squares)
+                moved[owner[from_sq]] = to_sq
+                captured = owner.get(to_sq)
+                if captured is None:
+                    edge_from.append(index)
+                    edge_to.append(layout.index(moved, OTHER_COLOR[turn]))
+                    continue
+                rest = [(t, color, sq) for i, ((t, color), sq) in enumerate(zip(pieces, moved)) if i != captured]
+                sub_layout, sub_index = locate(rest, OTHER_COLOR[turn])
+                if sub_layout is None:
+                    continue
+                result, distance = decode_value(tables[sub_layout.name][sub_index])
+                if result != DRAW:
+                    captures.setdefault(distance, []).append((index, result == LOSS))
+    
+    # Danh sách vị trí đi tới mỗi vị trí (dạng CSR: preds[starts[i]:starts[i + 1]])
+    starts = array('I', bytes(4 * (size + 1)))
+    for child in edge_to:
+        starts[child + 1] += 1
+    for i in range(size):
+        starts[i + 1] += starts[i]
+    fill = array('I', starts)
+    preds = array('I', bytes(4 * len(edge_to)))
+    for parent, child in zip(edge_from, edge_to):
+        preds[fill[child]] = parent
+        fill[child] += 1
+    del edge_from, edge_to, fill
+    
+    # Lan ngược theo khoảng cách tăng dần: thắng = nước tới vị trí thua gần nhất,
+    # thua = mọi nước tới vị trí thắng, khoảng cách = nước tới vị trí thắng xa nhất
+    distance = 0
+    while resolved or captures:
+        events = captures.pop(distance, [])
+        for child in resolved.pop(distance, []):
+            child_loss = values[child] >= 128
+            events.extend((preds[k], child_loss) for k in range(starts[child], starts[child + 1]))
+        for parent, child_loss in events:
+            if not pending[parent]:
+                continue
+            if child_loss:
+                values[parent] = encode_value(WIN, distance + 1)
+            else:
+                remaining[parent] -= 1
+                if remaining[parent]:
+                    continue
+                values[parent] = encode_value(LOSS, distance + 1)
+            pending[parent] = 0
+            resolved.setdefault(distance + 1, []).append(parent)
+        distance += 1
+    
+    wins = sum(1 for v in values if 0 < v < 128)
+    losses = sum(1 for v in values if v >= 128)
+    log(f"{layout.name}: {size} vị trí, {wins} thắng, {losses} thua, xa nhất {distance - 1} ply,"
+        f" {time.monotonic() - started:.1f}s")
+    tables[layout.name] = values
+    return values
+
+
+def write_table(path: str, name: str, values: bytes, block_size: int = BLOCK_SIZE):
+    """Ghi bảng ra file (nén từng khối), qua file tạm rồi đổi tên"""
+    blocks = [zlib.compress(bytes(values[i:i + block_size]), 9) for i in range(0, len(values), block_size)]
+    offsets = [HEADER.size + 4 * (len(blocks) + 1)]
+    for data in blocks:
+        offsets.append(offsets[-1] + len(data))
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, name.encode('ascii'), len(values), block_size))
+        f.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        for data in blocks:
+            f.write(data)
+    os.replace(temp_path, path)
+
+
+def build(directory: str, names=DEFAULT_SIGNATURES, log=print):
+    """Tạo và ghi các bộ quân (kèm bộ quân nhỏ hơn) vào thư mục, trả về danh sách tên đã ghi"""
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    for name in names:
+        red, black, _ = canonical(*parse_name(name))
+        if is_drawn(red, black):
+            log(f"{name}: không bên nào chiếu được, luôn hòa")
+            continue
+        generate(layout_for(red, black), tables, log)
+    for name, values in tables.items():
+        write_table(os.path.join(directory, name + FILE_SUFFIX), name, values)
+    return sorted(tables)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    written = build(sys.argv[1], sys.argv[2:] or DEFAULT_SIGNATURES)
+    print(f"Đã ghi {len(written)} bộ quân vào {sys.argv[1]}: {', '.join(written)}")
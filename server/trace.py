@@ -0,0 +1,247 @@
+"""
+Ghi vết search (trace) để phân tích offline từng nước đi của AI
+
+Bật cho 1 lần search: ai.trace = SearchTrace('move.ndjson')
+Bật cho mọi nước của các level trong production: AI_TRACE_DIR=/path/traces (AI_TRACE_LEVELS=hard)
+
+File NDJSON, mỗi dòng 1 record:
+    {"t": "header", "fen", "moves", "level", "color", "settings"}   vị trí gốc + cấu hình
+    {"t": "root", "m", "d", "v", "n"}                                 mỗi nước ở root: nước, depth,
+                                                                      giá trị, số node cây con
+    {"t": "n", "p", "d", "m", "a", "b", "v", "r", "n"}                 mỗi node: ply, depth, nước dẫn
+                                                                      tới node, cửa sổ alpha/beta,
+                                                                      giá trị, lý do kết thúc, số node
+    {"t": "result", "move", "depth", "score", "stats", "dropped"}    kết quả + thống kê
+
+Kích thước giới hạn: chỉ ghi node có ply <= max_ply và tối đa max_records node
+(record root luôn được ghi nên số node theo cây con ở root vẫn chính xác)
+
+Lý do kết thúc node (r): tt, leaf, repetition, mate_distance, razor, terminal (hết nước),
+cutoff (cắt beta), all (không nước nào vượt alpha), pv (giá trị nằm trong cửa sổ)
+
+Tóm tắt 1 file trace:
+    python -m server.trace move.ndjson
+"""
+
+import json
+import math
+import os
+import sys
+import time
+from collections import defaultdict
+
+from server.board import decode_move
+
+# Thư mục ghi trace tự động cho mọi nước đi (rỗng = tắt)
+TRACE_DIR = os.environ.get('AI_TRACE_DIR', '')
+
+# Các level được ghi trace tự động
+TRACE_LEVELS = tuple(level.strip() for level in os.environ.get('AI_TRACE_LEVELS', 'hard').split(','))
+
+
+def _json_value(value):
+    """±inf không có trong JSON chuẩn, ghi thành null"""
+    if value is None or math.isinf(value):
+        return None
+    return value
+
+
+class SearchTrace:
+    """
+    Bộ ghi vết cho 1 lần search
+    
+    Args:
+        path: file NDJSON đầu ra
+        max_ply: chỉ ghi node có ply <= max_ply
+        max_records: số record node tối đa (các node sau đó chỉ được đếm vào 'dropped')
+    """
+    
+    def __init__(self, path: str, max_ply: int = 4, max_records: int = 50000):
+        self.path = path
+        self.max_ply = max_ply
+        self.max_records = max_records
+        self.records = []
+        self.node_records = 0
+        self.dropped = 0
+    
+    @classmethod
+    def for_level(cls, level: str):
+        """Trace tự động theo AI_TRACE_DIR / AI_TRACE_LEVELS, None nếu không bật"""
+        if not TRACE_DIR or level not in TRACE_LEVELS:
+            return None
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{level}.ndjson"
+        return cls(os.path.join(TRACE_DIR, name))
+    
+    def begin(self, ai, board, remaining_time: float = None):
+        """Ghi vị trí gốc và cấu hình search"""
+        fen, moves = board.serialize()
+        self.records.append({
+            't': 'header',
+            'fen': fen,
+            'moves': [list(move) for move in moves],
+            'level': ai.level,
+            'color': ai.color,
+            'settings': {
+                'max_depth': ai.depth_map.get(ai.level),
+                'time_limit': ai.time_limit.get(ai.level),
+                'remaining_time': remaining_time,
+                'lmr_params': ai.lmr_params.get(ai.level),
+                'late_move_counts': ai.late_move_counts.get(ai.level),
+                'node_limit': ai.timer.node_limit,
+                'futility_margins': ai.futility_margins.get(ai.level),
+                'razor_margins': ai.razor_margins.get(ai.level),
+                'max_ply': self.max_ply,
+                'max_records': self.max_records
+            }
+        })
+    
+    def attach(self, ai):
+        """
+        Thay ai._minimax bằng bản có ghi vết (chỉ trên instance này, gỡ bằng detach);
+        khi không trace, search không tốn thêm chi phí nào
+        """
+        inner = type(ai)._minimax
+        
+        def traced(board, depth, alpha, beta, maximizing, root_depth):
+            ply = len(board.hash_history) - ai._root_ply
+            if ply > self.max_ply:
+                return inner(ai, board, depth, alpha, beta, maximizing, root_depth)
+            
+            stats = ai.stats
+            nodes = ai.nodes_evaluated
+            counters = (stats.tt_hits, stats.leaf_nodes, stats.repetitions,
+                        stats.mate_distance_cuts, stats.razored)
+            value = inner(ai, board, depth, alpha, beta, maximizing, root_depth)
+            
+            if self.node_records >= self.max_records:
+                self.dropped += 1
+                return value
+            
+            subtree = ai.nodes_evaluated - nodes
+            if subtree == 1:
+                changed = [after - before for before, after in zip(counters, (
+                    stats.tt_hits, stats.leaf_nodes, stats.repetitions,
+                    stats.mate_distance_cuts, stats.razored))]
+                reasons = ('tt', 'leaf', 'repetition', 'mate_distance', 'razor')
+                reason = next((r for r, delta in zip(reasons, changed) if delta), 'terminal')
+            elif (value >= beta) if maximizing else (value <= alpha):
+                reason = 'cutoff'
+            elif (value <= alpha) if maximizing else (value >= beta):
+                reason = 'all'
+            else:
+                reason = 'pv'
+            
+            self.node_records += 1
+            self.records.append({
+                't': 'n',
+                'p': ply,
+                'd': depth,
+                'm': list(board.undo_stack[-1][:4]),
+                'a': _json_value(alpha),
+                'b': _json_value(beta),
+                'v': _json_value(value),
+                'r': reason,
+                'n': subtree
+            })
+            return value
+        
+        ai._minimax = traced
+        ai._tracer = self
+    
+    def detach(self, ai):
+        """Gỡ bản ghi vết khỏi ai"""
+        ai.__dict__.pop('_minimax', None)
+        ai._tracer = None
+    
+    def root(self, move: int, depth: int, value, nodes: int):
+        """Ghi kết quả 1 nước ở root (luôn ghi, không tính vào max_records)"""
+        self.records.append({
+            't': 'root',
+            'm': list(decode_move(move)),
+            'd': depth,
+            'v': _json_value(value),
+            'n': nodes
+        })
+    
+    def end(self, result):
+        """Ghi kết quả rồi xuất toàn bộ ra file"""
+        self.records.append({
+            't': 'result',
+            'move': list(decode_move(result.move)) if result.move is not None else None,
+            'depth': result.depth,
+            'score': _json_value(result.score),
+            'stats': result.stats.to_dict(),
+            'dropped': self.dropped
+        })
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for record in self.records:
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.records = []
+
+
+def summarize(path: str, out=sys.stdout):
+    """In tóm tắt 1 file trace: số node theo nước ở root, theo ply, theo lý do kết thúc"""
+    header = result = None
+    roots = defaultdict(lambda: {'nodes': 0, 'depth': 0, 'value': None})
+    by_ply = defaultdict(lambda: defaultdict(int))
+    by_reason = defaultdict(int)
+    
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            kind = record['t']
+            if kind == 'header':
+                header = record
+            elif kind == 'result':
+                result = record
+            elif kind == 'root':
+                entry = roots[tuple(record['m'])]
+                entry['nodes'] += record['n']
+                # Giá trị của depth sâu nhất
+                if record['d'] >= entry['depth']:
+                    entry['depth'] = record['d']
+                    entry['value'] = record['v']
+            elif kind == 'n':
+                by_ply[record['p']][record['r']] += 1
+                by_ply[record['p']]['nodes'] += 1
+                by_reason[record['r']] += 1
+    
+    if header:
+        print(f"Vị trí: {header['fen']} + {len(header['moves'])} nước", file=out)
+        print(f"Level {header['level']} ({header['color']}), {header['settings']}", file=out)
+    if result:
+        stats = result['stats']
+        print(f"Kết quả: {result['move']} depth {result['depth']} điểm {result['score']}, "
+              f"{stats['nodes']} nodes, {stats['elapsed']}s, ebf {stats['ebf']}, "
+              f"bỏ {result['dropped']} record", file=out)
+        print("\nTheo depth (Iterative Deepening):", file=out)
+        for it in stats['iterations']:
+            mark = '' if it['completed'] else ' (dừng giữa chừng)'
+            print(f"  depth {it['depth']:>2}: {it['nodes']:>9} nodes, {it['time']:>7.3f}s, "
+                  f"ebf {it['ebf']}{mark}", file=out)
+    
+    total = sum(entry['nodes'] for entry in roots.values()) or 1
+    print("\nTheo cây con ở root (mọi depth cộng lại):", file=out)
+    for move, entry in sorted(roots.items(), key=lambda item: -item[1]['nodes']):
+        print(f"  {list(move)}: {entry['nodes']:>9} nodes ({entry['nodes'] / total:6.1%}), "
+              f"depth {entry['depth']}, giá trị {entry['value']}", file=out)
+    
+    print("\nTheo ply (node đã ghi):", file=out)
+    for ply in sorted(by_ply):
+        counts = by_ply[ply]
+        detail = ', '.join(f"{reason} {count}" for reason, count in sorted(counts.items())
+                           if reason != 'nodes')
+        print(f"  ply {ply}: {counts['nodes']:>9} node - {detail}", file=out)
+    
+    print("\nTheo lý do kết thúc:", file=out)
+    for reason, count in sorted(by_reason.items(), key=lambda item: -item[1]):
+        print(f"  {reason}: {count}", file=out)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Cách dùng: python -m server.trace <file.ndjson> [...]")
+        sys.exit(1)
+    for trace_path in sys.argv[1:]:
+        summarize(trace_path)
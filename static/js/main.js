@@ -25,7 +25,9 @@ let gameState = {
     capturedByOpponent: [], // Quân ta bị đối phương ăn
     playerScore: 0,        // Điểm của người chơi
     opponentScore: 0,      // Điểm của đối thủ
-    aiThinking: false      // AI đang suy nghĩ (không đếm timer)
+    aiThinking: false,     // AI đang suy nghĩ (không đếm timer)
+    moveSeq: 0,            // seq của nước đi cuối cùng đã áp dụng (server đánh số từng nước)
+    pendingMoves: {}       // Nước đi tới sớm hơn thứ tự, chờ nước trước đó: seq -> data
 };
 
 // Timer state
@@ -303,6 +305,14 @@ function initSocket() {
     
     socket.on('game_state', (data) => {
         console.log('Received game state:', data);
+        if (data.seq !== undefined) {
+            // Trạng thái mới nhất từ server: các nước đi tới trước đó đã nằm trong board
+            gameState.moveSeq = data.seq;
+            gameState.pendingMoves = {};
+        }
+        if (data.ai_thinking !== undefined && GAME_DATA.gameType === 'pve') {
+            gameState.aiThinking = data.ai_thinking;
+        }
         if (data.board) {
             gameState.board = data.board.grid;
             gameState.turn = data.board.turn;
@@ -335,12 +345,18 @@ function initSocket() {
     
     socket.on('move_made', (data) => {
         console.log('Move made event received:', data);
-        handleOpponentMove(data);
+        applyMoveInOrder(data);
     });
     
     socket.on('move_error', (data) => {
         console.log('Move error:', data);
-        alert('Lỗi: ' + data.message);
+        if (data.code === 'ai_thinking') {
+            // Nước đi gửi khi AI chưa trả lời: bàn cờ không đổi, chỉ bỏ chọn quân
+            gameState.aiThinking = true;
+            addSystemMessage('AI đang suy nghĩ, vui lòng chờ');
+        } else {
+            alert('Lỗi: ' + data.message);
+        }
         // Deselect piece
         gameState.selectedPiece = null;
         gameState.validMoves = [];
@@ -1037,6 +1053,26 @@ function makeMove(fromRow, fromCol, toRow, toCol) {
     gameState.validMoves = [];
 }
 
+// Áp dụng move_made theo đúng seq của server: bỏ nước cũ / trùng, giữ lại nước tới sớm
+function applyMoveInOrder(data) {
+    if (data.seq === undefined) {
+        handleOpponentMove(data);
+        return;
+    }
+    if (data.seq <= gameState.moveSeq) {
+        console.log('Bỏ qua nước đi cũ, seq:', data.seq);
+        return;
+    }
+    
+    gameState.pendingMoves[data.seq] = data;
+    while (gameState.pendingMoves[gameState.moveSeq + 1]) {
+        const next = gameState.pendingMoves[gameState.moveSeq + 1];
+        delete gameState.pendingMoves[gameState.moveSeq + 1];
+        gameState.moveSeq += 1;
+        handleOpponentMove(next);
+    }
+}
+
 function handleOpponentMove(data) {
     console.log('handleOpponentMove called:', data);
     console.log('Current turn before:', gameState.turn);
@@ -1123,6 +1159,12 @@ function handleGameOver(data) {
         reasonText = ' (chiếu bí)';
     } else if (data.reason === 'resign') {
         reasonText = ' (đầu hàng)';
+    } else if (data.reason === 'perpetual_check') {
+        reasonText = ' (chiếu dai)';
+    } else if (data.reason === 'perpetual_chase') {
+        reasonText = ' (đuổi dai)';
+    } else if (data.reason === 'repetition') {
+        reasonText = ' (lặp lại nước đi)';
     }
     
     // Tạo HTML chi tiết điểm
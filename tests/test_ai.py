@@ -0,0 +1,114 @@
+"""Test ChessAI: bảng chuyển vị (chỉnh điểm chiếu hết theo ply), node budget tất định,
+history heuristic, MovePicker"""
+
+from server.ai import (HISTORY_MAX, MATE_SCORE, ChessAI, MovePicker, TranspositionTable, value_from_tt,
+                       value_to_tt)
+from server.board import Board, encode_move
+from server.opening_cache import OPENING_CACHE
+
+
+def test_mate_value_round_trip():
+    for value in (MATE_SCORE - 7, -(MATE_SCORE - 7), 1234, -1234, 0):
+        for ply in (0, 3, 10):
+            assert value_from_tt(value_to_tt(value, ply), ply) == value
+
+
+def test_mate_stored_relative_to_node():
+    # Chiếu hết sau 7 ply tính từ root, node ở ply 3 -> lưu "hết sau 4 ply" tính từ node
+    assert value_to_tt(MATE_SCORE - 7, 3) == MATE_SCORE - 4
+    assert value_to_tt(-(MATE_SCORE - 7), 3) == -(MATE_SCORE - 4)
+    assert value_to_tt(500, 3) == 500
+
+
+def test_tt_mate_score_follows_ply():
+    tt = TranspositionTable()
+    board = Board()
+    tt.store(board, 4, MATE_SCORE - 7, TranspositionTable.EXACT, ply=3)
+    # Cùng vị trí gặp lại ở ply 5: hết sau 4 ply từ node = 9 ply từ root
+    value, found = tt.lookup(board, 4, -MATE_SCORE, MATE_SCORE, ply=5)
+    assert found and value == MATE_SCORE - 9
+    value, found = tt.lookup(board, 4, -MATE_SCORE, MATE_SCORE, ply=1)
+    assert found and value == MATE_SCORE - 5
+    # Không đủ depth thì không dùng
+    assert tt.lookup(board, 5, -MATE_SCORE, MATE_SCORE, ply=1) == (None, False)
+
+
+def test_tt_bounds_respect_window():
+    tt = TranspositionTable()
+    board = Board()
+    tt.store(board, 2, 300, TranspositionTable.LOWER)
+    assert tt.lookup(board, 2, 0, 250) == (300, True)
+    assert tt.lookup(board, 2, 0, 400) == (None, False)
+    tt.store(board, 2, -300, TranspositionTable.UPPER)
+    assert tt.lookup(board, 2, -250, 0) == (-300, True)
+    assert tt.lookup(board, 2, -400, 0) == (None, False)
+
+
+def test_node_budget_ignores_level_time_limit(monkeypatch):
+    monkeypatch.setattr(OPENING_CACHE, 'max_plies', 0)
+    
+    def search():
+        ai = ChessAI(level='medium', color='red')
+        ai.verbose = False
+        ai.use_node_budget = True
+        ai.node_budget['medium'] = 3000
+        ai.time_limit['medium'] = 0.001  # Không được cắt search ở chế độ node budget
+        result = ai.search(Board())
+        return result.move, result.depth, ai.last_score, ai.nodes_evaluated
+    
+    first = search()
+    assert first[3] > 1000
+    assert search() == first
+
+
+def test_history_halved_in_place():
+    ai = ChessAI(level='medium', color='red')
+    history = ai.history
+    history[5] = 10
+    history[7] = HISTORY_MAX
+    ai._update_history(7, 3)
+    assert ai.history is history
+    assert history[5] == 5 and history[7] == (HISTORY_MAX + 9) >> 1
+    ai._age_tables()
+    assert ai.history is history and history[5] == 2
+
+
+PICKER_POSITIONS = [
+    Board().to_fen(),
+    # Giữa ván: có nước ăn được lời, ăn thiệt và ăn ngang
+    '3aka3/r2nC3n/5c2b/p1p1pC2p/2b1P4/2P5P/P4cP2/B8/7r1/RN1AKABNR w',
+    'r3k4/9/9/p8/9/R8/R8/9/9/3K5 w',
+]
+
+
+def test_move_picker_yields_every_legal_move_once():
+    for fen in PICKER_POSITIONS:
+        board = Board.from_fen(fen)
+        legal = board.legal_move_codes(board.turn)
+        ai = ChessAI(level='hard', color=board.turn)
+        for index in range(len(ai.history)):
+            ai.history[index] = index % 17
+        # Nước ưu tiên: hợp lệ, trùng nhau và không hợp lệ ở vị trí này
+        picker = MovePicker(board, legal, tt_move=legal[-1], killers=(legal[0], encode_move(0, 0, 9, 8)),
+                            counter=legal[0], history=ai.history)
+        picked = list(picker)
+        assert sorted(picked) == sorted(legal)
+        assert picked[0] == legal[-1]
+
+
+def test_move_picker_orders_good_captures_before_quiets():
+    board = Board.from_fen('r3k4/9/9/p8/9/R8/R8/9/9/3K5 w')
+    picked = list(MovePicker(board, board.legal_move_codes('red'), history=[0] * (14 * 90)))
+    # Xe ăn Tốt (có Xe thứ hai yểm trợ) xếp đầu tiên
+    assert picked[0] == encode_move(5, 0, 3, 0)
+
+
+def test_fallback_move_keeps_legal_move_and_replaces_missing_one():
+    board = Board()
+    board.move(6, 0, 5, 0)  # Lượt đen
+    ai = ChessAI('hard', 'black')
+    legal = board.legal_move_codes('black')
+    assert ai.fallback_move(board, legal[3]) == legal[3]
+    # Search không tìm được nước / nước không hợp lệ: đi nước hợp lệ đầu tiên
+    assert ai.fallback_move(board, None) == legal[0]
+    assert ai.fallback_move(board, encode_move(0, 0, 9, 0)) == legal[0]
@@ -0,0 +1,77 @@
+"""Test AIManager: tổng bộ nhớ đã cấp, chia lại ngân sách chỉ khi vượt, bỏ engine dùng lâu nhất"""
+
+from server.ai_manager import ENGINE_BASE_BYTES, TT_ENTRY_BYTES, AIManager
+
+
+def reserved(manager):
+    return sum(ENGINE_BASE_BYTES + entry[0].tt.max_size * TT_ENTRY_BYTES for entry in manager.engines.values())
+
+
+def make_manager(engines_at_max: int):
+    return AIManager(memory_budget=engines_at_max * (ENGINE_BASE_BYTES + 1000 * TT_ENTRY_BYTES),
+                     max_tt_entries=1000, min_tt_entries=100)
+
+
+def test_no_rebalance_within_budget():
+    manager = make_manager(3)
+    for game_id in range(3):
+        manager.get_ai(game_id)
+    for _ in range(10):
+        manager.get_ai(1)
+    assert manager.rebalances == 0
+    assert manager.reserved == reserved(manager) <= manager.memory_budget
+
+
+def test_over_budget_shrinks_then_regrows():
+    manager = make_manager(3)
+    for game_id in range(4):
+        manager.get_ai(game_id)
+    assert manager.rebalances == 1
+    assert all(entry[0].tt.max_size < 1000 for entry in manager.engines.values())
+    assert manager.reserved == reserved(manager) <= manager.memory_budget
+    
+    # Bỏ 2 engine: engine còn lại được nới lại khi dùng, không cần chia lại cả bảng
+    manager.remove_ai(0)
+    manager.remove_ai(1)
+    assert manager.get_ai(2).tt.max_size == 1000
+    assert manager.rebalances == 1
+    assert manager.reserved == reserved(manager)
+
+
+def test_evicts_least_recently_used_when_min_does_not_fit():
+    manager = AIManager(memory_budget=2 * (ENGINE_BASE_BYTES + 100 * TT_ENTRY_BYTES),
+                        max_tt_entries=1000, min_tt_entries=100)
+    first = manager.get_ai('g1')
+    manager.get_ai('g2')
+    manager.get_ai('g1')
+    manager.get_ai('g3')
+    assert set(key[0] for key in manager.engines) == {'g1', 'g3'}
+    assert manager.get_ai('g1') is first
+    assert manager.evictions == 1
+    assert manager.reserved == reserved(manager) <= manager.memory_budget
+
+
+def test_level_change_replaces_engine():
+    manager = make_manager(3)
+    medium = manager.get_ai('g1', 'medium')
+    hard = manager.get_ai('g1', 'hard')
+    assert hard is not medium and len(manager.engines) == 1
+    assert manager.reserved == reserved(manager)
+
+
+def test_worker_engines_share_the_budget():
+    manager = make_manager(4)
+    for game_id in range(4):
+        manager.get_ai(game_id)
+    assert manager.rebalances == 0
+    
+    # Engine pool lấy nửa ngân sách cho 2 engine trong worker: engine của process web bị thu nhỏ
+    assert manager.reserve_workers(2, share=0.5) == 1000
+    assert manager.worker_reserved == 2 * (ENGINE_BASE_BYTES + 1000 * TT_ENTRY_BYTES)
+    assert manager.rebalances == 1
+    assert manager.reserved == reserved(manager) <= manager.memory_budget - manager.worker_reserved
+    assert manager.memory()['worker_reserved_bytes'] == manager.worker_reserved
+    
+    # Nhiều engine trong worker hơn: mỗi engine được ít entry hơn, không dưới min_tt_entries
+    assert manager.reserve_workers(8, share=0.5) < 1000
+    assert manager.reserve_workers(1000, share=0.5) == 100
@@ -0,0 +1,178 @@
+"""Test Board: mã hóa nước đi, Zobrist key + make/unmake, phân xử lặp lại vị trí, SEE, FEN"""
+
+import pytest
+
+from server.board import Board, decode_move, encode_move, mirror_move
+
+
+def play(board, moves):
+    for move in moves:
+        board.make_move(*move)
+
+
+def test_make_unmake_restores_key_and_material():
+    board = Board()
+    key, material, count = board.zobrist_key, board.material, board.piece_count
+    moves = [(7, 1, 7, 4), (0, 1, 2, 2), (7, 4, 3, 4), (2, 2, 3, 4)]  # có nước ăn quân
+    play(board, moves)
+    assert board._piece_key == board.compute_piece_key()
+    assert board.material == board.compute_material()
+    assert board.piece_count == count - 2
+    assert len(board.hash_history) == len(moves) + 1
+    for _ in moves:
+        board.unmake_move()
+    assert (board.zobrist_key, board.material, board.piece_count) == (key, material, count)
+    assert board.hash_history == [key]
+
+
+def test_key_depends_on_side_to_move():
+    board = Board()
+    key = board.zobrist_key
+    board.pass_turn()
+    assert board.turn == 'black'
+    assert board.zobrist_key != key
+    assert board.hash_history == [key, board.zobrist_key]
+    board.unmake_move()
+    assert board.turn == 'red' and board.zobrist_key == key
+
+
+def test_pass_turn_is_repetition_boundary():
+    board = Board.from_fen('4k4/9/9/9/9/R8/9/9/9/3K5 w')
+    play(board, [(5, 0, 5, 1), (0, 4, 0, 5)])
+    board.pass_turn()
+    assert board.find_repetitions() == []
+    assert board.serialize()[1] == []
+
+
+def test_perpetual_check_loses():
+    board = Board.from_fen('4k4/9/9/9/9/R8/9/9/9/3K5 w')
+    play(board, [(5, 0, 5, 4), (0, 4, 0, 5)])
+    cycle = [(5, 4, 5, 5), (0, 5, 0, 4), (5, 5, 5, 4), (0, 4, 0, 5)]
+    play(board, cycle)
+    play(board, cycle)
+    repeats = board.find_repetitions()
+    assert repeats == [6, 2]
+    assert board.repetition_loser(repeats[0]) == 'red'
+    assert board.get_game_state() == 'black_wins'
+    assert board.end_reason == 'perpetual_check'
+
+
+def test_idle_repetition_is_draw():
+    board = Board.from_fen('4k4/9/9/9/9/R8/9/9/9/3K5 w')
+    cycle = [(5, 0, 5, 1), (0, 4, 0, 5), (5, 1, 5, 0), (0, 5, 0, 4)]
+    play(board, cycle)
+    play(board, cycle)
+    repeats = board.find_repetitions()
+    assert repeats == [4, 0]
+    assert board.repetition_loser(repeats[0]) is None
+    assert board.get_game_state() == 'draw'
+    assert board.end_reason == 'repetition'
+
+
+def test_see_known_exchanges():
+    # Xe ăn Tốt không được bảo vệ / được Xe bảo vệ / có Xe thứ hai phía sau (x-ray)
+    assert Board.from_fen('4k4/9/9/p8/9/R8/9/9/9/3K5 w').see(5, 0, 3, 0) == 100
+    assert Board.from_fen('r3k4/9/9/p8/9/R8/9/9/9/3K5 w').see(5, 0, 3, 0) == -800
+    assert Board.from_fen('r3k4/9/9/p8/9/R8/R8/9/9/3K5 w').see(5, 0, 3, 0) == 100
+    # Pháo (qua ngòi) ăn Xe, Tốt ăn lại Pháo
+    assert Board.from_fen('4k4/9/1r7/9/9/1P7/9/1C7/9/3K5 w').see(7, 1, 2, 1) == 900
+    assert Board.from_fen('4k4/1p7/1r7/9/9/1P7/9/1C7/9/3K5 w').see(7, 1, 2, 1) == 450
+
+
+def test_see_leaves_grid_untouched():
+    board = Board.from_fen('r3k4/9/9/p8/9/R8/R8/9/9/3K5 w')
+    fen = board.to_fen()
+    board.see(5, 0, 3, 0)
+    assert board.to_fen() == fen
+
+
+def test_fen_round_trip_both_sides():
+    start = Board()
+    assert Board.from_fen(start.to_fen()).to_fen() == start.to_fen()
+    start.make_move(7, 1, 7, 4)
+    fen = start.to_fen()
+    assert fen.endswith(' b')
+    board = Board.from_fen(fen)
+    assert board.turn == 'black'
+    assert board.to_fen() == fen
+    assert board.zobrist_key == start.zobrist_key
+
+
+def test_from_fen_full_fen_fields():
+    placement = Board().to_fen().split()[0]
+    assert Board.from_fen(f'{placement} b - - 0 1').turn == 'black'
+    assert Board.from_fen(f'{placement} w - - 0 1').turn == 'red'
+    assert Board.from_fen(placement).turn == 'red'
+    with pytest.raises(ValueError):
+        Board.from_fen(f'{placement} x')
+    with pytest.raises(ValueError):
+        Board.from_fen('')
+
+
+def test_move_encode_decode_round_trip():
+    for move in range(90 * 90):
+        assert encode_move(*decode_move(move)) == move
+    assert encode_move(7, 1, 7, 4) == (7 * 9 + 1) * 90 + 7 * 9 + 4
+    assert decode_move(encode_move(9, 8, 0, 0)) == (9, 8, 0, 0)
+
+
+def test_mirror_move():
+    assert decode_move(mirror_move(encode_move(7, 1, 7, 4))) == (7, 7, 7, 4)
+    assert decode_move(mirror_move(encode_move(9, 4, 8, 4))) == (9, 4, 8, 4)
+    for move in range(90 * 90):
+        assert mirror_move(mirror_move(move)) == move
+    # Vị trí đầu tự đối xứng: tập nước hợp lệ không đổi khi lật
+    moves = Board().legal_move_codes('red')
+    assert sorted(mirror_move(move) for move in moves) == sorted(moves)
+
+
+def test_mirror_key_matches_mirrored_position():
+    board = Board.from_fen('4k4/9/9/p8/9/R8/9/9/9/3K5 w')
+    mirrored = Board.from_fen('4k4/9/9/8p/9/8R/9/9/9/5K3 w')
+    assert board.mirror_zobrist_key() == mirrored.zobrist_key
+
+
+def test_ply_survives_serialize_and_dict():
+    board = Board()
+    moves = [(7, 1, 7, 4), (0, 1, 2, 2), (7, 4, 3, 4), (2, 2, 3, 4), (9, 1, 7, 2)]  # có nước ăn quân
+    play(board, moves)
+    board.pass_turn()
+    assert board.ply == 6
+    fen, tail = board.serialize()
+    assert len(tail) == 0  # Mất lượt cắt chuỗi nước: chỉ còn FEN
+    restored = Board.from_fen(fen, tail)
+    assert (restored.ply, restored.turn, restored.zobrist_key) == (6, board.turn, board.zobrist_key)
+    board.unmake_move()
+    fen, tail = board.serialize()
+    assert len(tail) == 1 and Board.from_fen(fen, tail).ply == 5
+    
+    loaded = Board()
+    loaded.from_dict(board.to_dict())
+    assert loaded.ply == 5
+    board.unmake_move()
+    assert board.ply == 4
+
+
+def test_undo_move_undoes_move_across_pass():
+    board = Board()
+    key = board.zobrist_key
+    assert board.move(7, 1, 7, 4)[0]
+    board.pass_turn()
+    assert board.turn == 'red'
+    assert board.undo_move()
+    assert (board.turn, board.zobrist_key, board.ply) == ('red', key, 0)
+    assert board.grid[7][1] and not board.grid[7][4]
+    assert not board.undo_stack and board.hash_history == [key]
+
+
+@pytest.mark.parametrize('fen', [
+    '4k4/9/9/9/9/9/9/9/3K5 w',               # 9 hàng
+    '4k4/9/9/9/9/9/9/9/9/3K6 w',             # hàng dài hơn 9 cột
+    '4k4/9/9/9/9/9/9/9/9/3K4 w',             # hàng thiếu cột
+    '4x4/9/9/9/9/9/9/9/9/3K5 w',             # quân không có
+    '4k4/9/9/9/9/9/9/9/9/3K5 w - - 0 abc',   # số nước không phải số
+    None,
+])
+def test_from_fen_rejects_malformed(fen):
+    with pytest.raises(ValueError):
+        Board.from_fen(fen)
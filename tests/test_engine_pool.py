@@ -0,0 +1,39 @@
+"""Test EnginePool: search trong worker process"""
+
+import pytest
+
+from server.ai import ChessAI
+from server.board import Board
+from server.engine_pool import EnginePool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # Worker (spawn) đọc cấu hình Lazy SMP / root splitting từ môi trường khi import server.ai
+    monkeypatch.setenv('AI_SMP_HELPERS', '2')
+    monkeypatch.setenv('AI_ROOT_SPLIT_WORKERS', '2')
+    pool = EnginePool(1, tt_entries=500)
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_search_with_parallel_search_configured(pool):
+    board = Board()
+    for level in ('medium', 'hard'):
+        ai = ChessAI(level=level, color='red')
+        ai.time_limit[level] = 0.5
+        move = pool.choose_move('g1', ai, board)
+        assert move is not None, 'worker search lỗi, bên gọi phải tự search tại chỗ'
+        assert move in board.legal_move_codes('red')
+    assert pool.failed == 0 and pool.completed == 2
+
+
+def test_worker_engines_use_tt_share_and_report_memory(pool):
+    ai = ChessAI(level='hard', color='red')
+    ai.time_limit['hard'] = 0.5
+    assert pool.choose_move('g1', ai, Board()) is not None
+    pool.check_health()  # Pong mang theo bộ nhớ của worker
+    memory = pool.memory()
+    assert memory['engines'] == 1 and memory['tt_capacity'] == 500
+    assert 0 < memory['tt_entries'] <= 500
+    assert memory['estimated_bytes'] < memory['reserved_bytes']
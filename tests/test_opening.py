@@ -0,0 +1,96 @@
+"""Test opening cache (giới hạn theo ply thật của ván) và opening book (build / tra, đối xứng trái-phải)"""
+
+import random
+
+from server.board import Board, encode_move
+from server.opening_book import OpeningBook, build, canonical_key
+from server.opening_cache import OpeningCache
+
+
+def test_cache_uses_game_ply_not_hash_history():
+    cache = OpeningCache(max_plies=4)
+    board = Board()
+    for move in [(7, 1, 7, 4), (0, 1, 2, 2), (9, 1, 7, 2), (0, 7, 2, 6)]:
+        board.make_move(*move)
+    move = encode_move(9, 0, 9, 1)
+    cache.store(board, 'hard', move, 10, 3)
+    assert not cache.entries
+    
+    # Bàn cờ dựng lại (serialize -> from_fen) vẫn biết đã qua 4 nước
+    restored = Board.from_fen(*board.serialize())
+    cache.store(restored, 'hard', move, 10, 3)
+    assert not cache.entries and cache.probe(restored, 'hard') is None
+    
+    restored.unmake_move()
+    cache.store(restored, 'hard', move, 10, 3)
+    assert cache.probe(restored, 'hard') == (move, 10, 3)
+
+
+def game(winner, moves, red='Alice', black='Bob'):
+    rows = []
+    for index, (fr, fc, tr, tc) in enumerate(moves):
+        rows.append({'player': 'red' if index % 2 == 0 else 'black',
+                     'from_row': fr, 'from_col': fc, 'to_row': tr, 'to_col': tc})
+    return {'winner': winner, 'red_player_name': red, 'black_player_name': black}, rows
+
+
+GAMES = [
+    game('red', [(7, 1, 7, 4), (0, 1, 2, 2)]),
+    game('red', [(7, 7, 7, 4), (0, 7, 2, 6)]),   # Ảnh gương của ván trên
+    game('draw', [(7, 1, 7, 4), (0, 7, 2, 6)]),
+    game('black', [(9, 1, 7, 2), (0, 1, 2, 2)], red='AI (easy)'),  # Nước của AI easy không tính
+]
+
+
+def played(*moves):
+    board = Board()
+    for move in moves:
+        board.make_move(*move)
+    return board
+
+
+def open_book(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    assert build(path, GAMES, max_plies=10, min_games=1) == 4
+    book = OpeningBook()
+    book.open(path)
+    return book
+
+
+def test_book_merges_mirrored_positions(tmp_path):
+    book = open_book(tmp_path)
+    
+    # Vị trí đầu tự đối xứng: Pháo đầu trái / phải là 1 record, 3 ván (2 thắng, 1 hòa)
+    key, mirrored, symmetric = canonical_key(Board())
+    assert symmetric and not mirrored
+    assert [entry[1:] for entry in book.lookup(key)] == [(2, 1, 0)]
+    
+    # Sau Pháo đầu trái hoặc phải: cùng key, nước lưu theo hướng của key
+    left, right = played((7, 1, 7, 4)), played((7, 7, 7, 4))
+    assert canonical_key(left)[0] == canonical_key(right)[0]
+    assert book.lookup(canonical_key(left)[0]) == [(encode_move(0, 1, 2, 2), 0, 1, 0),
+                                                   (encode_move(0, 7, 2, 6), 0, 0, 2)]
+    
+    # Nước của AI easy (bên Đỏ) không tính, nước của người chơi cùng ván vẫn tính
+    assert book.lookup(canonical_key(played((9, 1, 7, 2)))[0]) == [(encode_move(0, 1, 2, 2), 1, 0, 0)]
+
+
+def test_book_choose_flips_moves_for_mirrored_position(tmp_path):
+    book = open_book(tmp_path)
+    rng = random.Random(1)
+    for board, expected in [(played((7, 1, 7, 4)), encode_move(0, 1, 2, 2)),
+                            (played((7, 7, 7, 4)), encode_move(0, 7, 2, 6))]:
+        legal = board.legal_move_codes(board.turn)
+        assert book.choose(board, legal, variety=0, min_games=2, rng=rng) == expected
+    
+    # Vị trí tự đối xứng: chọn ngẫu nhiên 1 trong 2 hướng
+    legal = Board().legal_move_codes('red')
+    chosen = {book.choose(Board(), legal, rng=rng) for _ in range(40)}
+    assert chosen == {encode_move(7, 1, 7, 4), encode_move(7, 7, 7, 4)}
+
+
+def test_book_respects_max_plies(tmp_path):
+    book = open_book(tmp_path)
+    board = played((7, 1, 7, 4))
+    board.ply = 10
+    assert book.choose(board, board.legal_move_codes(board.turn), variety=0) is None
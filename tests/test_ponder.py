@@ -0,0 +1,112 @@
+"""Test Ponderer: ponder hit / miss và hủy search nền trong lúc chờ kết quả ponder hit"""
+
+import threading
+import time
+
+import pytest
+
+from server.ai import CancelToken
+from server.board import Board, encode_move
+from server.ponder import Ponderer
+
+PREDICTED = encode_move(7, 1, 7, 4)
+REPLY = encode_move(0, 1, 2, 2)
+
+
+class FakeAI:
+    """ChessAI giả: ponder chạy tới khi start_timer() (ponder hit) hoặc stop_check() báo dừng"""
+    
+    level = 'hard'
+    color = 'black'
+    use_node_budget = False
+    
+    def __init__(self):
+        self.stop_check = None
+        self.yield_hook = None
+        self.timed = False
+    
+    def predict_reply(self, board):
+        return PREDICTED
+    
+    def start_timer(self):
+        self.timed = True
+    
+    def ponder(self, board):
+        stop_check = self.stop_check
+        while not self.timed and not stop_check():
+            time.sleep(0.001)
+        return REPLY, 3
+
+
+def spawn(target, *args):
+    threading.Thread(target=target, args=args, daemon=True).start()
+
+
+@pytest.fixture
+def ponderer():
+    return Ponderer(spawn=spawn, sleep=time.sleep)
+
+
+def test_ponder_hit_returns_background_result(ponderer):
+    assert ponderer.start('g1', FakeAI(), Board())
+    assert ponderer.finish('g1', PREDICTED) == REPLY
+    assert ponderer.hits == 1 and not ponderer.sessions
+
+
+def test_ponder_miss_stops_search(ponderer):
+    assert ponderer.start('g1', FakeAI(), Board())
+    assert ponderer.finish('g1', encode_move(9, 1, 7, 2)) is None
+    assert ponderer.misses == 1 and ponderer.active == 0
+
+
+def test_cancel_stops_ponder_hit_wait(ponderer):
+    ai = FakeAI()
+    ai.start_timer = lambda: None  # Search nền chỉ dừng khi bị hủy
+    assert ponderer.start('g1', ai, Board())
+    threading.Timer(0.05, ponderer.cancel, args=('g1',)).start()
+    assert ponderer.finish('g1', PREDICTED) is None
+    assert not ponderer.sessions and ponderer.active == 0
+
+
+def test_cancel_token_stops_ponder_hit_wait(ponderer):
+    ai = FakeAI()
+    ai.start_timer = lambda: None
+    token = CancelToken()
+    assert ponderer.start('g1', ai, Board())
+    threading.Timer(0.05, token.cancel, args=('game_over',)).start()
+    assert ponderer.finish('g1', PREDICTED, token) is None
+    assert not ponderer.sessions
+
+
+def test_cancelled_session_stays_until_search_exits(ponderer):
+    ai = FakeAI()
+    ai.start_timer = lambda: None
+    assert ponderer.start('g1', ai, Board())
+    ponderer.cancel('g1')
+    # Lượt kế tiếp chờ search nền cũ thoát trước khi dùng lại AI
+    assert ponderer.finish('g1', None) is None
+    assert not ponderer.sessions and ponderer.active == 0
+    assert ai.stop_check is None and ponderer.misses == 0
+
+
+def test_ponder_exit_keeps_hooks_of_new_search(ponderer):
+    ai = FakeAI()
+    ai.start_timer = lambda: None
+    assert ponderer.start('g1', ai, Board())
+    ponderer.cancel('g1')
+    new_hook = ai.stop_check = lambda: False  # Search mới gắn hook trước khi ponder thoát
+    deadline = time.monotonic() + 2
+    while ponderer.sessions and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert not ponderer.sessions
+    assert ai.stop_check is new_hook
+
+
+def test_cancel_after_search_finished_releases_session(ponderer):
+    ai = FakeAI()
+    ai.timed = True  # Search nền xong ngay
+    assert ponderer.start('g1', ai, Board())
+    while ponderer.active:
+        time.sleep(0.001)
+    ponderer.cancel('g1')
+    assert not ponderer.sessions
@@ -0,0 +1,98 @@
+"""Test AIScheduler: thứ tự ưu tiên, giới hạn theo level, chế độ hạ cấp, hủy job"""
+
+from server.ai import CancelToken
+from server.board import Board
+from server.scheduler import AIScheduler
+
+
+def midgame_board():
+    board = Board()
+    for move in [(9, 1, 7, 2), (0, 1, 2, 2), (9, 7, 7, 6), (0, 7, 2, 6), (6, 2, 5, 2),
+                 (3, 2, 4, 2), (6, 6, 5, 6), (3, 6, 4, 6), (9, 0, 9, 1), (0, 0, 0, 1)]:
+        assert board.move(*move)[0]
+    return board
+
+
+def take_next(scheduler):
+    job = scheduler._next_job()
+    scheduler.queue.remove(job)
+    return job
+
+
+def test_priority_order():
+    scheduler = AIScheduler(max_running=1)
+    hard = scheduler._submit('g1', 'hard', midgame_board())
+    analysis = scheduler._submit(None, 'analysis', Board())
+    hard_opening = scheduler._submit('g2', 'hard', Board())
+    medium = scheduler._submit('g3', 'medium', midgame_board())
+    easy = scheduler._submit('g4', 'easy', midgame_board())
+    easy_later = scheduler._submit('g5', 'easy', midgame_board())
+    order = [take_next(scheduler) for _ in range(6)]
+    assert order == [easy, easy_later, medium, hard_opening, hard, analysis]
+
+
+def test_level_limit_skips_full_level():
+    scheduler = AIScheduler(max_running=4, level_limits={'easy': 1})
+    scheduler._submit('g1', 'easy', Board())
+    hard = scheduler._submit('g2', 'hard', Board())
+    scheduler.running['easy'] = 1
+    assert scheduler._next_job() is hard
+    scheduler.running['hard'] = 3
+    assert scheduler._next_job() is None
+
+
+def test_runs_normal_search_without_node_limit():
+    scheduler = AIScheduler(sleep=lambda _: None)
+    assert scheduler.run('g1', 'hard', Board(), lambda node_limit: node_limit) is None
+    snapshot = scheduler.snapshot()
+    assert snapshot['completed'] == 1 and snapshot['running'] == 0
+
+
+def test_degrades_when_queue_full():
+    scheduler = AIScheduler(sleep=lambda _: None, max_queue=0, degraded_nodes=123)
+    assert scheduler.run('g1', 'hard', Board(), lambda node_limit: node_limit) == 123
+    assert scheduler.snapshot()['degraded'] == {'queue_full': 1, 'deadline': 0}
+
+
+def test_degrades_after_deadline():
+    scheduler = AIScheduler(sleep=lambda _: None, max_running=1, max_wait=0, degraded_nodes=50)
+    scheduler.running['hard'] = 1  # Search khác đang chiếm chỗ
+    assert scheduler.run('g1', 'medium', Board(), lambda node_limit: node_limit) == 50
+    assert scheduler.snapshot()['degraded'] == {'queue_full': 0, 'deadline': 1}
+    assert not scheduler.queue
+
+
+def test_cancelled_job_leaves_queue():
+    token = CancelToken()
+    scheduler = AIScheduler(sleep=lambda _: token.cancel('game_over'), max_running=1)
+    scheduler.running['hard'] = 1
+    assert scheduler.run('g1', 'hard', Board(), lambda node_limit: 'searched', token) is None
+    assert not scheduler.queue and scheduler.snapshot()['cancelled'] == 1
+
+
+def test_opening_bonus_uses_game_ply():
+    scheduler = AIScheduler()
+    resumed = Board.from_fen(Board().to_fen() + ' - - 0 20')  # Ván dựng lại: move_history rỗng
+    assert scheduler.priority('hard', resumed) == AIScheduler.LEVEL_PRIORITY['hard']
+    assert scheduler.priority('hard', Board()) == AIScheduler.LEVEL_PRIORITY['hard'] - AIScheduler.OPENING_BONUS
+    assert scheduler.priority('analysis', Board()) == AIScheduler.LEVEL_PRIORITY['analysis']
+
+
+def test_degraded_searches_are_capped():
+    token = CancelToken()
+    scheduler = AIScheduler(sleep=lambda _: token.cancel('game_over'), max_queue=0, max_degraded=1)
+    scheduler.running_degraded = 1  # Slot hạ cấp duy nhất đang bận
+    assert scheduler.run('g1', 'hard', Board(), lambda node_limit: 'searched', token) is None
+    assert scheduler.running_degraded == 1 and scheduler.snapshot()['cancelled'] == 1
+
+
+def test_degraded_search_waits_for_free_slot():
+    scheduler = AIScheduler(max_queue=0, max_degraded=1, degraded_nodes=77)
+    scheduler.running_degraded = 1
+    
+    def sleep(_):
+        scheduler.running_degraded = 0  # Search hạ cấp khác vừa xong
+    
+    scheduler.sleep = sleep
+    assert scheduler.run('g1', 'hard', Board(), lambda node_limit: node_limit) == 77
+    assert scheduler.running_degraded == 0
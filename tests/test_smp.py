@@ -0,0 +1,58 @@
+"""Test SharedTranspositionTable: đóng gói / giải nén entry trong shared memory"""
+
+import pytest
+
+from server.ai import MATE_SCORE, TranspositionTable
+from server.board import Board, encode_move
+from server.smp import SharedTranspositionTable
+
+
+@pytest.fixture
+def table():
+    tt = SharedTranspositionTable(1024)
+    yield tt
+    tt.close()
+
+
+def test_store_lookup_round_trip(table):
+    board = Board()
+    move = encode_move(7, 1, 7, 4)
+    table.store(board, 5, -123, TranspositionTable.EXACT, move)
+    assert table.lookup(board, 5, -1000, 1000) == (-123, True)
+    assert table.lookup(board, 4, -1000, 1000) == (-123, True)
+    assert table.lookup(board, 6, -1000, 1000) == (None, False)  # depth không đủ
+    assert table.probe_move(board) == move
+
+
+def test_bounds(table):
+    board = Board()
+    table.store(board, 3, 50, TranspositionTable.LOWER)
+    assert table.lookup(board, 3, 0, 40) == (50, True)
+    assert table.lookup(board, 3, 0, 60) == (None, False)
+    table.store(board, 3, 50, TranspositionTable.UPPER)
+    assert table.lookup(board, 3, 60, 100) == (50, True)
+    assert table.lookup(board, 3, 40, 100) == (None, False)
+
+
+def test_move_kept_when_storing_without_move(table):
+    board = Board()
+    move = encode_move(9, 1, 7, 2)
+    table.store(board, 2, 10, TranspositionTable.EXACT, move)
+    table.store(board, 3, 20, TranspositionTable.EXACT)
+    assert table.probe_move(board) == move
+    assert table.lookup(board, 3, -100, 100) == (20, True)
+
+
+def test_mate_score_adjusted_by_ply(table):
+    board = Board()
+    # Chiếu hết ở ply 7 tính từ root, lưu tại node ở ply 3 -> đọc lại ở ply 5
+    table.store(board, 4, MATE_SCORE - 7, TranspositionTable.EXACT, ply=3)
+    assert table.lookup(board, 4, -MATE_SCORE, MATE_SCORE, ply=5) == (MATE_SCORE - 9, True)
+
+
+def test_other_position_misses(table):
+    board = Board()
+    table.store(board, 3, 10, TranspositionTable.EXACT, encode_move(7, 1, 7, 4))
+    board.make_move(7, 1, 7, 4)
+    assert table.lookup(board, 0, -100, 100) == (None, False)
+    assert table.probe_move(board) is None
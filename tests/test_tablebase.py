@@ -0,0 +1,47 @@
+"""Test tablebase: tạo KRvK vào thư mục tạm, tra theo cả 2 hướng (bên mạnh là Đỏ / Đen)"""
+
+import pytest
+
+from server.board import MOVE_COORDS, Board
+from server.tablebase import DRAW, LOSS, WIN, Tablebases, build
+
+
+@pytest.fixture(scope='module')
+def tables(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('tablebase'))
+    assert build(directory, ['KRvK'], log=lambda *args: None) == ['KRvK']
+    return Tablebases(directory)
+
+
+def probe(tables, fen):
+    return tables.probe(Board.from_fen(fen))
+
+
+def test_krvk_both_orientations(tables):
+    # Đỏ có Xe, và ảnh lật dọc (Đen có Xe, đổi lượt đi): cùng kết quả
+    assert probe(tables, '4k4/9/9/9/9/9/9/9/9/R2K5 w') == (WIN, 7)
+    assert probe(tables, 'r2k5/9/9/9/9/9/9/9/9/4K4 b') == (WIN, 7)
+    assert probe(tables, '4k4/9/9/9/9/9/9/9/9/R2K5 b') == (LOSS, 8)
+    assert probe(tables, 'r2k5/9/9/9/9/9/9/9/9/4K4 w') == (LOSS, 8)
+
+
+def test_krvk_win_has_move_to_shorter_loss(tables):
+    for fen in ('4k4/9/9/9/9/9/9/9/9/R2K5 w', 'r2k5/9/9/9/9/9/9/9/9/4K4 b'):
+        board = Board.from_fen(fen)
+        result, distance = tables.probe(board)
+        children = []
+        for move in board.legal_move_codes(board.turn):
+            board.make_move(*MOVE_COORDS[move])
+            children.append(tables.probe(board))
+            board.unmake_move()
+        assert (LOSS, distance - 1) in children
+        assert all(child[0] != WIN for child in children)
+
+
+def test_bare_kings_draw_without_file(tables):
+    assert probe(tables, '3k5/9/9/9/9/9/9/9/9/4K4 w') == (DRAW, 0)
+
+
+def test_missing_signature_and_piece_limit(tables):
+    assert probe(tables, '4k4/9/9/9/9/9/9/9/9/N2K5 w') is None  # Chưa tạo KNvK
+    assert probe(tables, '4k4/4a4/9/9/9/9/9/9/9/R2K5 w') is None  # 4 quân > bảng lớn nhất